@@ -0,0 +1,70 @@
+import ast
+import json
+import queue
+from typing import Any, List
+
+from any_agent.callbacks import Callback, Context
+
+from source.agent_plans import photo_paths
+from source.agentic_machine import get_photo_from_street_view
+from source.the_machine.api.geocache import track_lookups
+
+
+class GeocodeCacheStats(Callback):
+    """
+    Record the geocoding cache hits and misses of every tool call on its span in the agent trace.
+
+    Only the lookups of the call itself are counted, see `track_lookups`, so concurrent
+    sessions of the app do not count each other's lookups.
+    """
+
+    def before_tool_execution(self, context: Context, *args, **kwargs) -> Context:
+        span_id = context.current_span.get_span_context().span_id
+        context.shared[("geocode_cache_stats", span_id)] = track_lookups()
+        return context
+
+    def after_tool_execution(self, context: Context, *args, **kwargs) -> Context:
+        span_id = context.current_span.get_span_context().span_id
+        counts = context.shared.pop(("geocode_cache_stats", span_id), None)
+        if counts is None:
+            return context
+        if any(counts.values()):
+            for name, count in counts.items():
+                context.current_span.set_attribute(f"geocode_cache.{name}", count)
+        return context
+
+
+def _parse_tool_output(output: str) -> Any:
+    # Frameworks report structured tool outputs either as JSON or as a Python literal
+    try:
+        return json.loads(output)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(output)
+    except (ValueError, SyntaxError):
+        return None
+
+
+def _get_photo_paths_from_tool_output(tool_name: str, output: str) -> List[str]:
+    if tool_name == get_photo_from_street_view.__name__:
+        return [output]
+    return photo_paths(tool_name, _parse_tool_output(output))
+
+
+class PhotoStream(Callback):
+    """
+    Publish the photos of every Street View tool call as soon as the call finishes.
+    """
+
+    def __init__(self):
+        self.paths = queue.Queue()
+
+    def after_tool_execution(self, context: Context, *args, **kwargs) -> Context:
+        attributes = context.current_span.attributes or {}
+        output = attributes.get("gen_ai.output")
+        if isinstance(output, str):
+            tool_name = attributes.get("gen_ai.tool.name")
+            for path in _get_photo_paths_from_tool_output(tool_name, output):
+                self.paths.put(path)
+        return context
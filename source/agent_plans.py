@@ -0,0 +1,361 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, List, Optional, Tuple
+
+import requests
+
+from source.agentic_machine import (
+    get_area_details_from_name,
+    get_panorama_from_street_view,
+    get_photo_from_street_view,
+    get_photos_from_street_view,
+)
+from source.the_machine.api.auth import redact_credentials
+from source.the_machine.api.metrics import record_cache_lookup
+from source.the_machine.api.ratelimit import QuotaExceededError
+from source.the_machine.config import (
+    DEFAULT_PLAN_CACHE_FILE,
+    DEFAULT_WORKERS,
+    PLAN_CACHE_TTL,
+)
+
+if TYPE_CHECKING:
+    from any_agent.tracing.agent_trace import AgentTrace
+
+# Tools whose calls are run again on replay; geocoding calls are kept in a plan to show where
+# its coordinates came from, but the photo calls already carry the coordinates
+PHOTO_TOOLS = {
+    tool.__name__: tool
+    for tool in (
+        get_photo_from_street_view,
+        get_photos_from_street_view,
+        get_panorama_from_street_view,
+    )
+}
+PLANNED_TOOLS = {get_area_details_from_name.__name__, *PHOTO_TOOLS}
+
+
+@dataclass
+class PlanStep:
+    """
+    A tool call of an agent run.
+
+    Attributes:
+        tool (str): Name of the tool.
+        arguments (dict): Arguments the model called it with.
+        output (str, optional): What the tool returned, as recorded in the trace.
+    """
+
+    tool: str
+    arguments: dict
+    output: Optional[str] = None
+
+
+@dataclass
+class AgentPlan:
+    """
+    The tool calls an agent made for a prompt, and its final answer.
+    """
+
+    steps: List[PlanStep]
+    final_output: str = ""
+
+    @property
+    def photo_steps(self) -> List[PlanStep]:
+        return [step for step in self.steps if step.tool in PHOTO_TOOLS]
+
+
+@dataclass
+class ReplayResult:
+    """
+    Outcome of replaying a plan.
+
+    Attributes:
+        paths (list): Photos fetched, in the order of the plan.
+        errors (list): A dict with the 'tool', 'arguments' and 'error' of every failed call,
+            and of every place that a batch call could not photograph.
+        final_output (str): Final answer of the run the plan was recorded from, marked as
+            replayed, or a summary of the replay if any call failed, see `replay_answer`.
+    """
+
+    paths: List[str] = field(default_factory=list)
+    errors: List[dict] = field(default_factory=list)
+    final_output: str = ""
+
+
+def plan_key(prompt: str, model: str, instructions: str, use_web: bool) -> str:
+    """
+    Key of the plan of a prompt. Case and whitespace of the prompt are ignored, so that
+    e.g. 'Explore  Athens' and 'explore athens' share a plan.
+
+    Args:
+        prompt (str): The prompt.
+        model (str): Model of the agent.
+        instructions (str): Instructions of the agent.
+        use_web (bool): Whether the agent has the web tools, which change how it plans.
+
+    Returns:
+        str: Hex SHA-256 digest of the prompt, model, instructions and tool set.
+    """
+    payload = json.dumps(
+        [" ".join(prompt.casefold().split()), model, instructions, use_web]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def plan_from_trace(trace: "AgentTrace") -> AgentPlan:
+    """
+    Extract the calls of the Street View and geocoding tools from an agent trace.
+
+    Args:
+        trace (AgentTrace): Trace of a finished agent run.
+
+    Returns:
+        AgentPlan: The tool calls, in the order of the trace, and the final output.
+    """
+    steps = []
+    for span in trace.spans:
+        attributes = span.attributes or {}
+        if attributes.get("gen_ai.operation.name") != "execute_tool":
+            continue
+        tool = attributes.get("gen_ai.tool.name")
+        if tool not in PLANNED_TOOLS:
+            continue
+        try:
+            arguments = json.loads(attributes.get("gen_ai.tool.args") or "{}")
+        except ValueError:
+            continue
+        output = attributes.get("gen_ai.output")
+        steps.append(PlanStep(tool, arguments, output if isinstance(output, str) else None))
+    final_output = trace.final_output
+    return AgentPlan(steps, final_output if isinstance(final_output, str) else str(final_output))
+
+
+def photo_paths(tool: str, result: Any) -> List[str]:
+    """
+    Returns:
+        list: The photos that a call of a Street View tool returned.
+    """
+    if tool == get_photo_from_street_view.__name__:
+        return [result] if isinstance(result, str) else []
+    if tool == get_photos_from_street_view.__name__:
+        return (result or {}).get("paths", [])
+    if tool == get_panorama_from_street_view.__name__:
+        return result or []
+    return []
+
+
+def photo_errors(tool: str, result: Any) -> List[str]:
+    """
+    Returns:
+        list: The places that a successful call of a Street View tool could not photograph,
+            as '<coordinates>: <error>' messages.
+    """
+    if tool == get_photos_from_street_view.__name__:
+        return [
+            f"{error['coordinates']}: {error['error']}"
+            for error in (result or {}).get("errors", [])
+        ]
+    return []
+
+
+class PlanCache:
+    """
+    Persistent cache of agent plans, so that a prompt that was run before can be replayed
+    without asking the model again.
+
+    Plans are stored in SQLite and expire after `ttl` seconds, since the places a prompt
+    names may get new imagery.
+
+    Args:
+        path (str): Path of the SQLite database.
+        ttl (float): Lifetime of a plan in seconds.
+    """
+
+    def __init__(self, path: str = DEFAULT_PLAN_CACHE_FILE, ttl: float = PLAN_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, prompt TEXT NOT NULL, "
+            "plan TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[AgentPlan]:
+        """
+        Look up a plan.
+
+        Args:
+            key (str): Key of the plan, see `plan_key`.
+
+        Returns:
+            AgentPlan: The plan, or None on a miss or if it expired.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT plan FROM plans WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        record_cache_lookup("plan", row is not None)
+        if row is None:
+            return None
+        plan = json.loads(row[0])
+        return AgentPlan(
+            [PlanStep(**step) for step in plan["steps"]], plan["final_output"]
+        )
+
+    def put(self, key: str, prompt: str, plan: AgentPlan):
+        """
+        Store the plan of a prompt, replacing any earlier one.
+
+        Args:
+            key (str): Key of the plan, see `plan_key`.
+            prompt (str): The prompt, kept for reference.
+            plan (AgentPlan): The plan.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO plans (key, prompt, plan, expires_at) VALUES (?, ?, ?, ?)",
+                (key, prompt, json.dumps(asdict(plan)), now + self.ttl),
+            )
+            self._db.execute("DELETE FROM plans WHERE expires_at <= ?", (now,))
+            self._db.commit()
+
+    def forget(self, key: str):
+        """
+        Remove a plan, e.g. one whose photos could not be fetched anymore.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_plan_cache = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache:
+    """
+    Get the process-wide plan cache, created on first use.
+
+    Returns:
+        PlanCache: The shared cache.
+    """
+    global _plan_cache
+    with _plan_cache_lock:
+        if _plan_cache is None:
+            _plan_cache = PlanCache()
+        return _plan_cache
+
+
+def record_plan(key: str, prompt: str, trace: "AgentTrace") -> Optional[AgentPlan]:
+    """
+    Cache the plan of a finished agent run, if it took any photos.
+
+    Returns:
+        AgentPlan: The plan that was cached, or None.
+    """
+    plan = plan_from_trace(trace)
+    if not plan.photo_steps:
+        return None
+    get_plan_cache().put(key, prompt, plan)
+    return plan
+
+
+def iter_replay(
+    plan: AgentPlan, workers: int = DEFAULT_WORKERS
+) -> Iterator[Tuple[PlanStep, List[str], List[str]]]:
+    """
+    Run the Street View tool calls of a plan again, in parallel and without the model.
+
+    Args:
+        plan (AgentPlan): The plan to replay.
+        workers (int): Number of tool calls run at the same time.
+
+    Yields:
+        tuple: (step, photo paths, error messages) of every call, as it finishes. A call
+            that failed has a single error; a batch call has one per place it could not
+            photograph, see `photo_errors`.
+    """
+    steps = plan.photo_steps
+    if not steps:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(steps), workers)) as executor:
+        futures = {
+            executor.submit(PHOTO_TOOLS[step.tool], **step.arguments): step for step in steps
+        }
+        for future in as_completed(futures):
+            step = futures[future]
+            try:
+                result = future.result()
+            except (
+                TypeError,
+                ValueError,
+                QuotaExceededError,
+                requests.exceptions.RequestException,
+            ) as e:
+                yield step, [], [redact_credentials(str(e))]
+                continue
+            yield step, photo_paths(step.tool, result), photo_errors(step.tool, result)
+
+
+def replay_answer(plan: AgentPlan, n_photos: int, n_errors: int) -> str:
+    """
+    Answer of a replay. The recorded answer describes the photos of the original run, so
+    it is only given, marked as replayed, if every photo was fetched again.
+
+    Args:
+        plan (AgentPlan): The replayed plan.
+        n_photos (int): Number of photos the replay delivered.
+        n_errors (int): Number of failed calls and of places that a batch call could not
+            photograph, see `iter_replay`.
+
+    Returns:
+        str: The answer.
+    """
+    if n_errors:
+        return (
+            f"Replayed an earlier run of this prompt: {n_photos} photos fetched, "
+            f"{n_errors} could not be fetched again."
+        )
+    return f"{plan.final_output}\n\n(Replayed from an earlier run of this prompt.)"
+
+
+def replay_plan(
+    plan: AgentPlan, workers: int = DEFAULT_WORKERS, key: Optional[str] = None
+) -> ReplayResult:
+    """
+    Replay a plan and collect its photos, see `iter_replay`.
+
+    Args:
+        plan (AgentPlan): The plan to replay.
+        workers (int): Number of tool calls run at the same time.
+        key (str, optional): Key of the plan in the plan cache. If no photo is delivered,
+            the plan is forgotten so that the prompt is planned by the model next time.
+
+    Returns:
+        ReplayResult: The photos, in the order of the plan, and the failed calls.
+    """
+    by_step = {}
+    result = ReplayResult()
+    for step, paths, errors in iter_replay(plan, workers):
+        by_step[id(step)] = paths
+        for error in errors:
+            result.errors.append({"tool": step.tool, "arguments": step.arguments, "error": error})
+    result.paths = [path for step in plan.photo_steps for path in by_step.get(id(step), [])]
+    result.final_output = replay_answer(plan, len(result.paths), len(result.errors))
+    if key is not None and not result.paths:
+        get_plan_cache().forget(key)
+    return result
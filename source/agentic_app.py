@@ -1,69 +1,206 @@
 import asyncio
-from typing import List
-import gradio as gr
-from any_agent import AgentTrace, AnyAgent
+import io
+import itertools
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Coroutine
 
-from source.agentic_machine import init_street_view_agent, get_photo_from_street_view
+from source.agent_plans import (
+    get_plan_cache,
+    iter_replay,
+    plan_key,
+    record_plan,
+    replay_answer,
+)
+from source.agentic_machine import get_photo_store, street_view_agent_config
+from source.the_machine.api.metrics import get_metrics
+from source.the_machine.config import AGENT_REPLAY_PLANS
+
+# gradio and any_agent take seconds to import; they are loaded when the app starts and
+# when the first agent is created, respectively
+if TYPE_CHECKING:
+    from any_agent import AnyAgent
+
+    from source.agent_callbacks import PhotoStream
 
 
 default_instructions = (
     "You are a lonely machine that wanders the streets of the world. "
     "Wherever you go, you take a picture."
 )
+default_framework = "openai"
 default_model = "gpt-4.1"
 default_use_web = False
+default_replay = AGENT_REPLAY_PLANS
+
+max_concurrent_runs = 4  # agent runs served at the same time, across all users
+max_queued_runs = 32  # further runs wait in a queue of this size, beyond it they are turned away
+metrics_file = None  # e.g. 'machine.prom': request metrics, exported after every run
+
+
+class EventLoopPool:
+    """
+    A fixed set of event loops, each running in its own thread, that agents are spread over.
+
+    Every agent stays on the loop it was created on, so its async clients are never shared
+    between loops, while agents on different loops run in parallel.
+
+    Args:
+        size (int): Number of event loops.
+    """
+
+    def __init__(self, size: int):
+        self._loops = []
+        for i in range(size):
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name=f"agent-loop-{i}", daemon=True
+            ).start()
+            self._loops.append(loop)
+        self._next = itertools.cycle(self._loops)
+        self._lock = threading.Lock()
+
+    def next_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            return next(self._next)
+
+
+_loops = None
+_loops_lock = threading.Lock()
+
 
+def _get_loops() -> EventLoopPool:
+    global _loops
+    with _loops_lock:
+        if _loops is None:
+            _loops = EventLoopPool(max_concurrent_runs)
+        return _loops
 
-def _get_photo_paths_from_agent_trace(agent_trace: AgentTrace) -> List[str]:
-    paths = []
-    for tool_call in agent_trace.spans:
-        if tool_call.name == get_photo_from_street_view.__name__:
-            paths.append(tool_call.attributes["output.value"])
 
-    return list(set(paths))  # make sure there are no duplicates
+@dataclass
+class AgentSession:
+    """
+    The agent of one user of the app, with the event loop it runs on and its photo stream.
 
+    The model, instructions and web tools key the cached plans of the agent's prompts; with
+    `replay`, a prompt that was run before replays its plan instead of running the agent.
+    """
 
-def query_agent(agent: AnyAgent, user_input: str):
+    agent: "AnyAgent"
+    loop: asyncio.AbstractEventLoop
+    photos: "PhotoStream"
+    model: str = default_model
+    instructions: str = default_instructions
+    use_web: bool = default_use_web
+    replay: bool = default_replay
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+def gallery_item(photo_path: str):
+    """
+    Get what the gallery shows for a photo: its path, or for a photo packed into the
+    photo store, the image read from the store.
+    """
+    store = get_photo_store()
+    if store is None or photo_path not in store:
+        return photo_path
+    from PIL import Image  # installed with gradio
+
+    return Image.open(io.BytesIO(store.get(photo_path)))
+
+
+def query_agent(session: AgentSession | None, user_input: str):
     # Initialize agent for the first time
-    if not agent:
-        agent, _ = initialize_agent()
+    if not session:
+        session, _ = initialize_agent()
 
-    yield agent, [], "Thinking... Planning... Wandering..."
+    photo_paths, gallery = [], []
+    key = plan_key(user_input, session.model, session.instructions, session.use_web)
+    plan = get_plan_cache().get(key) if session.replay else None
+    if plan is not None:
+        yield session, gallery, "Wandering the way I did before..."
+        n_errors = 0
+        # Photos are shown as their calls finish, which is not necessarily in order
+        for _, paths, errors in iter_replay(plan):
+            n_errors += len(errors)
+            for path in paths:
+                if path not in photo_paths:
+                    photo_paths.append(path)
+                    gallery.append(gallery_item(path))
+            yield session, list(gallery), "Wandering..."
+        print(f"Replayed these photos: {photo_paths}")
+        if not photo_paths:
+            get_plan_cache().forget(key)  # plan it again next time
+        if metrics_file:
+            get_metrics().write(metrics_file)
+        yield session, gallery, replay_answer(plan, len(photo_paths), n_errors)
+        return
 
-    agent_trace = agent.run(user_input)
+    yield session, gallery, "Thinking... Planning... Wandering..."
 
-    photo_paths = _get_photo_paths_from_agent_trace(agent_trace)
+    run = session.submit(session.agent.run_async(user_input))
+    # Mark the end of the run, after every photo it published
+    run.add_done_callback(lambda _: session.photos.paths.put(None))
+    # Show every photo as soon as its tool call finishes
+    for path in iter(session.photos.paths.get, None):
+        if path not in photo_paths:  # make sure there are no duplicates
+            photo_paths.append(path)
+            gallery.append(gallery_item(path))
+            yield session, list(gallery), "Wandering..."
+
+    agent_trace = run.result()
+    record_plan(key, user_input, agent_trace)
 
     print(f"Fetched these photos: {photo_paths}")
+    if metrics_file:
+        get_metrics().write(metrics_file)
 
-    yield agent, photo_paths, agent_trace.final_output
+    yield session, gallery, agent_trace.final_output
 
 
 def initialize_agent(
-    agent: AnyAgent | None = None,
+    session: AgentSession | None = None,
     instructions: str = default_instructions,
     model: str = default_model,
     use_web: bool = default_use_web,
+    replay: bool = default_replay,
 ):
-    # If the agent was already initialized, reset it
-    if agent:
-        agent.exit()
+    from any_agent import AnyAgent
+
+    from source.agent_callbacks import PhotoStream
+
+    # If the agent was already initialized, release it
+    if session:
+        session.submit(session.agent.cleanup_async()).result()
 
-    new_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(new_loop)
-    updated_agent = init_street_view_agent(
+    photos = PhotoStream()
+    config = street_view_agent_config(
         instructions=instructions,
         model=model,
         use_web=use_web,
+        callbacks=[photos],
+    )
+    # Agents are created on one of the shared loops rather than on a new loop every time
+    loop = _get_loops().next_loop()
+    agent = asyncio.run_coroutine_threadsafe(
+        AnyAgent.create_async(default_framework, config), loop
+    ).result()
+    return (
+        AgentSession(agent, loop, photos, model, instructions, use_web, replay),
+        "The Machine has been updated.",
     )
-    return updated_agent, "The Machine has been updated."
 
 
 def gradio_app():
+    import gradio as gr
+
     with gr.Blocks() as app:
         gr.Markdown("## The Lonely Machine")
 
-        agent = gr.State()
+        session = gr.State()
 
         with gr.Accordion("Configure the machine", open=False):
             with gr.Row():
@@ -85,13 +222,17 @@ def gradio_app():
                 )
             with gr.Row():
                 use_web = gr.Checkbox(label="Use Web", value=default_use_web)
+                replay = gr.Checkbox(
+                    label="Replay prompts run before, without the model",
+                    value=default_replay,
+                )
 
             agent_status = gr.Markdown("")
 
             gr.Button("Save").click(
                 initialize_agent,
-                inputs=[agent, instructions, model, use_web],
-                outputs=[agent, agent_status],
+                inputs=[session, instructions, model, use_web, replay],
+                outputs=[session, agent_status],
             )
 
         input_text = gr.Textbox(
@@ -104,10 +245,11 @@ def gradio_app():
         submit_button = gr.Button("Wander")
         submit_button.click(
             query_agent,
-            inputs=[agent, input_text],
-            outputs=[agent, output_gallery, status],
+            inputs=[session, input_text],
+            outputs=[session, output_gallery, status],
         )
 
+    app.queue(default_concurrency_limit=max_concurrent_runs, max_size=max_queued_runs)
     app.launch()
 
 
@@ -1,35 +1,179 @@
 import argparse
-import json
+import importlib.util
+import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from any_agent import AgentConfig, AnyAgent
-from any_agent.tools import search_web, visit_webpage
 import requests
 
-from source.the_machine.api.auth import sign_url
-from source.the_machine.api.client import get_credentials
+from source.the_machine.api import nominatim
+from source.the_machine.api.auth import get_request_template, redact_credentials
+from source.the_machine.api.cache import ImageCache, request_key
+from source.the_machine.api.client import (
+    create_session,
+    fetch_views_from_location,
+    find_nearby_photos,
+    get_credentials,
+    image_query,
+    move_to_store,
+    record_paths,
+    record_photos,
+)
+from source.the_machine.api.download import save_image
+from source.the_machine.api.metrics import (
+    get_metrics,
+    record_cache_lookup,
+    send_instrumented,
+)
+from source.the_machine.api.ratelimit import QuotaExceededError, get_limiter
+from source.the_machine.config import (
+    AGENT_DROP_NEAR_DUPLICATES,
+    AGENT_PHOTO_STORE,
+    AGENT_REPLAY_PLANS,
+    AGENT_SKIP_NEARBY,
+    DEFAULT_WORKERS,
+    STREETVIEW_API_URL,
+)
+from source.the_machine.storage.photo_index import PhotoIndex
+from source.the_machine.storage.shards import ShardStore
+
+# any_agent is only imported when an agent is created, so the tools can be used and
+# benchmarked without loading the agent frameworks
+if TYPE_CHECKING:
+    from any_agent import AgentConfig, AnyAgent
+    from any_agent.callbacks import Callback
+
+    from source.the_machine.images.duplicates import NearDuplicateDetector
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def _get_image_cache() -> ImageCache:
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache()
+        return _image_cache
+
+
+_photo_store = None
+_photo_store_lock = threading.Lock()
+
+
+def get_photo_store() -> ShardStore | None:
+    """
+    Returns:
+        ShardStore: The store the photos are packed into, or None if they are kept as plain
+            files, see AGENT_PHOTO_STORE. Photo paths returned by the tools are then keys in
+            the store.
+    """
+    global _photo_store
+    if AGENT_PHOTO_STORE is None:
+        return None
+    with _photo_store_lock:
+        if _photo_store is None:
+            _photo_store = ShardStore(AGENT_PHOTO_STORE)
+        return _photo_store
+
+
+_duplicate_detector = None
+_duplicate_detector_lock = threading.Lock()
+
+
+def get_duplicate_detector() -> "NearDuplicateDetector | None":
+    """
+    Returns:
+        NearDuplicateDetector: The detector that the agent's photos are checked with, or None
+            if they are not checked, see AGENT_DROP_NEAR_DUPLICATES.
+    """
+    global _duplicate_detector
+    if not AGENT_DROP_NEAR_DUPLICATES:
+        return None
+    with _duplicate_detector_lock:
+        if _duplicate_detector is None:
+            from source.the_machine.images.duplicates import NearDuplicateDetector
+
+            Path("the_photos").mkdir(parents=True, exist_ok=True)
+            # A photo at a time, hashing in the calling thread is faster than in a process
+            _duplicate_detector = NearDuplicateDetector("the_photos/hashes.sqlite", workers=1)
+        return _duplicate_detector
+
+
+_photo_index = None
+_photo_index_lock = threading.Lock()
+
+
+def get_photo_index() -> PhotoIndex | None:
+    """
+    Returns:
+        PhotoIndex: The index of the agent's photos, that a photo is reused from instead of
+            fetched again when one was taken nearby with the same camera settings, or None if photos
+            are always fetched, see AGENT_SKIP_NEARBY.
+    """
+    global _photo_index
+    if AGENT_SKIP_NEARBY is None:
+        return None
+    with _photo_index_lock:
+        if _photo_index is None:
+            Path("the_photos").mkdir(parents=True, exist_ok=True)
+            _photo_index = PhotoIndex("the_photos/photos.sqlite")
+        return _photo_index
 
 
 # Define the Street View agent
-def init_street_view_agent(
-    instructions: str = "You are a lonely machine that wanders the digital streets of the world. "
-    "Wherever you go, you take a picture.",
-    framework: str = "openai",
-    model: str = "gpt-4.1-nano",
+DEFAULT_INSTRUCTIONS = (
+    "You are a lonely machine that wanders the digital streets of the world. "
+    "Wherever you go, you take a picture."
+)
+DEFAULT_MODEL = "gpt-4.1-nano"
+
+
+def street_view_agent_config(
+    instructions: str = DEFAULT_INSTRUCTIONS,
+    model: str = DEFAULT_MODEL,
     use_web: bool = False,
-) -> AnyAgent:
-    tools = [get_area_details_from_name, get_photo_from_street_view]
+    callbacks: list["Callback"] | None = None,
+) -> "AgentConfig":
+    from any_agent import AgentConfig
+    from any_agent.callbacks import get_default_callbacks
+
+    from source.agent_callbacks import GeocodeCacheStats
+
+    tools = [
+        get_area_details_from_name,
+        get_photo_from_street_view,
+        get_photos_from_street_view,
+        get_panorama_from_street_view,
+    ]
     if use_web:
+        from any_agent.tools import search_web, visit_webpage
+
         tools += [search_web, visit_webpage]
+    return AgentConfig(
+        model_id=model,
+        instructions=instructions,
+        tools=tools,
+        callbacks=[*get_default_callbacks(), GeocodeCacheStats(), *(callbacks or [])],
+    )
+
+
+def init_street_view_agent(
+    instructions: str = DEFAULT_INSTRUCTIONS,
+    framework: str = "openai",
+    model: str = DEFAULT_MODEL,
+    use_web: bool = False,
+    callbacks: list["Callback"] | None = None,
+) -> "AnyAgent":
+    from any_agent import AnyAgent
+
     return AnyAgent.create(
         agent_framework=framework,
-        agent_config=AgentConfig(
-            model_id=model,
-            instructions=instructions,
-            tools=tools,
-        ),
+        agent_config=street_view_agent_config(instructions, model, use_web, callbacks),
     )
 
 
@@ -38,6 +182,7 @@ def get_area_details_from_name(area_name: str) -> list[dict]:
     """
     Get details of an area based on a place name using
     the [Nominatim API](https://nominatim.org/release-docs/develop/api/Search/).
+    Results are cached, so asking again for the same place returns instantly.
 
     Args:
         area_name (str): The name of the area.
@@ -68,14 +213,7 @@ def get_area_details_from_name(area_name: str) -> list[dict]:
             "type": "town"
         }
     """
-    response = requests.get(
-        f"https://nominatim.openstreetmap.org/search?q={area_name}&format=json",
-        headers={"User-Agent": "Mozilla/5.0"},
-    )
-    response.raise_for_status()
-    response_json = json.loads(response.content.decode())
-
-    return response_json
+    return nominatim.search(area_name)
 
 
 def get_photo_from_street_view(
@@ -94,37 +232,233 @@ def get_photo_from_street_view(
         radius (int): Search radius in meters.
 
     Returns:
-        str: Path to the saved image file or error message
+        str: Path to the saved image file or error message. A photo that looks like one taken
+            before may be replaced by the earlier one, see AGENT_DROP_NEAR_DUPLICATES, and if
+            enabled, a photo taken nearby with the same heading, pitch, fov and size is
+            returned without fetching, see AGENT_SKIP_NEARBY.
     """
-    key, secret = get_credentials()
+    params = {
+        "size": size,
+        "fov": fov,
+        "heading": heading,
+        "radius": radius,
+        "return_error_code": "true",
+    }
+    return _fetch_photo(coordinates, params)
+
+
+def get_photos_from_street_view(
+    coordinates: list[str], size: str, fov: int, heading: int, radius: int = 300
+) -> dict:
+    """
+    Fetch photos of many places at once from the Google Street View API, all with the same camera
+    settings. Prefer this over fetching one photo at a time when you want photos of several places.
+
+    Args:
+        coordinates (list[str]): Latitude and longitude of every place in the format 'lat,lng',
+            for example ['37.9838,23.7275', '37.9755,23.7348'].
+        size (str): Image size in the format 'WIDTHxHEIGHT'.
+        fov (int): Field of view.
+        heading (int): Compass heading of the camera.
+        radius (int): Search radius in meters.
+
+    Returns:
+        dict: 'paths' lists the saved image files and 'errors' the places that could not be
+            photographed, each with its 'coordinates' and 'error' message, e.g. once the
+            daily quota is used up.
+    """
+    params = {
+        "size": size,
+        "fov": fov,
+        "heading": heading,
+        "radius": radius,
+        "return_error_code": "true",
+    }
+    workers = min(len(coordinates), DEFAULT_WORKERS) or 1
+    with create_session(pool_size=workers) as session:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_fetch_photo, place, params, session)
+                for place in coordinates
+            ]
+            paths, errors = [], []
+            for place, future in zip(coordinates, futures):
+                try:
+                    paths.append(future.result())
+                except (
+                    ValueError,
+                    QuotaExceededError,
+                    requests.exceptions.RequestException,
+                ) as e:
+                    errors.append(
+                        {"coordinates": place, "error": redact_credentials(str(e))}
+                    )
+    return {"paths": paths, "errors": errors}
+
+
+def _fetch_photo(
+    coordinates: str, params: dict, session: requests.Session | None = None
+) -> str:
+    index = get_photo_index()
+    if index is not None:
+        nearby = find_nearby_photos(
+            index, coordinates, params, AGENT_SKIP_NEARBY, get_photo_store()
+        )
+        if nearby is not None:
+            return nearby[0]
 
     output_path = Path("the_photos")
     output_path.mkdir(parents=True, exist_ok=True)
 
-    base_url = "https://maps.googleapis.com/maps/api/streetview"
-    url_request = (
-        f"{base_url}?key={key}&size={size}"
-        f"&location={coordinates}&radius={radius}&fov={fov}"
-        f"&heading={heading}&return_error_code=true"
+    coordinates_str = coordinates.replace(",", "_").replace(".", "_")
+    timestamp = datetime.now().strftime("%d%m%Y")
+    uid = str(uuid.uuid4())[:2]
+    full_path = output_path / f"img_{timestamp}_{coordinates_str}_{uid}.jpg"
+
+    cache = _get_image_cache()
+    cache_key = request_key(coordinates, params)
+    hit = cache.copy_to(cache_key, str(full_path))
+    record_cache_lookup("image", hit)
+    if hit:
+        return _keep_photo(full_path, coordinates, params)
+
+    key, secret = get_credentials()
+    signed_url = get_request_template(STREETVIEW_API_URL, key, secret).sign(
+        image_query(coordinates, params)
+    )
+
+    http = session or requests
+    response = send_instrumented(
+        "streetview_image",
+        get_limiter("streetview"),
+        lambda: http.get(signed_url, stream=True),
+        stream=True,
     )
 
-    signed_url = sign_url(input_url=url_request, secret=secret)
+    with response:
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error when fetching image: {response.status_code} - {response.text}"
+            )
+        # Raises NotAnImageError, a ValueError, if the response is not an image
+        save_image(response, str(full_path))
+    cache.put_file(cache_key, str(full_path))
+    return _keep_photo(full_path, coordinates, params)
+
+
+def _keep_photo(path: Path, coordinates: str, params: dict) -> str:
+    """
+    Check a new photo for near-duplicates, if enabled, then move it into the photo store,
+    if any, and return its path or key.
+
+    A near-duplicate of an earlier photo is deleted and the earlier photo returned instead.
+    New photos are also recorded in the photo index, if any.
+
+    Raises:
+        ValueError: If the photo is a "no imagery" placeholder.
+    """
+    detector = get_duplicate_detector()
+    if detector is not None:
+        from source.the_machine.images.duplicates import PLACEHOLDER
 
-    response = requests.get(signed_url)
+        verdict = detector.check(path.as_posix(), str(path))
+        if verdict.duplicate_of or verdict.status == PLACEHOLDER:
+            os.remove(path)
+        if verdict.duplicate_of:
+            return verdict.duplicate_of
+        if verdict.status == PLACEHOLDER:
+            raise ValueError(f"No Street View imagery at {coordinates}")
 
-    if response.status_code == 200:
-        coordinates = coordinates.replace(",", "_").replace(".", "_")
-        timestamp = datetime.now().strftime("%d%m%Y")
-        uid = str(uuid.uuid4())[:2]
-        filename = f"img_{timestamp}_{coordinates}_{uid}.jpg"
-        full_path = output_path / filename
-        with open(full_path, "wb") as file:
-            file.write(response.content)
-        return str(full_path)  # Return the full path
+    store = get_photo_store()
+    if store is None:
+        kept = str(path)  # Return the full path
     else:
+        kept = move_to_store(store, str(path), coordinates, params, key=path.as_posix())
+    index = get_photo_index()
+    if index is not None:
+        record_paths(index, coordinates, [kept], params, keys=store is not None)
+    return kept
+
+
+def get_panorama_from_street_view(
+    coordinates: str,
+    size: str,
+    fov: int,
+    headings: list[int],
+    pitches: list[int] | None = None,
+    radius: int = 300,
+    stitch: bool = False,
+) -> list[str]:
+    """
+    Given some coordinates in the format of XX.XXXXXX, YY.YYYYYY fetch several photos from the
+    same spot of the Google Street View API, looking in different directions, for example
+    headings [0, 90, 180, 270] for a full 360° view. All photos are taken at the same time.
+
+    Args:
+        coordinates (str): Latitude and longitude in the format 'lat,lng' for example '37.9838,23.7275'.
+        size (str): Image size in the format 'WIDTHxHEIGHT'.
+        fov (int): Field of view of every photo.
+        headings (list[int]): Compass headings of the camera, one photo per heading.
+        pitches (list[int], optional): Camera pitches, one row of photos per pitch. Defaults to [0].
+        radius (int): Search radius in meters.
+        stitch (bool): If True, also combine the photos into one strip image. Requires
+            Pillow, see Raises.
+
+    Returns:
+        list[str]: Paths to the saved image files, followed by the strip image if stitched.
+            Unless stitching, photos taken nearby with the same camera settings may be
+            returned without fetching, see AGENT_SKIP_NEARBY.
+
+    Raises:
+        ValueError: If stitching is asked for but Pillow is not installed, before any
+            photo is fetched, or if the photos could not be fetched.
+    """
+    if stitch and importlib.util.find_spec("PIL") is None:
         raise ValueError(
-            f"Error when fetching image: {response.status_code} - {response.text}"
+            "Stitching photos requires Pillow, which is not installed. "
+            "Ask again with stitch=False to get the separate photos."
         )
+    coordinates_str = coordinates.replace(",", "_").replace(".", "_")
+    timestamp = datetime.now().strftime("%d%m%Y")
+    uid = str(uuid.uuid4())[:2]
+    directory = Path("the_photos") / f"pano_{timestamp}_{coordinates_str}_{uid}"
+
+    key, secret = get_credentials()
+    params = {
+        "size": size,
+        "fov": fov,
+        "headings": headings,
+        "pitches": pitches,
+        "pitch": 0,
+        "radius": radius,
+        "return_error_code": "true",
+        "stitch": stitch,
+    }
+    store = get_photo_store()
+    index = get_photo_index()
+    if index is not None and not params["stitch"]:
+        nearby = find_nearby_photos(index, coordinates, params, AGENT_SKIP_NEARBY, store)
+        if nearby is not None:
+            return nearby
+
+    result = fetch_views_from_location(
+        location=coordinates,
+        key=key,
+        secret=secret,
+        params=params,
+        filename=str(directory),
+        manual_check=False,
+        cache=_get_image_cache(),
+        api_url=STREETVIEW_API_URL,
+        store=store,
+    )
+    if not result.ok:
+        raise ValueError(f"Error when fetching photos: {result.error}")
+    if index is not None:
+        record_photos(index, result, params, keys=store is not None)
+    if params["stitch"]:
+        return result.views + [str(Path(result.filename) / "strip.jpg")]
+    return result.views
 
 
 if __name__ == "__main__":
@@ -135,11 +469,36 @@ if __name__ == "__main__":
         default="Fetch me an image from Acropolis, Athens",
         help="Write your prompt here. The agent will try to fetch an image from the Google Street View API.",
     )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Export the request metrics to this file when done ('.prom' for Prometheus, "
+        "JSON lines otherwise).",
+    )
+
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        default=AGENT_REPLAY_PLANS,
+        help="If the prompt was run before, replay its tool calls without the model.",
+    )
 
     args = parser.parse_args()
 
-    r = get_area_details_from_name("elefsina")
+    from source.agent_plans import get_plan_cache, plan_key, record_plan, replay_plan
 
-    agent = init_street_view_agent()
-    agent_trace = agent.run(args.prompt)
-    print(agent_trace.final_output)
+    key = plan_key(args.prompt, DEFAULT_MODEL, DEFAULT_INSTRUCTIONS, use_web=False)
+    plan = get_plan_cache().get(key) if args.replay else None
+    if plan is not None:
+        replay = replay_plan(plan, key=key)
+        print(replay.final_output)
+        print(f"Replayed {len(plan.photo_steps)} tool calls: {replay.paths}")
+        for error in replay.errors:
+            print(f"Failed {error['tool']}: {error['error']}")
+    else:
+        agent = init_street_view_agent()
+        agent_trace = agent.run(args.prompt)
+        print(agent_trace.final_output)
+        record_plan(key, args.prompt, agent_trace)
+    if args.metrics_file:
+        get_metrics().write(args.metrics_file)
@@ -1,20 +1,101 @@
-from source.the_machine.locations.generator import create_locations
-from source.the_machine.api.client import fetch_images
+import argparse
+import os
+from typing import Optional
 
+from source.the_machine.config import DEFAULT_PHOTO_INDEX_FILE
+from source.the_machine.jobs.manifest import RUN_MODES
 
-def main():
+
+def main(
+    mode: str = "run",
+    metrics_file: Optional[str] = None,
+    store_dir: Optional[str] = None,
+    near_duplicates: Optional[str] = None,
+    photo_index: Optional[str] = None,
+    skip_nearby: Optional[float] = None,
+):
     """
-    This script demonstrates how to generate a sample locations CSV file using
+    This script demonstrates how to generate sample location coordinates using
     the location generator and then fetch images using the API client.
+
+    Args:
+        mode (str): 'run' to fetch every location, 'resume' to continue an interrupted run
+            or 'retry-failed' to only fetch the locations that failed in a previous run.
+        metrics_file (str, optional): File to export the request metrics to at the end.
+        store_dir (str, optional): Directory of a shard store to pack the images into,
+            instead of saving them as separate files.
+        near_duplicates (str, optional): 'flag' or 'drop' near-duplicate and placeholder
+            images, see `iter_fetch_images`.
+        photo_index (str, optional): SQLite file indexing the photos taken by every run.
+        skip_nearby (float, optional): Distance in meters within which a location is not
+            fetched again if the photo index has a photo facing the same way.
     """
-    # Generate a CSV file with sample location coordinates.
-    csv_file = create_locations()
-    print("Generated CSV file:", csv_file)
+    # Imported here so that argument parsing does not wait for NumPy and requests to load
+    from source.the_machine.locations.generator import iter_locations
+    from source.the_machine.api.client import fetch_images
 
-    # Fetch images based on the generated CSV file.
+    # Stream the generated locations straight into the fetcher.
+    # The locations that were used are also saved to a CSV file as a side output.
+    csv_file = os.path.join(os.getcwd(), "athens_random.csv")
+    locations = iter_locations(output_file=csv_file)
+
+    # Fetch images based on the generated locations.
     # Note: Ensure API credentials are properly set.
-    fetch_images(input_file=csv_file)
+    fetch_images(
+        input_file=locations,
+        mode=mode,
+        metrics_file=metrics_file,
+        store_dir=store_dir,
+        near_duplicates=near_duplicates,
+        photo_index=photo_index,
+        skip_nearby=skip_nearby,
+    )
+    print("Generated CSV file:", csv_file)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="The Lonely Machine. V1 - Auto run.")
+    parser.add_argument(
+        "--mode",
+        choices=RUN_MODES,
+        default="run",
+        help="'resume' continues an interrupted run, 'retry-failed' only refetches failures.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Export the request metrics to this file ('.prom' for Prometheus, JSON lines otherwise).",
+    )
+    parser.add_argument(
+        "--store-dir",
+        default=None,
+        help="Pack the images into a shard store in this directory instead of separate files.",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        choices=("flag", "drop"),
+        default=None,
+        help="Flag or drop images that look like earlier ones or like placeholders (requires Pillow).",
+    )
+    parser.add_argument(
+        "--photo-index",
+        default=None,
+        help=f"Index the photos of every run in this SQLite file, e.g. {DEFAULT_PHOTO_INDEX_FILE}.",
+    )
+    parser.add_argument(
+        "--skip-nearby",
+        type=float,
+        default=None,
+        help="Skip locations within this many meters of an indexed photo facing the same way.",
+    )
+    args = parser.parse_args()
+    if args.skip_nearby is not None and args.photo_index is None:
+        parser.error("--skip-nearby requires --photo-index.")
+    main(
+        mode=args.mode,
+        metrics_file=args.metrics_file,
+        store_dir=args.store_dir,
+        near_duplicates=args.near_duplicates,
+        photo_index=args.photo_index,
+        skip_nearby=args.skip_nearby,
+    )
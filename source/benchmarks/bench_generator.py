@@ -0,0 +1,98 @@
+"""
+Benchmark how location generation scales with the number of locations.
+
+Usage:
+    python -m source.benchmarks.bench_generator --method even
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+from source.the_machine.config import DEFAULT_LOCATION_PARAMS
+from source.the_machine.locations.generator import (
+    GRID_METHODS,
+    SAMPLING_METHODS,
+    iter_locations,
+)
+
+
+def _legacy_generate_coordinates(lats, lons):
+    """The original nested-loop implementation, kept as a baseline for comparison."""
+    locs = {"Address": [], "City": [], "Country": [], "lat": [], "long": []}
+    for lat in lats:
+        for lon in lons:
+            lat_str = str(lat)
+            lon_str = str(lon)
+            locs["Address"].append("-")
+            locs["City"].append("-")
+            locs["Country"].append("-")
+            locs["lat"].append(lat_str[:2] + "." + lat_str[2:])
+            locs["long"].append(lon_str[:2] + "." + lon_str[2:])
+    return pd.DataFrame(locs)
+
+
+def _measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _count_locations(params):
+    return sum(len(chunk) for chunk in iter_locations(params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Location generator benchmark.")
+    parser.add_argument("--method", default="even", choices=list(SAMPLING_METHODS))
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**2, 10**3, 10**4, 10**5, 10**6, 10**7],
+        help="Values of n_locs to benchmark.",
+    )
+    parser.add_argument(
+        "--min-distance",
+        type=float,
+        default=10,
+        help="Minimum distance in meters for the 'poisson' method.",
+    )
+    parser.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=10**6,
+        help="Largest n_locs to also run the legacy implementation for (grid methods only).",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'n_locs':>10} {'points':>10} {'time (s)':>10} {'peak MiB':>10} "
+        f"{'legacy (s)':>11} {'legacy MiB':>11}"
+    )
+    for n_locs in args.sizes:
+        params = {
+            **DEFAULT_LOCATION_PARAMS,
+            "method": args.method,
+            "n_locs": n_locs,
+            "min_distance": args.min_distance,
+        }
+        n_points, elapsed, peak = _measure(_count_locations, params)
+        row = f"{n_locs:>10} {n_points:>10} {elapsed:>10.4f} {peak / 2**20:>10.1f}"
+        if args.method in GRID_METHODS and n_locs <= args.legacy_limit:
+            lats, lons = GRID_METHODS[args.method](params)
+            _, legacy_elapsed, legacy_peak = _measure(
+                _legacy_generate_coordinates, lats, lons
+            )
+            row += f" {legacy_elapsed:>11.4f} {legacy_peak / 2**20:>11.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
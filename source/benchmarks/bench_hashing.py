@@ -0,0 +1,136 @@
+"""
+Benchmark perceptual hashing of images and near-duplicate lookups.
+
+Hashing requires Pillow; the lookup benchmark compares the multi-index `HammingIndex`
+with a linear scan over every hash.
+
+Usage:
+    python -m source.benchmarks.bench_hashing --n-images 500 --n-hashes 1000000
+"""
+
+import argparse
+import io
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from source.the_machine.config import DEFAULT_HASH_WORKERS, NEAR_DUPLICATE_THRESHOLD
+from source.the_machine.images.hashing import (
+    HammingIndex,
+    hash_images,
+    hash_thumbnails,
+    load_thumbnail,
+)
+
+
+def _best_of(repeat, func):
+    """Run a function several times and return its last result and fastest time."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _report(name, elapsed, n):
+    print(f"{name:>30} {elapsed:>10.3f} {elapsed / n * 1e6:>12.2f}")
+
+
+def _jpegs(n_images, size=640):
+    """Street View sized JPEGs of smooth random scenes."""
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(n_images):
+        scene = Image.fromarray(rng.integers(0, 255, (16, 16, 3), dtype=np.uint8))
+        buffer = io.BytesIO()
+        scene.resize((size, size), Image.Resampling.BICUBIC).save(buffer, "JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def bench_hashing(n_images, repeat):
+    from source.the_machine.images.duplicates import NearDuplicateDetector
+
+    images = _jpegs(n_images)
+    print(f"{'hashing':>30} {'total (s)':>10} {'us / image':>12}")
+    _, elapsed = _best_of(repeat, lambda: [load_thumbnail(image) for image in images])
+    _report("decode to thumbnails", elapsed, n_images)
+    thumbnails = np.stack([load_thumbnail(image) for image in images])
+    _, elapsed = _best_of(
+        repeat, lambda: [hash_thumbnails(thumbnail[None]) for thumbnail in thumbnails]
+    )
+    _report("hash one at a time", elapsed, n_images)
+    _, elapsed = _best_of(repeat, lambda: hash_thumbnails(thumbnails))
+    _report("hash as one batch", elapsed, n_images)
+    _, elapsed = _best_of(repeat, lambda: hash_images(images))
+    _report("decode + hash, 1 process", elapsed, n_images)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with NearDuplicateDetector(
+            f"{directory}/hashes.sqlite", workers=DEFAULT_HASH_WORKERS
+        ) as detector:
+            items = [(str(i), image) for i, image in enumerate(images)]
+            detector.check_many(items[:DEFAULT_HASH_WORKERS])  # start the processes
+            _, elapsed = _best_of(repeat, lambda: detector.check_many(items))
+            _report(f"check_many, {DEFAULT_HASH_WORKERS} process(es)", elapsed, n_images)
+
+
+def bench_lookups(n_hashes, n_queries, threshold, repeat):
+    random.seed(0)
+    hashes = [random.getrandbits(64) for _ in range(n_hashes)]
+    # Half of the queries are near-duplicates of an indexed hash, half are new
+    queries = [
+        hashes[random.randrange(n_hashes)] ^ (1 << random.randrange(64))
+        if i % 2
+        else random.getrandbits(64)
+        for i in range(n_queries)
+    ]
+    array = np.array(hashes, dtype=np.uint64)
+
+    def linear_scan():
+        matches = []
+        for query in queries:
+            distances = np.bitwise_count(array ^ np.uint64(query))
+            matches.append(int((distances <= threshold).sum()))
+        return matches
+
+    index = HammingIndex(threshold)
+    start = time.perf_counter()
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+    build = time.perf_counter() - start
+
+    print(f"\n{'lookups of ' + str(n_hashes) + ' hashes':>30} {'total (s)':>10} {'us / query':>12}")
+    print(f"{'build HammingIndex':>30} {build:>10.3f}")
+    scanned, elapsed = _best_of(repeat, linear_scan)
+    _report("NumPy linear scan", elapsed, n_queries)
+    indexed, elapsed = _best_of(repeat, lambda: [len(index.query(q)) for q in queries])
+    _report("HammingIndex.query", elapsed, n_queries)
+    assert scanned == indexed, "The index and the scan found different matches"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual hashing benchmark.")
+    parser.add_argument("--n-images", type=int, default=200)
+    parser.add_argument("--n-hashes", type=int, default=1_000_000)
+    parser.add_argument("--n-queries", type=int, default=1_000)
+    parser.add_argument("--threshold", type=int, default=NEAR_DUPLICATE_THRESHOLD)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Report the fastest of this many runs."
+    )
+    args = parser.parse_args()
+
+    try:
+        bench_hashing(args.n_images, args.repeat)
+    except ImportError:
+        print("Pillow is not installed, skipping the hashing benchmark.")
+    bench_lookups(args.n_hashes, args.n_queries, args.threshold, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
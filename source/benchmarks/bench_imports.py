@@ -0,0 +1,89 @@
+"""
+Benchmark the import time of the entry points and check that heavy dependencies stay lazy.
+
+Every module is imported in a fresh interpreter. The script exits with an error if a module
+loads a dependency it should only load on demand, or takes longer than --max-ms to import,
+so it can guard against startup regressions in CI.
+
+Usage:
+    python -m source.benchmarks.bench_imports
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Entry points and the dependencies they must not load at import time
+LAZY_DEPENDENCIES = {
+    "source.auto_run": ["pandas", "numpy", "requests", "any_agent", "gradio"],
+    "source.interact_run": ["pandas", "numpy", "requests", "any_agent", "gradio"],
+    "source.the_machine.api.client": ["pandas", "numpy", "any_agent", "gradio"],
+    "source.the_machine.locations.generator": ["pandas", "any_agent", "gradio"],
+    "source.agentic_machine": ["pandas", "numpy", "any_agent", "gradio"],
+    "source.agentic_app": ["pandas", "numpy", "any_agent", "gradio"],
+}
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, forbidden: list, repeat: int) -> dict:
+    """
+    Import a module in fresh interpreters.
+
+    Returns:
+        dict: Fastest import time in milliseconds and the forbidden modules that were loaded.
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, forbidden=forbidden)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return {"ms": None, "loaded": [], "error": result.stderr.strip().splitlines()[-1]}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or probe["ms"] < best["ms"]:
+            best = probe
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark.")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Report the fastest of this many imports."
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="Fail if any module takes longer than this to import.",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<40} {'import (ms)':>12}  eagerly loaded")
+    for module, forbidden in LAZY_DEPENDENCIES.items():
+        result = measure(module, forbidden, args.repeat)
+        if result.get("error"):
+            print(f"{module:<40} {'-':>12}  {result['error']}")
+            failed = True
+            continue
+        too_slow = args.max_ms is not None and result["ms"] > args.max_ms
+        failed = failed or too_slow or bool(result["loaded"])
+        print(
+            f"{module:<40} {result['ms']:>12.1f}  {', '.join(result['loaded']) or '-'}"
+            + ("  (too slow)" if too_slow else "")
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark the per-URL cost of building and signing Street View requests.
+
+Usage:
+    python -m source.benchmarks.bench_signing --n-urls 100000
+"""
+
+import argparse
+import base64
+import os
+import time
+
+from source.the_machine.api.auth import RequestTemplate, sign_url
+from source.the_machine.api.client import image_query
+from source.the_machine.config import DEFAULT_API_PARAMS, STREETVIEW_API_URL
+
+
+def _legacy_sign(location, key, secret, params):
+    """The original f-string construction followed by `sign_url`, kept as a baseline."""
+    url_request = (
+        f"{STREETVIEW_API_URL}?key={key}&size={params['size']}"
+        f"&location={location}&radius={params['radius']}&fov={params['fov']}"
+        f"&heading={params['heading']}&return_error_code={params['return_error_code']}"
+    )
+    if params.get("source") and params["source"] != "default":
+        url_request += f"&source={params['source']}"
+    if params.get("pitch"):
+        url_request += f"&pitch={params['pitch']}"
+    return sign_url(input_url=url_request, secret=secret)
+
+
+def _best_of(repeat, func):
+    """Run a function several times and return its last result and fastest time."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _report(name, elapsed, n_urls):
+    print(f"{name:>26} {elapsed:>10.3f} {elapsed / n_urls * 1e6:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="URL signing benchmark.")
+    parser.add_argument("--n-urls", type=int, default=100_000)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Report the fastest of this many runs."
+    )
+    args = parser.parse_args()
+
+    key = "AIzaSyBenchmarkKey"
+    secret = base64.urlsafe_b64encode(os.urandom(20)).decode()
+    params = DEFAULT_API_PARAMS
+    locations = [
+        f"{37.9 + i * 1e-6:.6f},{23.7 + i * 1e-6:.6f}" for i in range(args.n_urls)
+    ]
+
+    template = RequestTemplate(STREETVIEW_API_URL, key, secret)
+
+    print(f"{'':>26} {'total (s)':>10} {'us / URL':>10}")
+    legacy, elapsed = _best_of(
+        args.repeat,
+        lambda: [_legacy_sign(location, key, secret, params) for location in locations],
+    )
+    _report("f-string + sign_url", elapsed, args.n_urls)
+    signed, elapsed = _best_of(
+        args.repeat,
+        lambda: [template.sign(image_query(location, params)) for location in locations],
+    )
+    _report("RequestTemplate.sign", elapsed, args.n_urls)
+    batch, elapsed = _best_of(
+        args.repeat,
+        lambda: template.sign_many(image_query(location, params) for location in locations),
+    )
+    _report("RequestTemplate.sign_many", elapsed, args.n_urls)
+
+    assert legacy == signed == batch, "The signed URLs differ"
+
+
+if __name__ == "__main__":
+    main()
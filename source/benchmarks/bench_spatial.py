@@ -0,0 +1,106 @@
+"""
+Benchmark proximity lookups of the photo index against a linear scan.
+
+Photos are spread uniformly over a bounding box, so that a query only has a few photos
+within its radius; the index answers from the geohash cells around the point while the
+scan measures the distance of every photo.
+
+Usage:
+    python -m source.benchmarks.bench_spatial --n-photos 1000000 --radius 10
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from source.the_machine.locations.geohash import EARTH_RADIUS_METERS
+from source.the_machine.storage.photo_index import PhotoIndex, PhotoRecord
+
+
+def _best_of(repeat, func):
+    """Run a function several times and return its last result and fastest time."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _report(name, elapsed, n):
+    print(f"{name:>30} {elapsed:>10.3f} {elapsed / n * 1e3:>12.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Photo index benchmark.")
+    parser.add_argument("--n-photos", type=int, default=1_000_000)
+    parser.add_argument("--n-queries", type=int, default=1_000)
+    parser.add_argument("--radius", type=float, default=10.0, help="Meters.")
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        default=(37.9, 38.1, 23.6, 23.9),
+        metavar=("MIN_LAT", "MAX_LAT", "MIN_LON", "MAX_LON"),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Report the fastest of this many runs."
+    )
+    args = parser.parse_args()
+    min_lat, max_lat, min_lon, max_lon = args.bbox
+
+    random.seed(0)
+
+    def random_point():
+        return random.uniform(min_lat, max_lat), random.uniform(min_lon, max_lon)
+
+    photos = [(*random_point(), random.uniform(0, 360)) for _ in range(args.n_photos)]
+    # Half of the queries are about 2 m from a photo, half are anywhere
+    queries = []
+    for n in range(args.n_queries):
+        lat, lon, _ = photos[random.randrange(args.n_photos)]
+        queries.append((lat + 2e-5, lon) if n % 2 else random_point())
+
+    lats, lons = np.radians(np.array(photos)[:, :2]).T
+
+    def linear_scan():
+        counts = []
+        for lat, lon in queries:
+            phi = np.radians(lat)
+            a = (
+                np.sin((lats - phi) / 2) ** 2
+                + np.cos(phi) * np.cos(lats) * np.sin((lons - np.radians(lon)) / 2) ** 2
+            )
+            distances = 2 * EARTH_RADIUS_METERS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+            counts.append(int((distances <= args.radius).sum()))
+        return counts
+
+    with tempfile.TemporaryDirectory() as directory:
+        with PhotoIndex(os.path.join(directory, "photos.sqlite")) as index:
+            start = time.perf_counter()
+            index.add_many(
+                PhotoRecord(f"photo_{i}.jpg", lat, lon, heading)
+                for i, (lat, lon, heading) in enumerate(photos)
+            )
+            build = time.perf_counter() - start
+
+            print(f"{str(args.n_photos) + ' photos':>30} {'total (s)':>10} {'ms / query':>12}")
+            print(f"{'build PhotoIndex':>30} {build:>10.3f}")
+            scanned, elapsed = _best_of(args.repeat, linear_scan)
+            _report("NumPy linear scan", elapsed, args.n_queries)
+            indexed, elapsed = _best_of(
+                args.repeat,
+                lambda: [len(index.nearby(lat, lon, args.radius)) for lat, lon in queries],
+            )
+            _report("PhotoIndex.nearby", elapsed, args.n_queries)
+    # The scan can differ from the index by photos exactly at the radius, by rounding
+    mismatches = sum(a != b for a, b in zip(scanned, indexed))
+    print(f"{sum(indexed)} photos found, {mismatches} queries differ from the scan")
+
+
+if __name__ == "__main__":
+    main()
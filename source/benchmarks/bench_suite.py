@@ -0,0 +1,385 @@
+"""
+Benchmark fetching and location generation end to end against a local mock server.
+
+Every scenario runs against `mock_server.MockServer`, so no quota is spent. Each reports
+requests per second, p50/p95/p99 request latency, bytes written and peak Python memory.
+Results are appended to a JSON-lines file together with the current commit, and
+--compare shows the change against the latest results of another commit.
+
+Usage:
+    python -m source.benchmarks.bench_suite --n-locations 200 --latency-ms 50 --compare
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from requests.adapters import HTTPAdapter
+
+from source import agentic_machine
+from source.benchmarks.mock_server import (
+    MockServer,
+    add_config_arguments,
+    config_from_arguments,
+)
+from source.the_machine.api import nominatim
+from source.the_machine.api.cache import ImageCache
+from source.the_machine.api.client import fetch_images
+from source.the_machine.api.geocache import GeocodeCache
+from source.the_machine.api.ratelimit import get_limiter
+from source.the_machine.config import (
+    DEFAULT_API_PARAMS,
+    DEFAULT_LOCATION_PARAMS,
+    DEFAULT_WORKERS,
+)
+from source.the_machine.locations.generator import SAMPLING_METHODS, iter_locations
+
+DEFAULT_OUTPUT = "benchmark_results.jsonl"
+
+GEOCODE_QUERIES = ["Athens", "Piraeus", "Kifisia", "Glyfada", "Marousi"]
+
+
+@contextlib.contextmanager
+def record_requests():
+    """
+    Record the latency of every HTTP request sent through `requests` while active.
+
+    Yields:
+        list: Latencies in seconds, appended as requests complete.
+    """
+    latencies = []
+    send = HTTPAdapter.send
+
+    def timed_send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(self, request, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    HTTPAdapter.send = timed_send
+    try:
+        yield latencies
+    finally:
+        HTTPAdapter.send = send
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Scenarios:
+    """
+    The benchmark scenarios, each a method taking a working directory and returning
+    the number of items it processed and the number of errors.
+
+    Args:
+        server (MockServer): The running mock server.
+        locations_file (str): CSV of locations to fetch.
+        coordinates (list): The same locations as 'lat,lng' strings, for the agent tools.
+        n_generate (int): Number of locations for the generator scenarios.
+    """
+
+    def __init__(
+        self,
+        server: MockServer,
+        locations_file: str,
+        coordinates: List[str],
+        n_generate: int,
+    ):
+        self.server = server
+        self.locations_file = locations_file
+        self.coordinates = coordinates
+        self.n_generate = n_generate
+
+    def all(self) -> Dict[str, Callable]:
+        scenarios = {
+            "fetch_sequential": lambda d: self._fetch(d, workers=1),
+            "fetch_concurrent": lambda d: self._fetch(d, workers=DEFAULT_WORKERS),
+            "fetch_preflight": lambda d: self._fetch(d, workers=DEFAULT_WORKERS, preflight=True),
+            "fetch_dedupe": lambda d: self._fetch(d, workers=DEFAULT_WORKERS, dedupe=True),
+            "fetch_capture": lambda d: self._fetch(
+                d, workers=DEFAULT_WORKERS, headings=[0, 90, 180, 270]
+            ),
+            "agent_photo": self._agent_photo,
+            "agent_photos": self._agent_photos,
+            "geocode": lambda d: self._geocode(d, cached=False),
+            "geocode_cached": lambda d: self._geocode(d, cached=True),
+        }
+        for method in SAMPLING_METHODS:
+            scenarios[f"generate_{method}"] = (
+                lambda d, method=method: self._generate(d, method)
+            )
+        return scenarios
+
+    def _fetch(
+        self,
+        directory: str,
+        workers: int,
+        preflight: bool = False,
+        dedupe: bool = False,
+        **params,
+    ) -> tuple:
+        params = {**DEFAULT_API_PARAMS, "n_addresses": len(self.coordinates), **params}
+        results = fetch_images(
+            self.locations_file,
+            params=params,
+            save_dir=directory,
+            manual_check=False,
+            workers=workers,
+            use_cache=False,
+            preflight=preflight,
+            dedupe=dedupe,
+            api_url=self.server.streetview_url,
+        )
+        return len(results), sum(not result.ok for result in results)
+
+    def _agent_photo(self, directory: str) -> tuple:
+        errors = 0
+        for place in self.coordinates:
+            try:
+                agentic_machine.get_photo_from_street_view(place, "640x640", 90, 0)
+            except ValueError:
+                errors += 1
+        return len(self.coordinates), errors
+
+    def _agent_photos(self, directory: str) -> tuple:
+        result = agentic_machine.get_photos_from_street_view(
+            self.coordinates, "640x640", 90, 0
+        )
+        return len(self.coordinates), len(result["errors"])
+
+    def _geocode(self, directory: str, cached: bool) -> tuple:
+        nominatim._geocode_cache = GeocodeCache(os.path.join(directory, "geocode.sqlite"))
+        try:
+            for _ in range(2 if cached else 1):
+                for query in GEOCODE_QUERIES:
+                    nominatim.search(
+                        query, api_url=self.server.nominatim_url, use_cache=cached
+                    )
+        finally:
+            nominatim._geocode_cache.close()
+            nominatim._geocode_cache = None
+        return len(GEOCODE_QUERIES) * (2 if cached else 1), 0
+
+    def _generate(self, directory: str, method: str) -> tuple:
+        params = {**DEFAULT_LOCATION_PARAMS, "method": method, "n_locs": self.n_generate}
+        output_file = os.path.join(directory, f"{method}.csv")
+        n_points = sum(len(chunk) for chunk in iter_locations(params, output_file=output_file))
+        return n_points, 0
+
+
+def run_scenario(name: str, func: Callable) -> dict:
+    """
+    Run a scenario in a fresh working directory and measure it.
+
+    Returns:
+        dict: The metrics of the scenario.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)  # the agent tools save photos to the working directory
+        agentic_machine._image_cache = ImageCache(os.path.join(directory, "cache"))
+        tracemalloc.start()
+        try:
+            with record_requests() as latencies, contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                items, errors = func(directory)
+                elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            os.chdir(cwd)
+            agentic_machine._image_cache = None
+        bytes_written = directory_size(directory)
+
+    return {
+        "scenario": name,
+        "items": items,
+        "errors": errors,
+        "requests": len(latencies),
+        "elapsed_s": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else None,
+        "items_per_s": items / elapsed if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "bytes_written": bytes_written,
+        "peak_mib": peak / 2**20,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+def _format(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_result(result: dict, baseline: Optional[dict] = None):
+    row = (
+        f"{result['scenario']:<20} {result['items']:>8} {result['errors']:>6} "
+        f"{result['requests']:>8} {_format(result['rps'], '.1f'):>8} "
+        f"{_format(result['items_per_s'], '.1f'):>10} "
+        f"{_format(result['p50_ms'], '.1f'):>8} {_format(result['p95_ms'], '.1f'):>8} "
+        f"{_format(result['p99_ms'], '.1f'):>8} "
+        f"{result['bytes_written'] / 2**20:>9.2f} {result['peak_mib']:>9.1f}"
+    )
+    if baseline:
+        row += "  " + _compare(result, baseline)
+    print(row)
+
+
+def _compare(result: dict, baseline: dict) -> str:
+    changes = []
+    for metric in ("items_per_s", "p95_ms", "peak_mib"):
+        if result.get(metric) and baseline.get(metric):
+            changes.append(f"{metric} {result[metric] / baseline[metric] - 1:+.0%}")
+    return ", ".join(changes)
+
+
+def load_baselines(path: str, commit: Optional[str]) -> Dict[str, dict]:
+    """
+    Load the latest result of every scenario recorded for a commit other than `commit`.
+    """
+    baselines = {}
+    if not os.path.exists(path):
+        return baselines
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get("commit") != commit:
+                baselines[record["scenario"]] = record
+    return baselines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a mock server.")
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=None,
+        help="Scenarios to run (default: all). Use --list to see them.",
+    )
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit.")
+    parser.add_argument("--n-locations", type=int, default=100, help="Locations to fetch.")
+    parser.add_argument(
+        "--n-generate", type=int, default=100_000, help="Locations to generate per method."
+    )
+    parser.add_argument(
+        "--streetview-rate",
+        type=float,
+        default=None,
+        help="Override the Street View rate limit (requests per second), e.g. to find "
+        "the client's own ceiling.",
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON-lines results file.")
+    parser.add_argument("--no-save", action="store_true", help="Do not save the results.")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Show the change against the latest results of another commit in --output.",
+    )
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    # Placeholder credentials; requests only ever reach the mock server
+    os.environ["STREET_VIEW_API_KEY"] = "benchmark-key"
+    os.environ["STREET_VIEW_API_SECRET"] = "YmVuY2htYXJrLXNlY3JldA=="
+    if args.streetview_rate:
+        limiter = get_limiter("streetview")
+        limiter.rate = limiter.burst = args.streetview_rate
+
+    config = config_from_arguments(args)
+    commit = git_commit()
+    baselines = load_baselines(args.output, commit) if args.compare else {}
+
+    with MockServer(config) as server, tempfile.TemporaryDirectory() as directory:
+        # The agent tools take no URL argument, they always call the configured API
+        agentic_machine.STREETVIEW_API_URL = server.streetview_url
+        # Fetched locations are spread over a small area, so that some share a panorama
+        locations_file = os.path.join(directory, "locations.csv")
+        location_params = {
+            **DEFAULT_LOCATION_PARAMS,
+            "method": "halton",
+            "n_locs": args.n_locations,
+            "max_lat": DEFAULT_LOCATION_PARAMS["min_lat"] + 10_000,
+            "max_lon": DEFAULT_LOCATION_PARAMS["min_lon"] + 10_000,
+        }
+        coordinates = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for chunk in iter_locations(location_params, output_file=locations_file):
+                coordinates.extend(f"{row.lat},{row.long}" for row in chunk.itertuples())
+
+        scenarios = Scenarios(server, locations_file, coordinates, args.n_generate).all()
+        if args.list:
+            print("\n".join(scenarios))
+            return
+        names = args.scenarios or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        print(
+            f"{'scenario':<20} {'items':>8} {'errors':>6} {'requests':>8} {'rps':>8} "
+            f"{'items / s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'MB written':>9} {'peak MiB':>9}"
+        )
+        results = []
+        for name in names:
+            result = run_scenario(name, scenarios[name])
+            print_result(result, baselines.get(name))
+            results.append(result)
+
+    if not args.no_save:
+        timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with open(args.output, "a") as file:
+            for result in results:
+                record = {
+                    "timestamp": timestamp,
+                    "commit": commit,
+                    "server": vars(config),
+                    "n_locations": args.n_locations,
+                    "n_generate": args.n_generate,
+                    **result,
+                }
+                file.write(json.dumps(record) + "\n")
+        print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
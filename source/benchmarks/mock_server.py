@@ -0,0 +1,262 @@
+"""
+Local stand-in for the Street View and Nominatim APIs, for benchmarks that do not spend quota.
+
+Usage:
+    python -m source.benchmarks.mock_server --port 8080 --latency-ms 80 --not-found-rate 0.2
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class MockConfig:
+    """
+    Behaviour of the mock server.
+
+    Attributes:
+        image_bytes (int): Size of every image response.
+        latency_ms (float): Time spent before answering every request.
+        jitter_ms (float): Extra random latency, uniform in [0, jitter_ms].
+        not_found_rate (float): Fraction of locations without imagery. Such locations get
+            ZERO_RESULTS from the metadata endpoint and 404 for images.
+        burst_every (int): Every this many requests, start a burst of 429 responses; 0 disables bursts.
+        burst_length (int): Number of requests answered with 429 in every burst.
+        retry_after (float): Seconds sent in the Retry-After header of 429 responses.
+        pano_precision (int): Locations are snapped to panoramas by rounding to this many
+            decimals, so nearby locations share a panorama ID.
+    """
+
+    image_bytes: int = 50_000
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    not_found_rate: float = 0.1
+    burst_every: int = 0
+    burst_length: int = 5
+    retry_after: float = 0.2
+    pano_precision: int = 3
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients may drop a connection without reading the response, e.g. a 404
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    """
+    Threaded HTTP server with Street View ('/streetview', '/streetview/metadata') and
+    Nominatim ('/search') endpoints, run in a background thread.
+
+    Args:
+        config (MockConfig, optional): Behaviour of the server.
+        port (int): Port to listen on; 0 picks a free port.
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None, port: int = 0):
+        self.config = config or MockConfig()
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._image = self._make_image(self.config.image_bytes)
+        self._httpd = _QuietHTTPServer(("127.0.0.1", port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    @property
+    def streetview_url(self) -> str:
+        return f"{self.url}/streetview"
+
+    @property
+    def nominatim_url(self) -> str:
+        return self.url
+
+    @staticmethod
+    def _make_image(size: int) -> bytes:
+        # JPEG start and end markers around padding, enough to pass as an image
+        return b"\xff\xd8\xff\xe0" + b"\x00" * max(size - 6, 0) + b"\xff\xd9"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _throttle(self) -> bool:
+        """Count a request and tell whether it falls in a burst of 429 responses."""
+        config = self.config
+        with self._lock:
+            self.requests += 1
+            if not config.burst_every:
+                return False
+            throttled = (self.requests - 1) % config.burst_every < config.burst_length
+            self.throttled += throttled
+            return throttled
+
+    def _has_imagery(self, location: str) -> bool:
+        return zlib.crc32(location.encode()) % 10_000 >= self.config.not_found_rate * 10_000
+
+    def _pano(self, location: str) -> dict:
+        lat, lng = (float(value) for value in location.split(","))
+        lat = round(lat, self.config.pano_precision)
+        lng = round(lng, self.config.pano_precision)
+        return {
+            "status": "OK",
+            "pano_id": f"pano_{lat}_{lng}",
+            "location": {"lat": lat, "lng": lng},
+            "date": "2020-05",
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, Nagle's algorithm
+            # delays the body of keep-alive responses
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, body: bytes, content_type: str, headers=None):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                config = server.config
+                time.sleep((config.latency_ms + random.uniform(0, config.jitter_ms)) / 1000)
+                if server._throttle():
+                    self._send(
+                        429,
+                        b"Too Many Requests",
+                        "text/plain",
+                        {"Retry-After": str(config.retry_after)},
+                    )
+                    return
+
+                url = urlparse(self.path)
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                if url.path == "/search":
+                    self._search(query)
+                elif url.path == "/streetview/metadata":
+                    self._metadata(query)
+                elif url.path == "/streetview":
+                    self._image(query)
+                else:
+                    self._send(404, b"Not Found", "text/plain")
+
+            def _search(self, query):
+                name = query.get("q", "")
+                seed = zlib.crc32(name.encode())
+                lat = 37.9 + (seed % 1000) / 10_000
+                lon = 23.7 + (seed // 1000 % 1000) / 10_000
+                result = {
+                    "display_name": name,
+                    "lat": f"{lat:.7f}",
+                    "lon": f"{lon:.7f}",
+                    "boundingbox": [f"{lat - 0.01:.7f}", f"{lat + 0.01:.7f}", f"{lon - 0.01:.7f}", f"{lon + 0.01:.7f}"],
+                }
+                if query.get("polygon_geojson"):
+                    result["geojson"] = {
+                        "type": "Polygon",
+                        "coordinates": [
+                            [[lon - 0.01, lat - 0.01], [lon + 0.01, lat - 0.01], [lon, lat + 0.01], [lon - 0.01, lat - 0.01]]
+                        ],
+                    }
+                self._send(200, json.dumps([result]).encode(), "application/json")
+
+            def _metadata(self, query):
+                location = query.get("location", "")
+                if not server._has_imagery(location):
+                    body = {"status": "ZERO_RESULTS"}
+                else:
+                    body = server._pano(location)
+                self._send(200, json.dumps(body).encode(), "application/json")
+
+            def _image(self, query):
+                if not server._has_imagery(query.get("location", "")):
+                    self._send(404, b"Not Found", "text/plain")
+                    return
+                self._send(200, server._image, "image/jpeg")
+
+        return Handler
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the options of MockConfig to a command line parser.
+    """
+    defaults = MockConfig()
+    parser.add_argument("--image-bytes", type=int, default=defaults.image_bytes)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--not-found-rate", type=float, default=defaults.not_found_rate)
+    parser.add_argument(
+        "--burst-every",
+        type=int,
+        default=defaults.burst_every,
+        help="Start a burst of 429 responses every this many requests (0 disables bursts).",
+    )
+    parser.add_argument("--burst-length", type=int, default=defaults.burst_length)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+
+
+def config_from_arguments(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        image_bytes=args.image_bytes,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        not_found_rate=args.not_found_rate,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+        retry_after=args.retry_after,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Street View and Nominatim server.")
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(config_from_arguments(args), port=args.port)
+    print(f"Street View: {server.streetview_url}  Nominatim: {server.nominatim_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
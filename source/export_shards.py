@@ -0,0 +1,39 @@
+import argparse
+
+from source.the_machine.storage.shards import ShardStore
+
+
+def main(store_dir: str, output_dir: str, prefix: str = ""):
+    """
+    Export the images of a shard store back to plain files, named after their keys.
+
+    Args:
+        store_dir (str): Directory of the shard store.
+        output_dir (str): Directory to write the images to.
+        prefix (str): Only export the images whose key starts with this prefix.
+    """
+    with ShardStore(store_dir) as store:
+        print(f"Shard store {store_dir}:", store.stats())
+        n_exported = store.export(output_dir, prefix=prefix)
+    print(f"Exported {n_exported} images to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the images of a shard store to plain files."
+    )
+    parser.add_argument("store_dir", help="Directory of the shard store.")
+    parser.add_argument("output_dir", help="Directory to write the images to.")
+    parser.add_argument(
+        "--prefix", default="", help="Only export the images whose key starts with this."
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Recreate the index from the shards before exporting, e.g. if it was lost.",
+    )
+    args = parser.parse_args()
+    if args.rebuild_index:
+        with ShardStore(args.store_dir) as store:
+            store.rebuild_index()
+    main(args.store_dir, args.output_dir, prefix=args.prefix)
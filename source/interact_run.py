@@ -1,8 +1,9 @@
 import os
 import sys
 import getpass
-from source.the_machine.locations.generator import create_locations
-from source.the_machine.api.client import fetch_images
+
+# The generator, API client and their dependencies (NumPy, requests) are imported where
+# they are first needed, so the first prompt shows up without waiting for them to load.
 
 
 def prompt_for_int(prompt_message: str, default=None):
@@ -36,32 +37,57 @@ def generate_file():
     Returns:
         str: The file path of the generated CSV file.
     """
-    print(
-        "Please input the bounding box coordinates without dots or commas and press Enter."
-    )
     params = {}
-    params["min_lat"] = prompt_for_int("\tMinimum Latitude (South Limit): ")
-    params["max_lat"] = prompt_for_int("\tMaximum Latitude (North Limit): ")
-    params["min_lon"] = prompt_for_int("\tMinimum Longitude (West Limit): ")
-    params["max_lon"] = prompt_for_int("\tMaximum Longitude (East Limit): ")
+    area = input(
+        "Path to a GeoJSON file or name of a place to sample inside "
+        "(press Enter to input a bounding box instead): "
+    ).strip()
+    if os.path.isfile(area):
+        params["area"] = area
+    elif area:
+        from source.the_machine.api.nominatim import fetch_area_boundary
+
+        try:
+            params["area"] = fetch_area_boundary(area)
+        except Exception as e:
+            print("Error fetching the area boundary:", e)
+            sys.exit(1)
+    else:
+        print(
+            "Please input the bounding box coordinates in microdegrees (degrees x 1000000, "
+            "e.g. 37946894 for 37.946894) and press Enter."
+        )
+        params["min_lat"] = prompt_for_int("\tMinimum Latitude (South Limit): ")
+        params["max_lat"] = prompt_for_int("\tMaximum Latitude (North Limit): ")
+        params["min_lon"] = prompt_for_int("\tMinimum Longitude (West Limit): ")
+        params["max_lon"] = prompt_for_int("\tMaximum Longitude (East Limit): ")
 
     # Select method for location generation.
+    methods = {"1": "random", "2": "even", "3": "halton", "4": "sobol", "5": "poisson"}
     while True:
         method_input = (
             input(
-                "Input method (1 for random, 2 for even; default is random): "
+                "Input method (1 for random, 2 for even, 3 for halton, 4 for sobol, "
+                "5 for poisson; default is random): "
             ).strip()
             or "1"
         )
-        if method_input in ["1", "2"]:
-            params["method"] = "random" if method_input == "1" else "even"
+        if method_input in methods:
+            params["method"] = methods[method_input]
             break
         else:
-            print("Invalid selection. Please input 1 or 2.")
+            print("Invalid selection. Please input a number from 1 to 5.")
+
+    if params["method"] == "poisson":
+        params["min_distance"] = prompt_for_int(
+            "Minimum distance between locations in meters (default 50): ", default=50
+        )
 
     # Number of locations to generate.
     params["n_locs"] = prompt_for_int("Number of locations (default 10): ", default=10)
 
+    from source.the_machine.locations.generator import create_locations
+
     try:
         file_path = create_locations(params)
         print("CSV file created:", file_path)
@@ -99,6 +125,11 @@ def make_request(file_path: str):
     params["heading"] = input("\tHeading (default 0): ").strip() or "0"
     params["radius"] = input("\tRadius in meters (default 50): ").strip() or "50"
     params["pitch"] = input("\tPitch (default 10): ").strip() or "10"
+    headings = input(
+        "\tHeadings for several views per location, e.g. 0,90,180,270 (default none): "
+    ).strip()
+    if headings:
+        params["headings"] = [heading.strip() for heading in headings.split(",")]
     params["source"] = "default"
     params["return_error_code"] = "true"
 
@@ -110,6 +141,8 @@ def make_request(file_path: str):
     for key, value in params.items():
         print(f"\t{key}: {value}")
 
+    from source.the_machine.api.client import fetch_images
+
     try:
         fetch_images(input_file=file_path, params=params)
     except Exception as e:
@@ -0,0 +1,123 @@
+import argparse
+import os
+
+from source.the_machine.config import (
+    DEFAULT_API_PARAMS,
+    DEFAULT_LOCATION_PARAMS,
+    DEFAULT_SAVE_DIR,
+    DEFAULT_WORKERS,
+    TILE_GEOHASH_PRECISION,
+    TILE_LEASE_SECONDS,
+)
+
+
+def main():
+    """
+    Fetch a large bounding box as geohash tiles, with several processes and machines.
+
+    'run' splits DEFAULT_LOCATION_PARAMS into tiles and fetches them with local worker
+    processes; running it again resumes the run. 'worker' joins a run from another
+    machine that shares its directory. 'status' shows the progress of a run.
+    """
+    parser = argparse.ArgumentParser(description="The Lonely Machine. Tiled runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Plan the tiles and fetch them locally.")
+    run.add_argument("--save-dir", default=DEFAULT_SAVE_DIR)
+    run.add_argument("--processes", type=int, default=4, help="Local worker processes.")
+    run.add_argument(
+        "--precision",
+        type=int,
+        default=TILE_GEOHASH_PRECISION,
+        help="Geohash precision of the tiles (6 is about 1.2 x 0.6 km).",
+    )
+    run.add_argument(
+        "--n-locs",
+        type=int,
+        default=DEFAULT_LOCATION_PARAMS["n_locs"],
+        help="Locations over the whole bounding box, spread over the tiles by area.",
+    )
+    run.add_argument(
+        "--n-addresses",
+        type=int,
+        default=None,
+        help="Maximum locations fetched per tile; by default every location is fetched.",
+    )
+    run.add_argument(
+        "--method",
+        default=DEFAULT_LOCATION_PARAMS["method"],
+        help="Sampling method of the locations in every tile.",
+    )
+
+    worker = subparsers.add_parser("worker", help="Join a run, e.g. from another machine.")
+    worker.add_argument("queue", help="Path of the run's tiles.sqlite.")
+    worker.add_argument(
+        "--save-dir", default=None, help="Directory of the run; defaults to the queue's."
+    )
+    worker.add_argument(
+        "--rate-share",
+        type=float,
+        default=1.0,
+        help="Part of the Street View rate limit this worker may use, e.g. 0.5 when two "
+        "workers share an API key.",
+    )
+
+    status = subparsers.add_parser("status", help="Show the tiles per status.")
+    status.add_argument("queue", help="Path of the run's tiles.sqlite.")
+
+    for subparser in (run, worker):
+        subparser.add_argument(
+            "--workers",
+            type=int,
+            default=DEFAULT_WORKERS,
+            help="Concurrent requests of every worker process.",
+        )
+        subparser.add_argument(
+            "--lease-seconds",
+            type=float,
+            default=TILE_LEASE_SECONDS,
+            help="Time after which the tile of a silent worker is handed out again.",
+        )
+    args = parser.parse_args()
+    if args.command != "run" and not os.path.exists(args.queue):
+        parser.error(f"No tile queue at {args.queue}; start the run first.")
+
+    # Imported here so that argument parsing does not wait for requests to load
+    from source.the_machine.jobs.orchestrator import run_tiled, run_worker
+    from source.the_machine.jobs.tiles import TileQueue
+
+    if args.command == "run":
+        location_params = {
+            **DEFAULT_LOCATION_PARAMS,
+            "n_locs": args.n_locs,
+            "method": args.method,
+        }
+        api_params = None
+        if args.n_addresses is not None:
+            api_params = {**DEFAULT_API_PARAMS, "n_addresses": args.n_addresses}
+        run_tiled(
+            location_params,
+            api_params=api_params,
+            save_dir=args.save_dir,
+            precision=args.precision,
+            n_processes=args.processes,
+            lease_seconds=args.lease_seconds,
+            workers=args.workers,
+        )
+    elif args.command == "worker":
+        n_completed = run_worker(
+            args.queue,
+            save_dir=args.save_dir,
+            lease_seconds=args.lease_seconds,
+            workers=args.workers,
+            rate_share=args.rate_share,
+        )
+        print(f"Completed {n_completed} tiles.")
+    else:
+        queue = TileQueue(args.queue)
+        print(queue.counts())
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,21 @@
 # Sourced from : https://developers.google.com/maps/digital-signature
 """Signs a URL using a URL signing secret"""
 
+import functools
 import hashlib
 import hmac
 import base64
+import re
 import urllib.parse as urlparse
+from typing import Iterable, List
+
+# Query values made only of these characters need no percent-encoding
+_is_url_safe = re.compile(r"[\w.\-~,]*\Z", re.ASCII).match
+
+
+def _encode_value(value) -> str:
+    value = str(value)
+    return value if _is_url_safe(value) else urlparse.quote(value, safe=",")
 
 
 def sign_url(input_url=None, secret=None):
@@ -44,3 +55,98 @@ def sign_url(input_url=None, secret=None):
 
     # Return signed URL
     return original_url + "&signature=" + encoded_signature.decode()
+
+
+class RequestTemplate:
+    """
+    Reusable builder of signed requests to one API endpoint.
+
+    The signing secret is decoded once and kept as a pre-keyed HMAC state, which is copied
+    for every URL instead of being rebuilt from the secret. Query values are percent-encoded,
+    so the signature always matches the URL that is sent.
+
+    Args:
+        url (str): URL of the endpoint, e.g. 'https://maps.googleapis.com/maps/api/streetview'.
+        key (str): Google API key.
+        secret (str): URL signing secret, base64-encoded.
+    """
+
+    def __init__(self, url: str, key: str, secret: str):
+        if not url or not key or not secret:
+            raise ValueError("url, key and secret are required")
+        split = urlparse.urlsplit(url)
+        self._origin = f"{split.scheme}://{split.netloc}"
+        self._prefix = f"{split.path}?key={urlparse.quote(key, safe='')}"
+        self._hmac = hmac.new(base64.urlsafe_b64decode(secret), digestmod=hashlib.sha1)
+
+    def sign(self, query: dict) -> str:
+        """
+        Build and sign the URL of a request.
+
+        Args:
+            query (dict): Query parameters in the order they should appear; None values are left out.
+
+        Returns:
+            str: The signed request URL.
+        """
+        return self.sign_many([query])[0]
+
+    def sign_many(self, queries: Iterable[dict]) -> List[str]:
+        """
+        Build and sign the URLs of many requests.
+
+        Args:
+            queries (Iterable): Query parameters of every request, see `sign`.
+
+        Returns:
+            list: The signed request URLs, in input order.
+        """
+        encode_value = _encode_value
+        encode = base64.urlsafe_b64encode
+        keyed = self._hmac
+        origin, prefix = self._origin, self._prefix
+        urls = []
+        for query in queries:
+            path = prefix + "".join(
+                [
+                    f"&{name}={encode_value(value)}"
+                    for name, value in query.items()
+                    if value is not None
+                ]
+            )
+            signature = keyed.copy()
+            signature.update(path.encode())
+            urls.append(
+                f"{origin}{path}&signature={encode(signature.digest()).decode()}"
+            )
+        return urls
+
+
+@functools.lru_cache(maxsize=16)
+def get_request_template(url: str, key: str, secret: str) -> RequestTemplate:
+    """
+    Get a shared request template for an endpoint and set of credentials.
+
+    Args:
+        See `RequestTemplate`.
+
+    Returns:
+        RequestTemplate: The template, created on first use.
+    """
+    return RequestTemplate(url, key, secret)
+
+
+_credential_params = re.compile(r"\b(key|signature)=[^&\s]+")
+
+
+def redact_credentials(text: str) -> str:
+    """
+    Hide the API key and signature of any signed URL in a text, e.g. an error message.
+
+    Args:
+        text (str): Text that may contain signed URLs.
+
+    Returns:
+        str: The text with the values of 'key' and 'signature' replaced by 'REDACTED'.
+    """
+    return _credential_params.sub(r"\1=REDACTED", text)
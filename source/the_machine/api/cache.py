@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from ..config import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
+from .download import temporary_path
+
+# Request parameters that determine the returned image, with the values the API
+# assumes when a parameter is not sent.
+CACHE_KEY_PARAMS = {
+    "size": None,
+    "fov": "90",
+    "heading": None,
+    "pitch": "0",
+    "radius": "50",
+    "source": "default",
+}
+
+
+def request_key(location: str, params: dict) -> str:
+    """
+    Compute the cache key of an unsigned Street View request.
+
+    The key only depends on the parameters that change the image (location, size, fov,
+    heading, pitch, radius and source), so it is independent of credentials and signatures.
+
+    Args:
+        location (str): Formatted location string, e.g. '37.9838,23.7275'.
+        params (dict): Parameters for the Street View API request.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    canonical = {"location": str(location).replace(" ", "")}
+    for name, default in CACHE_KEY_PARAMS.items():
+        value = params.get(name)
+        canonical[name] = str(value).strip() if value not in (None, "") else default
+    encoded = json.dumps(canonical, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ImageCache:
+    """
+    Persistent on-disk cache of Street View images with LRU eviction.
+
+    Images are stored as files named after their request key and indexed in a SQLite
+    database that tracks their size and last access time. When the total size exceeds
+    `max_bytes`, the least recently used images are evicted.
+
+    Args:
+        cache_dir (str): Directory holding the images and the index.
+        max_bytes (int): Maximum total size of the cached images in bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.cache_dir / "index.sqlite", check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def get_path(self, key: str) -> Optional[Path]:
+        """
+        Look up an image and mark it as recently used.
+
+        Args:
+            key (str): Request key from `request_key`.
+
+        Returns:
+            Path: Location of the cached image, or None on a miss.
+        """
+        path = self._path(key)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or not path.exists():
+                if row is not None:
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+            self.hits += 1
+        return path
+
+    def copy_to(self, key: str, filename: str) -> bool:
+        """
+        Copy a cached image to a destination file, atomically.
+
+        Args:
+            key (str): Request key from `request_key`.
+            filename (str): Destination path.
+
+        Returns:
+            bool: True on a cache hit, False otherwise, including when the image is evicted
+                by another thread or process while it is being copied.
+        """
+        path = self.get_path(key)
+        if path is None:
+            return False
+        # Unique, as other threads and processes may copy the same image at the same time
+        tmp_path = temporary_path(filename)
+        try:
+            shutil.copyfile(path, tmp_path)
+        except FileNotFoundError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        os.replace(tmp_path, filename)
+        return True
+
+    def put(self, key: str, content: bytes):
+        """
+        Store an image and evict least recently used images if over the size limit.
+
+        Args:
+            key (str): Request key from `request_key`.
+            content (bytes): The image data.
+        """
+        self._store(key, len(content), lambda tmp_path: tmp_path.write_bytes(content))
+
+    def put_file(self, key: str, filename: str):
+        """
+        Store a copy of an image file, see `put`.
+
+        Args:
+            key (str): Request key from `request_key`.
+            filename (str): Path of the image.
+        """
+        self._store(
+            key,
+            os.path.getsize(filename),
+            lambda tmp_path: shutil.copyfile(filename, tmp_path),
+        )
+
+    def _store(self, key: str, size: int, write: Callable[[Path], None]):
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(temporary_path(str(path)))
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                (key, size, time.time()),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._path(key).unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Hit and miss counters of this instance, and the number and total size of cached images.
+        """
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def close(self):
+        self._db.close()
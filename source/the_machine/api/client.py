@@ -1,16 +1,52 @@
+import importlib.util
+import itertools
 import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
-import pandas as pd
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple, Union
 import requests
 from ..config import (
     DEFAULT_SAVE_DIR,
     STREETVIEW_API_URL,
     DEFAULT_API_PARAMS,
+    DEFAULT_WORKERS,
+    DEFAULT_CHUNK_SIZE,
+    HASH_BATCH_SIZE,
 )
-from .auth import sign_url
+from .auth import get_request_template, redact_credentials
+from .cache import ImageCache, request_key
+from .download import NotAnImageError, save_image
+from .metrics import (
+    InstrumentedAdapter,
+    get_metrics,
+    record_cache_lookup,
+    send_instrumented,
+)
+from .ratelimit import QuotaExceededError, get_limiter
+from ..jobs.manifest import (
+    DONE,
+    DUPLICATE,
+    FAILED,
+    FINISHED_STATUSES,
+    NEARBY,
+    NO_IMAGERY,
+    RUN_MODES,
+    JobManifest,
+)
+from ..locations.chunk import LocationChunk, read_csv_chunks
 from ..locations.processor import preprocess_location
+from ..storage.photo_index import PhotoIndex, PhotoRecord, parse_coordinates
+from ..storage.shards import ShardStore
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from ..images.duplicates import NearDuplicateDetector
+
 
 def get_credentials():
     """
@@ -30,6 +66,135 @@ def get_credentials():
     return key, secret
 
 
+@dataclass
+class FetchResult:
+    """
+    Outcome of a single Street View image request.
+
+    Attributes:
+        location (str): Formatted location string that was requested.
+        filename (str): Path the image was (or would have been) saved to.
+        status (str): One of 'done', 'failed' or 'skipped', 'duplicate' and 'no_imagery'
+            for images dropped by the near-duplicate check, or 'nearby' for locations not
+            fetched because of an earlier photo, which `filename` (and `views`) then name.
+        status_code (int, optional): HTTP status code of the response, if any.
+        error (str, optional): Error message when the request failed.
+        cached (bool): True if the image was served from the local cache.
+        pano_id (str, optional): Panorama the location resolved to, when known.
+        views (list, optional): In capture mode, the image of every view, in which case
+            `filename` is the directory holding them.
+            With a shard store, `filename` and `views` are keys in the store instead of paths.
+        sha256 (str, optional): Hex SHA-256 digest of the downloaded image.
+        duplicate_of (str, optional): Earlier image that this one is a near-duplicate of.
+        placeholder (bool): True if the image is blank or a "no imagery" placeholder.
+        quota_exceeded (bool): True if the request was not sent because the daily quota
+            of the Street View API is used up, see RATE_LIMITS.
+    """
+
+    location: str
+    filename: str
+    status: str
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    cached: bool = False
+    pano_id: Optional[str] = None
+    views: Optional[List[str]] = None
+    sha256: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    placeholder: bool = False
+    quota_exceeded: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "done"
+
+
+def create_session(pool_size: int = DEFAULT_WORKERS) -> requests.Session:
+    """
+    Create an HTTP session with a keep-alive connection pool.
+
+    Reusing one session across requests avoids paying a new TCP/TLS handshake
+    for every image. The session reports connection setup times to the request metrics.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host.
+
+    Returns:
+        requests.Session: The pooled session.
+    """
+    session = requests.Session()
+    adapter = InstrumentedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def ordered_map(func: Callable, items: Iterable, workers: int) -> Iterator:
+    """
+    Apply a function to items on a thread pool and yield results in input order.
+
+    At most `2 * workers` calls are in flight at any time, so arbitrarily long
+    iterables can be consumed without queueing every task up front.
+
+    Args:
+        func (Callable): Function called with a single item.
+        items (Iterable): Items to process.
+        workers (int): Number of worker threads.
+
+    Yields:
+        The result of `func(item)` for every item, in input order.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def image_query(location: str, params: dict) -> dict:
+    """
+    Query parameters of an image request, without the key and signature.
+
+    Args:
+        location (str): Formatted location string.
+        params (dict): Parameters for the Street View API request.
+
+    Returns:
+        dict: The query parameters, in request order. Parameters the API defaults are None.
+    """
+    return {
+        "size": params["size"],
+        "location": location,
+        "radius": params["radius"],
+        "fov": params["fov"],
+        "heading": params["heading"],
+        "return_error_code": params["return_error_code"],
+        "source": params["source"] if params.get("source") not in (None, "default") else None,
+        "pitch": params["pitch"] if params.get("pitch") else None,
+    }
+
+
+def metadata_query(location: str, params: dict) -> dict:
+    """
+    Query parameters of a metadata request, without the key and signature.
+
+    Args:
+        location (str): Formatted location string.
+        params (dict): Parameters for the Street View API request; only radius and source are used.
+
+    Returns:
+        dict: The query parameters, in request order. Parameters the API defaults are None.
+    """
+    return {
+        "location": location,
+        "radius": params["radius"],
+        "source": params["source"] if params.get("source") not in (None, "default") else None,
+    }
+
+
 def fetch_image_from_location(
     location: str,
     key: str,
@@ -37,7 +202,11 @@ def fetch_image_from_location(
     params: dict,
     filename: str,
     manual_check: bool = True,
-):
+    session: Optional[requests.Session] = None,
+    cache: Optional[ImageCache] = None,
+    api_url: str = STREETVIEW_API_URL,
+    store: Optional[ShardStore] = None,
+) -> FetchResult:
     """
     Construct and send a request to the Street View API.
 
@@ -48,72 +217,975 @@ def fetch_image_from_location(
         secret (str): Google API signing secret.
         params (dict): Parameters for the Street View API request.
         manual_check (bool): If True, requires user confirmation before sending the request.
+        session (requests.Session, optional): Pooled session to send the request with.
+        cache (ImageCache, optional): Image cache to check before sending the request.
+        api_url (str): Base URL of the Street View API.
+        store (ShardStore, optional): Shard store to move the image into once saved, under
+            the name of the file as key.
 
     Returns:
-        None: The image is saved to disk if the request is successful.
+        FetchResult: The outcome of the request. The image is saved to disk if the request is successful.
     """
-    url_request = (
-        f"{STREETVIEW_API_URL}?key={key}&size={params['size']}"
-        f"&location={location}&radius={params['radius']}&fov={params['fov']}"
-        f"&heading={params['heading']}&return_error_code={params['return_error_code']}"
-    )
-    if params.get("source") and params["source"] != "default":
-        url_request += f"&source={params['source']}"
-    if params.get("pitch"):
-        url_request += f"&pitch={params['pitch']}"
+    cache_key = request_key(location, params) if cache else None
+    if cache:
+        hit = cache.copy_to(cache_key, filename)
+        record_cache_lookup("image", hit)
+        if hit:
+            print(f"Image saved from cache: {filename}")
+            if store is not None:
+                filename = move_to_store(store, filename, location, params)
+            return FetchResult(
+                location=location, filename=filename, status="done", cached=True
+            )
 
-    signed_url = sign_url(input_url=url_request, secret=secret)
+    signed_url = get_request_template(api_url, key, secret).sign(
+        image_query(location, params)
+    )
 
-    print("Sending request:", signed_url)
     if manual_check:
+        # The signed URL carries the credentials, so it is never printed
+        print(f"Sending request for {location}")
         ans = input("Yes? (y/n) ")
     else:
         ans = "y"
-    if ans.lower() == "y":
+    if ans.lower() != "y":
+        return FetchResult(location=location, filename=filename, status="skipped")
+
+    http = session or requests
+    response = None
+    try:
+        # The image is streamed to disk, see `save_image`
+        response = send_instrumented(
+            "streetview_image",
+            get_limiter("streetview"),
+            lambda: http.get(signed_url, stream=True),
+            stream=True,
+        )
+        with response:
+            if not response.ok:
+                # Reading the short error body returns the connection to the pool, and it
+                # explains the error, e.g. why the request was rejected
+                raise requests.exceptions.HTTPError(
+                    f"{response.status_code} {response.reason}: {response.text[:200]}",
+                    response=response,
+                )
+            saved = save_image(response, filename)
+        if cache:
+            cache.put_file(cache_key, filename)
+        print(f"Image saved: {filename}")
+        if store is not None:
+            filename = move_to_store(store, filename, location, params)
+        return FetchResult(
+            location=location,
+            filename=filename,
+            status="done",
+            status_code=response.status_code,
+            sha256=saved.sha256,
+        )
+    except QuotaExceededError as e:
+        print(f"Error fetching image: {e}")
+        return FetchResult(
+            location=location,
+            filename=filename,
+            status="failed",
+            error=str(e),
+            quota_exceeded=True,
+        )
+    except (requests.exceptions.RequestException, NotAnImageError) as e:
+        error = redact_credentials(str(e))
+        print(f"Error fetching image: {error}")
+        return FetchResult(
+            location=location,
+            filename=filename,
+            status="failed",
+            status_code=response.status_code if response is not None else None,
+            error=error,
+        )
+
+
+def move_to_store(
+    store: ShardStore, filename: str, location: str, params: dict, key: Optional[str] = None
+) -> str:
+    """
+    Move a saved image into a shard store.
+
+    Returns:
+        str: Key of the image in the store; the name of the file unless given.
+    """
+    key = key or os.path.basename(filename)
+    metadata = {"location": location}
+    metadata.update((name, params.get(name)) for name in ("size", "fov", "heading", "pitch"))
+    store.put_file(key, filename, metadata)
+    os.remove(filename)
+    return key
+
+
+def is_capture(params: dict) -> bool:
+    """
+    Returns:
+        bool: True if the parameters ask for several views (headings or pitches) per location.
+    """
+    return bool(params.get("headings") or params.get("pitches"))
+
+
+def view_params(params: dict) -> List[dict]:
+    """
+    Expand the headings and pitches of a capture into the request parameters of every view.
+
+    Args:
+        params (dict): Parameters for the Street View API request, with optional 'headings'
+            and 'pitches' lists that default to the single 'heading' and 'pitch'.
+
+    Returns:
+        list: Parameters of every view, row by row: all headings of the first pitch, then
+            all headings of the next one.
+    """
+    headings = params.get("headings") or [params["heading"]]
+    pitches = params.get("pitches") or [params.get("pitch")]
+    return [
+        {**params, "heading": str(heading), "pitch": pitch if pitch is None else str(pitch)}
+        for pitch in pitches
+        for heading in headings
+    ]
+
+
+def stitch_views(filenames: List[str], n_columns: int, output: str) -> str:
+    """
+    Combine views into one image, with one column per heading and one row per pitch.
+
+    Requires [Pillow](https://python-pillow.org/), which is not installed by default.
+
+    Args:
+        filenames (list): Images of the views, in the order returned by `view_params`.
+        n_columns (int): Number of views per row.
+        output (str): Path of the combined image.
+
+    Returns:
+        str: The path of the combined image.
+    """
+    from PIL import Image
+
+    images = [Image.open(filename) for filename in filenames]
+    try:
+        width = max(image.width for image in images)
+        height = max(image.height for image in images)
+        n_rows = -(-len(images) // n_columns)
+        strip = Image.new("RGB", (width * n_columns, height * n_rows))
+        for i, image in enumerate(images):
+            strip.paste(image, ((i % n_columns) * width, (i // n_columns) * height))
+        strip.save(output, quality=95)
+    finally:
+        for image in images:
+            image.close()
+    return output
+
+
+def fetch_views_from_location(
+    location: str,
+    key: str,
+    secret: str,
+    params: dict,
+    filename: str,
+    manual_check: bool = True,
+    session: Optional[requests.Session] = None,
+    cache: Optional[ImageCache] = None,
+    api_url: str = STREETVIEW_API_URL,
+    store: Optional[ShardStore] = None,
+) -> FetchResult:
+    """
+    Capture several views of a location, e.g. a 360° panorama, with concurrent requests.
+
+    Every combination of the 'headings' and 'pitches' in params is fetched at the same
+    time over a shared session, so a capture takes about as long as a single request.
+    The views are saved together in one directory, as 'heading_<h>_pitch_<p>.jpg', and if
+    params['stitch'] is set, also combined into 'strip.jpg'.
+
+    Args:
+        location (str): Formatted location string.
+        key (str): Google API key.
+        secret (str): Google API signing secret.
+        params (dict): Parameters for the Street View API request, see `view_params`.
+        filename (str): Directory to save the views in.
+        manual_check (bool): If True, requires user confirmation before sending the requests.
+        session (requests.Session, optional): Pooled session to send the requests with; a new
+            one is created for the capture if not given.
+        cache (ImageCache, optional): Image cache to check before sending every request.
+        api_url (str): Base URL of the Street View API.
+        store (ShardStore, optional): Shard store to move the views of a successful capture
+            into, as '<directory name>/<view file name>', instead of keeping the directory.
+
+    Returns:
+        FetchResult: The outcome of the capture, which fails if any view failed. Its filename
+            is the directory and its views the image of every view.
+
+    Raises:
+        ImportError: If stitching is requested but Pillow is not installed.
+    """
+    stitch = params.get("stitch", False)
+    if stitch and importlib.util.find_spec("PIL") is None:
+        raise ImportError("Stitching views requires Pillow: pip install pillow")
+
+    views = view_params(params)
+    if manual_check:
+        print(f"Capturing {len(views)} views of {location}")
+        if input("Yes? (y/n) ").lower() != "y":
+            return FetchResult(location=location, filename=filename, status="skipped")
+    Path(filename).mkdir(parents=True, exist_ok=True)
+
+    def fetch(view, http):
+        view_filename = f"heading_{view['heading']}_pitch_{view['pitch'] or 0}.jpg"
+        return fetch_image_from_location(
+            location=location,
+            key=key,
+            secret=secret,
+            params=view,
+            filename=os.path.join(filename, view_filename),
+            manual_check=False,
+            session=http,
+            cache=cache,
+            api_url=api_url,
+        )
+
+    own_session = None if session else create_session(pool_size=len(views))
+    try:
+        with ThreadPoolExecutor(max_workers=len(views)) as executor:
+            results = list(
+                executor.map(lambda view: fetch(view, session or own_session), views)
+            )
+    finally:
+        if own_session:
+            own_session.close()
+
+    views_filenames = [result.filename for result in results]
+    failed = [result for result in results if not result.ok]
+    if failed:
+        return FetchResult(
+            location=location,
+            filename=filename,
+            status="failed",
+            status_code=failed[0].status_code,
+            error=f"{len(failed)} of {len(views)} views failed: {failed[0].error}",
+            views=views_filenames,
+            quota_exceeded=any(result.quota_exceeded for result in failed),
+        )
+    if stitch:
+        n_columns = len(params.get("headings") or [params["heading"]])
         try:
-            response = requests.get(signed_url)
-            response.raise_for_status()
-            with open(filename, "wb") as file:
-                file.write(response.content)
-            print(f"Image saved: {filename}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching image: {e}")
+            stitch_views(views_filenames, n_columns, os.path.join(filename, "strip.jpg"))
+        except OSError as e:
+            return FetchResult(
+                location=location,
+                filename=filename,
+                status="failed",
+                error=f"Error stitching views: {e}",
+                views=views_filenames,
+            )
+    if store is not None:
+        directory = filename
+        filename = os.path.basename(directory)
+        views_filenames = [
+            move_to_store(
+                store,
+                view_filename,
+                location,
+                view,
+                key=f"{filename}/{os.path.basename(view_filename)}",
+            )
+            for view_filename, view in zip(views_filenames, views)
+        ]
+        if stitch:
+            strip = os.path.join(directory, "strip.jpg")
+            move_to_store(store, strip, location, params, key=f"{filename}/strip.jpg")
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # holds files of an earlier run
+    return FetchResult(
+        location=location,
+        filename=filename,
+        status="done",
+        status_code=results[0].status_code,
+        cached=all(result.cached for result in results),
+        views=views_filenames,
+    )
 
 
-def fetch_images(
-    input_file: str,
+def fetch_metadata(
+    location: str,
+    key: str,
+    secret: str,
+    params: dict,
+    session: Optional[requests.Session] = None,
+    api_url: str = STREETVIEW_API_URL,
+) -> dict:
+    """
+    Query the Street View metadata endpoint for a location.
+
+    Metadata requests are not billed, so they can be used to check whether a panorama
+    exists before paying for the image itself.
+
+    Args:
+        location (str): Formatted location string.
+        key (str): Google API key.
+        secret (str): Google API signing secret.
+        params (dict): Parameters for the Street View API request; only radius and source are used.
+        session (requests.Session, optional): Pooled session to send the request with.
+        api_url (str): Base URL of the Street View API.
+
+    Returns:
+        dict: The metadata response, e.g. {"status": "OK", "pano_id": ..., "location": {"lat": ..., "lng": ...},
+            "date": "2019-05"}. Failed requests are reported with status "REQUEST_FAILED" and an "error" message.
+    """
+    signed_url = get_request_template(f"{api_url}/metadata", key, secret).sign(
+        metadata_query(location, params)
+    )
+    return _send_metadata_request(signed_url, session)
+
+
+def _send_metadata_request(
+    signed_url: str, session: Optional[requests.Session] = None
+) -> dict:
+    http = session or requests
+    try:
+        # Metadata requests are free of charge, so they do not count against the quota
+        response = send_instrumented(
+            "streetview_metadata",
+            get_limiter("streetview"),
+            lambda: http.get(signed_url),
+            billable=False,
+        )
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {"status": "REQUEST_FAILED", "error": redact_credentials(str(e))}
+
+
+def annotate_with_metadata(
+    df: "pd.DataFrame",
+    key: str,
+    secret: str,
+    params: dict = DEFAULT_API_PARAMS,
+    workers: int = DEFAULT_WORKERS,
+    session: Optional[requests.Session] = None,
+    api_url: str = STREETVIEW_API_URL,
+) -> "pd.DataFrame":
+    """
+    Query the metadata of every location concurrently and record it in the location table.
+
+    Args:
+        df (pd.DataFrame): Location table, as produced by `create_locations`.
+        key (str): Google API key.
+        secret (str): Google API signing secret.
+        params (dict, optional): API parameters for the request; defaults to DEFAULT_API_PARAMS.
+        workers (int): Number of concurrent metadata requests.
+        session (requests.Session, optional): Pooled session to send the requests with.
+        api_url (str): Base URL of the Street View API.
+
+    Returns:
+        pd.DataFrame: The location table with the added columns 'metadata_status',
+            'pano_id', 'pano_lat', 'pano_lng' and 'pano_date'.
+    """
+    if isinstance(df, LocationChunk):
+        df = df.to_frame()
+    locations = [preprocess_location(row.Index, row)[0] for row in df.itertuples()]
+    signed_urls = get_request_template(f"{api_url}/metadata", key, secret).sign_many(
+        metadata_query(location, params) for location in locations
+    )
+
+    def query(signed_url):
+        return _send_metadata_request(signed_url, session)
+
+    metadata = list(ordered_map(query, signed_urls, max(workers, 1)))
+
+    return df.assign(
+        metadata_status=[m.get("status") for m in metadata],
+        pano_id=[m.get("pano_id") for m in metadata],
+        pano_lat=[m.get("location", {}).get("lat") for m in metadata],
+        pano_lng=[m.get("location", {}).get("lng") for m in metadata],
+        pano_date=[m.get("date") for m in metadata],
+    )
+
+
+def filter_locations_with_imagery(
+    df: "pd.DataFrame",
+    key: str,
+    secret: str,
+    params: dict = DEFAULT_API_PARAMS,
+    workers: int = DEFAULT_WORKERS,
+    session: Optional[requests.Session] = None,
+    api_url: str = STREETVIEW_API_URL,
+) -> "pd.DataFrame":
+    """
+    Pre-flight stage that drops locations without a Street View panorama.
+
+    The metadata of every location is queried concurrently. The snapped panorama
+    coordinates and capture date are recorded as new columns of the location table.
+
+    Args:
+        See `annotate_with_metadata`.
+
+    Returns:
+        pd.DataFrame: The rows that have imagery, with the added columns 'metadata_status',
+            'pano_id', 'pano_lat', 'pano_lng' and 'pano_date'. The original index is kept.
+    """
+    df = annotate_with_metadata(df, key, secret, params, workers, session, api_url)
+    with_imagery = df[df["metadata_status"] == "OK"]
+    print(
+        f"Pre-flight: {len(with_imagery)} of {len(df)} locations have Street View imagery."
+    )
+    return with_imagery
+
+
+def _deduplicate_by_panorama(
+    df: "pd.DataFrame", filenames: List[str], first_by_pano: dict
+) -> List[str]:
+    """
+    Resolve every row to the image of the first row that snapped to the same panorama.
+
+    Args:
+        df (pd.DataFrame): Location table with a 'pano_id' column.
+        filenames (list): Image filename of every row.
+        first_by_pano (dict): Filename of the first image seen for every panorama ID.
+            Updated in place so that deduplication carries over across chunks.
+
+    Returns:
+        list: For every row, the filename of the image it resolves to.
+    """
+    resolved = []
+    for pano_id, filename in zip(df["pano_id"], filenames):
+        if pano_id is None or pano_id != pano_id:  # missing or NaN
+            resolved.append(filename)
+        else:
+            resolved.append(first_by_pano.setdefault(pano_id, filename))
+    return resolved
+
+
+def _check_near_duplicates(
+    fetched: Iterator[tuple],
+    detector: "NearDuplicateDetector",
+    drop: bool,
+    store: Optional[ShardStore] = None,
+) -> Iterator[tuple]:
+    """
+    Check fetched images for near-duplicates and placeholders, a batch at a time.
+
+    Args:
+        fetched (Iterator): (job, result) pairs of `iter_fetch_images`, in input order.
+        detector (NearDuplicateDetector): Detector to check the images with.
+        drop (bool): If True, near-duplicates and placeholders are deleted and their
+            status set to 'duplicate' or 'no_imagery'; otherwise they are only flagged.
+        store (ShardStore, optional): Store holding the images, when results name keys.
+
+    Yields:
+        tuple: The (job, result) pairs, in the same order, with flagged results.
+    """
+    from ..images.duplicates import PLACEHOLDER
+    while True:
+        batch = list(itertools.islice(fetched, HASH_BATCH_SIZE))
+        if not batch:
+            return
+        # Captured views are different on purpose, only single images are checked
+        checked = [
+            i
+            for i, (_, result) in enumerate(batch)
+            if result is not None and result.ok and result.views is None
+        ]
+        items = []
+        for i in checked:
+            filename = batch[i][1].filename
+            items.append(
+                (filename, bytes(store.get(filename)) if store is not None else filename)
+            )
+        for i, verdict in zip(checked, detector.check_many(items)):
+            job, result = batch[i]
+            if verdict.duplicate_of:
+                result = replace(result, duplicate_of=verdict.duplicate_of)
+            elif verdict.status == PLACEHOLDER:
+                result = replace(result, placeholder=True)
+            else:
+                continue
+            if drop:
+                if store is not None:
+                    store.delete(result.filename)
+                else:
+                    os.remove(result.filename)
+                result = replace(result, status=DUPLICATE if result.duplicate_of else NO_IMAGERY)
+            batch[i] = (job, result)
+        yield from batch
+
+
+# Camera settings the Street View API uses when a request leaves them out
+_API_DEFAULT_PITCH = 0.0
+_API_DEFAULT_FOV = 90.0
+
+
+def _view_cameras(params: dict) -> List[dict]:
+    """
+    Camera settings of every image of a location, as recorded in a photo index: heading
+    (None where the API picks it), pitch, fov and size.
+    """
+    views = view_params(params) if is_capture(params) else [params]
+    return [
+        {
+            "heading": None if view.get("heading") is None else float(view["heading"]),
+            "pitch": float(_API_DEFAULT_PITCH if view.get("pitch") is None else view["pitch"]),
+            "fov": float(_API_DEFAULT_FOV if view.get("fov") is None else view["fov"]),
+            "size": None if view.get("size") is None else str(view["size"]),
+        }
+        for view in views
+    ]
+
+
+def find_nearby_photos(
+    index: PhotoIndex,
+    location: str,
+    params: dict,
+    radius: float,
+    store: Optional[ShardStore] = None,
+) -> Optional[List[str]]:
+    """
+    Look for photos already taken of a location, facing the way every view would face
+    with the same pitch, field of view and size.
+
+    Records of photos that no longer exist are removed from the index on the way.
+
+    Args:
+        index (PhotoIndex): Index of the photos taken so far.
+        location (str): Formatted location string; only coordinates can be looked up.
+        params (dict): API parameters of the request, including the views in capture mode.
+        radius (float): Maximum distance of a photo in meters.
+        store (ShardStore, optional): Store holding photos recorded by their key.
+
+    Returns:
+        list: The path or key of a nearby photo for every view, or None unless every view
+            has one.
+    """
+    coordinates = parse_coordinates(location)
+    if coordinates is None:
+        return None
+    paths = []
+    for camera in _view_cameras(params):
+        for record in index.nearby(*coordinates, radius, **camera):
+            if os.path.exists(record.path) or (store is not None and record.path in store):
+                paths.append(record.path)
+                break
+            if os.path.isabs(record.path):
+                index.remove(record.path)  # deleted since; keys of other stores are kept
+        else:
+            return None
+    return paths
+
+
+def record_photos(index: PhotoIndex, result: FetchResult, params: dict, keys: bool = False):
+    """
+    Add the images of a successful result to a photo index.
+
+    Args:
+        index (PhotoIndex): Index to record the photos in.
+        result (FetchResult): Result of the request, in capture mode with its views.
+        params (dict): API parameters of the request.
+        keys (bool): True if the result names keys of a shard store rather than files,
+            which are then recorded as they are instead of as absolute paths.
+    """
+    if not result.ok:
+        return
+    paths = result.views if result.views is not None else [result.filename]
+    record_paths(index, result.location, paths, params, keys)
+
+
+def record_paths(
+    index: PhotoIndex, location: str, paths: List[str], params: dict, keys: bool = False
+):
+    """
+    Add the images of a location to a photo index, see `record_photos`.
+
+    Args:
+        index (PhotoIndex): Index to record the photos in.
+        location (str): Formatted location string; only coordinates are recorded.
+        paths (list): Path or key of the image of every view, in the order of `view_params`.
+        params (dict): API parameters of the request.
+        keys (bool): True if the paths are keys of a shard store.
+    """
+    coordinates = parse_coordinates(location)
+    if coordinates is None:
+        return
+    index.add_many(
+        PhotoRecord(path if keys else os.path.abspath(path), *coordinates, **camera)
+        for path, camera in zip(paths, _view_cameras(params))
+    )
+
+
+def iter_location_chunks(
+    input_file: Union[str, LocationChunk, "pd.DataFrame", Iterable[LocationChunk]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_row: int = 0,
+) -> Iterator[LocationChunk]:
+    """
+    Read locations in chunks, starting at a given row.
+
+    Args:
+        input_file (str, LocationChunk, DataFrame or iterable): Path to a CSV file, a table
+            of locations or an iterable of tables of locations.
+        chunk_size (int): Number of rows read from the CSV file at a time.
+        start_row (int): Index of the first row to yield. Rows before it are skipped
+            without being parsed when reading from a CSV file.
+
+    Yields:
+        LocationChunk or pd.DataFrame: Chunks of locations, indexed by their row number in
+            the full input. CSV files are read into LocationChunks, without pandas.
+    """
+    if isinstance(input_file, (str, os.PathLike)):
+        with open(input_file, newline="") as file:
+            yield from read_csv_chunks(file, chunk_size, start_row)
+        return
+
+    # A single table, rather than an iterable of tables
+    single = isinstance(input_file, LocationChunk) or hasattr(input_file, "itertuples")
+    chunks = [input_file] if single else input_file
+    for chunk in chunks:
+        if start_row:
+            chunk = chunk[[row >= start_row for row in chunk.index]]
+        if len(chunk):
+            yield chunk
+
+
+def iter_fetch_images(
+    input_file: Union[str, Iterable[LocationChunk]],
     params: dict = DEFAULT_API_PARAMS,
     save_dir: str = DEFAULT_SAVE_DIR,
     manual_check: bool = True,
-):
+    workers: int = 1,
+    use_cache: bool = True,
+    preflight: bool = False,
+    dedupe: bool = False,
+    api_url: str = STREETVIEW_API_URL,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_row: int = 0,
+    use_manifest: bool = True,
+    mode: str = "run",
+    metrics_file: Optional[str] = None,
+    store_dir: Optional[str] = None,
+    near_duplicates: Optional[str] = None,
+    photo_index: Optional[str] = None,
+    skip_nearby: Optional[float] = None,
+) -> Iterator[FetchResult]:
     """
-    Fetch Street View photos for locations specified in a CSV file.
+    Lazily fetch Street View photos, yielding a result as soon as each location is done.
+
+    Locations are consumed chunk by chunk, so memory stays flat regardless of the number
+    of locations and the first requests go out before the whole input has been read.
 
     Args:
-        input_file (str): Path to the CSV file containing location data.
+        input_file (str or iterable): Path to the CSV file containing location data, or an
+            iterable of location tables such as the one returned by `iter_locations`.
         params (dict, optional): API parameters for the request; defaults to DEFAULT_API_PARAMS.
+            With 'headings' or 'pitches', every location is captured from several views,
+            see `fetch_views_from_location`.
         save_dir (str): The directory where the fetched images will be saved.
         manual_check (bool): If True, requires user confirmation before sending the request.
+        workers (int): Number of concurrent locations. Values above 1 require manual_check=False.
+        use_cache (bool): If True, serve repeated requests from the local image cache.
+        preflight (bool): If True, skip locations without imagery using the metadata endpoint first.
+        dedupe (bool): If True, download only one image per panorama. Implies preflight.
+        api_url (str): Base URL of the Street View API.
+        chunk_size (int): Number of rows read from the CSV file at a time.
+        start_row (int): Index of the first input row to process.
+        use_manifest (bool): If True, record the status of every location in a job manifest
+            ('manifest.sqlite' in save_dir) as the run progresses.
+        mode (str): 'run' processes every location, 'resume' only the locations that have not
+            finished in a previous run and 'retry-failed' only those that failed.
+        metrics_file (str, optional): File to export the request metrics to when the run ends,
+            in the Prometheus text format if it ends with '.prom', as JSON lines otherwise.
+            See `metrics.MetricsRegistry.write`.
+        store_dir (str, optional): If given, images are packed into the shard store in this
+            directory instead of being kept as separate files in save_dir, see `ShardStore`.
+            Their keys are their file names, relative to save_dir.
+        near_duplicates (str, optional): 'flag' checks every fetched image against the
+            images fetched before into save_dir (hashes in 'hashes.sqlite'), and marks the
+            results of near-duplicates and placeholder images; 'drop' also deletes those
+            images. Requires Pillow. See `NearDuplicateDetector`.
+        photo_index (str, optional): Path of a `PhotoIndex` that every fetched image is
+            recorded in, with its coordinates and heading, e.g. DEFAULT_PHOTO_INDEX_FILE.
+        skip_nearby (float, optional): If given, locations that already have a photo in
+            photo_index within this many meters, facing within NEARBY_HEADING_TOLERANCE
+            degrees of every requested heading, are not fetched; their result is 'nearby'
+            and names the earlier photos. Only coordinates can be looked up.
+
+    When the daily quota of the Street View API runs out, see RATE_LIMITS, the run stops:
+    the result of the location that hit the quota is 'failed' with quota_exceeded set, and
+    that location is left pending in the manifest, so that a run in 'resume' mode picks it
+    up again once there is quota left.
+
+    With preflight or dedupe, the annotated location table, including the image every row
+    resolved to, is saved next to the input file with a '_preflight' suffix, or as
+    'locations_preflight.csv' in save_dir when the input is not a file.
+
+    Yields:
+        FetchResult: A result per processed location, in input order. Locations that share
+            a panorama share the FetchResult filename.
     """
+    if workers > 1 and manual_check:
+        raise ValueError("Concurrent fetching (workers > 1) requires manual_check=False.")
+    if mode not in RUN_MODES:
+        raise ValueError(f"Unknown mode '{mode}'. Choose one of {RUN_MODES}.")
+    if mode != "run" and not use_manifest:
+        raise ValueError(f"Mode '{mode}' requires use_manifest=True.")
+    if near_duplicates not in (None, "flag", "drop"):
+        raise ValueError("near_duplicates must be None, 'flag' or 'drop'.")
+    if skip_nearby is not None and not photo_index:
+        raise ValueError("skip_nearby requires a photo_index.")
+
     key, secret = get_credentials()
 
     Path.mkdir(Path(save_dir), parents=True, exist_ok=True)
 
-    df = pd.read_csv(input_file)
+    preflight_file = None
+    if preflight or dedupe:
+        if isinstance(input_file, (str, os.PathLike)):
+            input_path = Path(input_file)
+            preflight_file = input_path.with_name(f"{input_path.stem}_preflight.csv")
+        else:
+            preflight_file = Path(save_dir) / "locations_preflight.csv"
 
-    photo_paths = []
-    for index, row in df.iterrows():
-        location, filename = preprocess_location(index, row)
-        fetch_image_from_location(
-            location=location,
-            key=key,
-            secret=secret,
+    manifest = JobManifest(os.path.join(save_dir, "manifest.sqlite")) if use_manifest else None
+    capture = is_capture(params)
+    n_views = len(view_params(params)) if capture else 1
+    first_by_pano = {}
+    n_deduplicated = 0
+
+    def select_rows(chunk: LocationChunk) -> Tuple[LocationChunk, int]:
+        """Drop the rows that the manifest says this mode should not process."""
+        locations = [preprocess_location(row.Index, row)[0] for row in chunk.itertuples()]
+        statuses = manifest.statuses(chunk.index, locations)
+        status = [statuses.get(row) for row in chunk.index]
+        if mode == "retry-failed":
+            return chunk[[s == FAILED for s in status]], 0
+        # Finished locations still count towards the number of addresses of the run
+        n_finished = sum(s in (DONE, FAILED, DUPLICATE, NEARBY) for s in status)
+        return chunk[[s not in FINISHED_STATUSES for s in status]], n_finished
+
+    def iter_jobs(session):
+        nonlocal n_deduplicated
+        # Retrying failures revisits all of them, regardless of the number of addresses
+        remaining = params.get("n_addresses", 1) if mode != "retry-failed" else sys.maxsize
+        chunks = iter_location_chunks(input_file, chunk_size, start_row)
+        for i, chunk in enumerate(chunks):
+            if remaining <= 0:
+                break
+            if manifest and mode != "run":
+                chunk, n_finished = select_rows(chunk)
+                remaining -= n_finished
+            if preflight_file:
+                chunk = annotate_with_metadata(
+                    chunk,
+                    key=key,
+                    secret=secret,
+                    params=params,
+                    workers=max(workers, DEFAULT_WORKERS),
+                    session=session,
+                    api_url=api_url,
+                )
+                no_imagery = chunk["metadata_status"].isin(["ZERO_RESULTS", "NOT_FOUND"])
+                if manifest:
+                    for row in chunk[no_imagery].itertuples():
+                        location, _ = preprocess_location(row.Index, row)
+                        manifest.record(row.Index, location, NO_IMAGERY)
+                with_imagery = chunk["metadata_status"] == "OK"
+                print(
+                    f"Pre-flight: {int(with_imagery.sum())} of {len(chunk)} locations "
+                    "have Street View imagery."
+                )
+                chunk = chunk[with_imagery]
+            chunk = chunk.head(max(remaining, 0))
+            remaining -= len(chunk)
+
+            locations, filenames = [], []
+            for row in chunk.itertuples():
+                location, filename = preprocess_location(row.Index, row)
+                if capture:
+                    # The views of a location are saved together in a directory
+                    filename = os.path.splitext(filename)[0]
+                locations.append(location)
+                filenames.append(os.path.join(save_dir, filename))
+            resolved = filenames
+            if dedupe:
+                resolved = _deduplicate_by_panorama(chunk, filenames, first_by_pano)
+                n_deduplicated += len(chunk)
+
+            if preflight_file:
+                chunk.assign(filename=resolved).to_csv(
+                    preflight_file, mode="w" if i == 0 else "a", header=i == 0, index=False
+                )
+            if manifest:
+                manifest.mark_pending(chunk.index, locations, resolved)
+            pano_ids = chunk["pano_id"] if "pano_id" in chunk else [None] * len(chunk)
+            # Rows that resolved to an image of an earlier row are not fetched again
+            yield from zip(
+                chunk.index,
+                locations,
+                resolved,
+                pano_ids,
+                [own == image for own, image in zip(filenames, resolved)],
+            )
+
+    cache = ImageCache() if use_cache else None
+    store = ShardStore(store_dir) if store_dir else None
+    detector = None
+    if near_duplicates:
+        # Hashing needs numpy, which is only loaded when asked for
+        from ..images.duplicates import NearDuplicateDetector
+
+        detector = NearDuplicateDetector(os.path.join(save_dir, "hashes.sqlite"))
+    index = PhotoIndex(photo_index) if photo_index else None
+
+    try:
+        pool_size = max(workers, DEFAULT_WORKERS) * n_views
+        with create_session(pool_size=pool_size) as session:
+
+            def fetch(job):
+                _, location, filename, pano_id, needs_fetch = job
+                if not needs_fetch:
+                    return job, None
+                if skip_nearby is not None:
+                    nearby = find_nearby_photos(index, location, params, skip_nearby, store)
+                    if nearby:
+                        return job, FetchResult(
+                            location=location,
+                            filename=nearby[0],
+                            status=NEARBY,
+                            pano_id=pano_id,
+                            views=nearby if capture else None,
+                        )
+                fetch_location = (
+                    fetch_views_from_location if capture else fetch_image_from_location
+                )
+                result = fetch_location(
+                    location=location,
+                    key=key,
+                    secret=secret,
+                    params=params,
+                    filename=filename,
+                    manual_check=manual_check,
+                    session=session,
+                    cache=cache,
+                    api_url=api_url,
+                    store=store,
+                )
+                return job, replace(result, pano_id=pano_id)
+
+            jobs = iter_jobs(session)
+            if workers > 1:
+                fetched = ordered_map(fetch, jobs, workers)
+            else:
+                fetched = map(fetch, jobs)
+            if detector:
+                fetched = _check_near_duplicates(
+                    fetched, detector, near_duplicates == "drop", store
+                )
+
+            results_by_filename = {}
+            for (row, location, filename, pano_id, needs_fetch), result in fetched:
+                if result is not None and result.quota_exceeded:
+                    print("Daily quota of the Street View API used up; stopping the run.")
+                    yield result
+                    return
+                if result is None:
+                    result = replace(
+                        results_by_filename[filename], location=location, pano_id=pano_id
+                    )
+                elif dedupe:
+                    results_by_filename[filename] = result
+                if manifest:
+                    manifest.record(
+                        row,
+                        location,
+                        result.status,
+                        filename=result.filename,
+                        status_code=result.status_code,
+                        error=result.error,
+                        sha256=result.sha256,
+                    )
+                if index is not None and needs_fetch:
+                    record_photos(index, result, params, keys=store is not None)
+                yield result
+    finally:
+        if cache:
+            print("Image cache:", cache.stats())
+            cache.close()
+        if detector:
+            print(f"Near-duplicate check {detector.path}:", detector.counts())
+            detector.close()
+        if index is not None:
+            print(f"Photo index {photo_index}: {len(index)} photos")
+            index.close()
+        if store is not None:
+            print(f"Shard store {store_dir}:", store.stats())
+            store.close()
+        print("Street View rate limiter:", get_limiter("streetview").stats())
+        if dedupe:
+            print(
+                f"Deduplication: {n_deduplicated} locations resolved to "
+                f"{len(first_by_pano)} unique panoramas."
+            )
+        if preflight_file:
+            print("Pre-flight location table saved:", preflight_file)
+        if manifest:
+            print(f"Job manifest {manifest.path}:", manifest.counts())
+            manifest.close()
+        if metrics_file:
+            get_metrics().write(metrics_file)
+            print("Request metrics saved:", metrics_file)
+
+
+def fetch_images(
+    input_file: Union[str, Iterable[LocationChunk]],
+    params: dict = DEFAULT_API_PARAMS,
+    save_dir: str = DEFAULT_SAVE_DIR,
+    manual_check: bool = True,
+    workers: int = 1,
+    use_cache: bool = True,
+    preflight: bool = False,
+    dedupe: bool = False,
+    api_url: str = STREETVIEW_API_URL,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_row: int = 0,
+    use_manifest: bool = True,
+    mode: str = "run",
+    metrics_file: Optional[str] = None,
+    store_dir: Optional[str] = None,
+    near_duplicates: Optional[str] = None,
+    photo_index: Optional[str] = None,
+    skip_nearby: Optional[float] = None,
+) -> List[FetchResult]:
+    """
+    Fetch Street View photos for locations specified in a CSV file or a stream of locations.
+
+    See `iter_fetch_images` for the arguments.
+
+    Returns:
+        list: A FetchResult per location, in input order. Versions before concurrent
+            fetching returned the file names instead; they are the `filename` of the
+            results that are `ok`.
+    """
+    return list(
+        iter_fetch_images(
+            input_file,
             params=params,
-            filename=os.path.join(save_dir, filename),
+            save_dir=save_dir,
             manual_check=manual_check,
+            workers=workers,
+            use_cache=use_cache,
+            preflight=preflight,
+            dedupe=dedupe,
+            api_url=api_url,
+            chunk_size=chunk_size,
+            start_row=start_row,
+            use_manifest=use_manifest,
+            mode=mode,
+            metrics_file=metrics_file,
+            store_dir=store_dir,
+            near_duplicates=near_duplicates,
+            photo_index=photo_index,
+            skip_nearby=skip_nearby,
         )
-        photo_paths.append(filename)
-        if index + 1 >= params.get("n_addresses", 1):
-            break
-
-    return photo_paths
+    )
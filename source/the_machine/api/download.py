@@ -0,0 +1,114 @@
+import hashlib
+import itertools
+import os
+import time
+import uuid
+from dataclasses import dataclass
+
+import requests
+
+from ..config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_FSYNC
+from .metrics import record_transfer
+
+# Leading bytes of the image formats the Street View API can return
+IMAGE_SIGNATURES = (b"\xff\xd8", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+
+
+class NotAnImageError(ValueError):
+    """Raised when a response that should hold an image holds something else."""
+
+
+@dataclass
+class SavedImage:
+    """
+    An image written to disk.
+
+    Attributes:
+        path (str): Path of the image.
+        size (int): Size of the image in bytes.
+        sha256 (str): Hex SHA-256 digest of the image.
+    """
+
+    path: str
+    size: int
+    sha256: str
+
+
+def _is_image(head: bytes) -> bool:
+    if head.startswith(IMAGE_SIGNATURES):
+        return True
+    return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+
+
+def temporary_path(filename: str) -> str:
+    """
+    Returns:
+        str: A unique path next to `filename`, to write to before renaming it into place.
+    """
+    return f"{filename}.{uuid.uuid4().hex[:8]}.part"
+
+
+def save_image(
+    response: requests.Response,
+    filename: str,
+    endpoint: str = "streetview_image",
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+) -> SavedImage:
+    """
+    Stream an image response to disk in chunks and atomically move it into place.
+
+    The body is written to a temporary file next to `filename` while its checksum is
+    computed, then renamed over `filename`. A crash or a broken connection never leaves
+    a truncated image behind, and only one chunk per download is held in memory. The
+    response is rejected before anything is written unless its leading bytes are those
+    of an image, and its content type, if given, is an image type.
+
+    Args:
+        response (requests.Response): Response of a request sent with stream=True.
+        filename (str): Destination path.
+        endpoint (str): Name of the endpoint, used as the metrics label.
+        chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+        SavedImage: The path, size and checksum of the image.
+
+    Raises:
+        NotAnImageError: If the response does not hold an image.
+        requests.exceptions.RequestException: If the connection breaks during the download.
+    """
+    start = time.perf_counter()
+    with response:
+        content_type = response.headers.get("Content-Type", "")
+        chunks = response.iter_content(chunk_size)
+        # Gather enough bytes to recognize the format, even from very small chunks
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= 12:
+                break
+        if not _is_image(head) or (content_type and not content_type.startswith("image/")):
+            raise NotAnImageError(
+                f"Expected an image, got {content_type or 'no content type'} "
+                f"starting with {head[:16]!r}"
+            )
+
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = temporary_path(filename)
+        try:
+            with open(tmp_path, "wb") as file:
+                for chunk in itertools.chain([head], chunks):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                if DOWNLOAD_FSYNC:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(tmp_path, filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    record_transfer(endpoint, time.perf_counter() - start, size)
+    return SavedImage(path=filename, size=size, sha256=digest.hexdigest())
@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional
+
+from ..config import (
+    DEFAULT_GEOCODE_CACHE_FILE,
+    GEOCODE_CACHE_MAX_ENTRIES,
+    GEOCODE_CACHE_MEMORY_ENTRIES,
+    GEOCODE_CACHE_TTL,
+)
+
+
+# Lookup counts of the current context, see `track_lookups`
+_tracked_lookups: ContextVar[Optional[dict]] = ContextVar("geocode_lookups", default=None)
+
+
+def track_lookups() -> dict:
+    """
+    Count the cache lookups made from now on in the current context, e.g. in one agent tool
+    call, apart from the lookups of concurrent calls in other contexts. Contexts copied
+    from the current one, such as threads started with `asyncio.to_thread`, count into the
+    same dict.
+
+    Returns:
+        dict: Memory hits, disk hits and misses, updated as lookups happen.
+    """
+    counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+    _tracked_lookups.set(counts)
+    return counts
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a place name so that trivially different spellings share a cache entry.
+
+    Unicode is normalized (NFKC), case is folded and whitespace is collapsed,
+    e.g. '  Elefsina ' and 'ELEFSINA' both become 'elefsina'.
+
+    Args:
+        query (str): The place name.
+
+    Returns:
+        str: The normalized query.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class GeocodeCache:
+    """
+    Two-level cache of geocoding responses with expiry and LRU eviction.
+
+    Lookups first hit a small in-memory LRU and then a SQLite database that persists across
+    sessions. Entries expire after `ttl` seconds; when the database holds more than
+    `max_entries`, the least recently used entries are evicted.
+
+    Both levels keep responses as JSON, so every lookup returns a fresh copy that the
+    caller may change without changing the cached entry.
+
+    Args:
+        path (str): Path of the SQLite database.
+        ttl (float): Lifetime of an entry in seconds.
+        max_entries (int): Maximum number of entries kept on disk.
+        memory_entries (int): Maximum number of entries kept in memory.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_GEOCODE_CACHE_FILE,
+        ttl: float = GEOCODE_CACHE_TTL,
+        max_entries: int = GEOCODE_CACHE_MAX_ENTRIES,
+        memory_entries: int = GEOCODE_CACHE_MEMORY_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _remember(self, key: str, encoded: str, expires_at: float):
+        self._memory[key] = (encoded, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _count(self, name: str):
+        setattr(self, name, getattr(self, name) + 1)
+        tracked = _tracked_lookups.get()
+        if tracked is not None:
+            tracked[name] += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a response.
+
+        Args:
+            key (str): Cache key, see `normalize_query`.
+
+        Returns:
+            The cached response, or None on a miss or if the entry expired.
+        """
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                encoded, expires_at = self._memory[key]
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count("memory_hits")
+                    return json.loads(encoded)
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._db.commit()
+                self._count("misses")
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self._count("disk_hits")
+            return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """
+        Store a JSON-serializable response.
+
+        Args:
+            key (str): Cache key, see `normalize_query`.
+            value: The response.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        encoded = json.dumps(value)
+        with self._lock:
+            self._remember(key, encoded, expires_at)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, encoded, expires_at, now),
+            )
+            self._db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM entries WHERE key NOT IN "
+                "(SELECT key FROM entries ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Memory hits, disk hits and misses of this instance, across all threads;
+                see `track_lookups` for those of one context.
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        self._db.close()
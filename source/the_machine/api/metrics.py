@@ -0,0 +1,358 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ..config import METRICS_BYTES_BUCKETS, METRICS_SECONDS_BUCKETS
+from .ratelimit import RateLimiter
+
+# Exported metrics and their descriptions
+METRICS = {
+    "machine_http_requests_total": "Requests by final outcome, after retries.",
+    "machine_http_responses_total": "Responses to every attempt, including retried ones.",
+    "machine_http_retries_total": "Attempts that were retried.",
+    "machine_http_attempt_seconds": "Duration of every attempt, until its body is read "
+    "or, for streamed downloads, until its headers are.",
+    "machine_http_phase_seconds": "Duration of every attempt by phase: connect (DNS, TCP "
+    "and TLS, zero on a reused connection), wait (until the response headers) and transfer.",
+    "machine_http_response_bytes": "Size of every response body.",
+    "machine_cache_requests_total": "Cache lookups by result.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, with their sum, as in Prometheus.
+
+    Args:
+        buckets (Sequence): Increasing upper bounds of the buckets; values above the last
+            bound are counted in an implicit '+Inf' bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        Returns:
+            list: (upper bound, number of values up to it) for every bucket, ending with '+Inf'.
+        """
+        total, result = 0, []
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            total += count
+            result.append((_format_number(bound), total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms, keyed by name and labels.
+
+    The registry is meant to be shared by every thread of the process, see `get_metrics`,
+    and exported at the end of a run with `write`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """
+        Add a value to a counter.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = METRICS_SECONDS_BUCKETS,
+        **labels: str,
+    ):
+        """
+        Record a value in a histogram, created with the given buckets on first use.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> List[dict]:
+        """
+        Returns:
+            list: Every series as a dict with its 'name', 'type' and 'labels', and either its
+                'value' (counters) or its 'buckets', 'sum' and 'count' (histograms).
+        """
+        with self._lock:
+            series = [
+                {"name": name, "type": "counter", "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            series += [
+                {
+                    "name": name,
+                    "type": "histogram",
+                    "labels": dict(labels),
+                    "buckets": dict(histogram.cumulative()),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return series
+
+    def to_prometheus(self) -> str:
+        """
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        lines, described = [], set()
+        for series in self.snapshot():
+            name, labels = series["name"], series["labels"]
+            if name not in described:
+                described.add(name)
+                if name in METRICS:
+                    lines.append(f"# HELP {name} {METRICS[name]}")
+                lines.append(f"# TYPE {name} {series['type']}")
+            if series["type"] == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(series['value'])}")
+                continue
+            for bound, count in series["buckets"].items():
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(series['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self) -> str:
+        """
+        Returns:
+            str: Every series as a JSON object on its own line, stamped with the current time.
+        """
+        timestamp = time.time()
+        return "".join(
+            json.dumps({"timestamp": timestamp, **series}) + "\n" for series in self.snapshot()
+        )
+
+    def write(self, path: str):
+        """
+        Export the metrics to a file.
+
+        A '.prom' file is replaced atomically with the Prometheus text format, so that it can
+        be picked up by the node exporter's textfile collector at any time. Any other file gets
+        a JSON-lines snapshot appended, so successive runs can be compared.
+
+        Args:
+            path (str): Path of the metrics file.
+        """
+        if path.endswith(".prom"):
+            directory = os.path.dirname(os.path.abspath(path))
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, suffix=".tmp", delete=False
+            ) as file:
+                file.write(self.to_prometheus())
+            os.replace(file.name, path)
+        else:
+            with open(path, "a") as file:
+                file.write(self.to_json_lines())
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_number(value) -> str:
+    if isinstance(value, str):
+        return value
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Returns:
+        MetricsRegistry: The process-wide registry that requests are recorded in.
+    """
+    return _metrics
+
+
+# Connection setup time of the current request, set by the connections of InstrumentedAdapter
+_phases = threading.local()
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _phases.connect = getattr(_phases, "connect", 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose connections report how long they took to set up, so that
+    `send_instrumented` can tell connection time from server time.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def send_instrumented(
+    endpoint: str,
+    limiter: RateLimiter,
+    send: Callable[[], requests.Response],
+    billable: bool = True,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    Send a request through a rate limiter and record its metrics.
+
+    Every attempt records its status code, duration, response size and phases. Connection
+    setup is only measured on sessions from `create_session`; elsewhere it counts as wait time.
+    The request as a whole records its final status (or the exception it raised) and retries.
+
+    Args:
+        endpoint (str): Name of the endpoint, used as the 'endpoint' label.
+        limiter (RateLimiter): Rate limiter to send the request through.
+        send (Callable): Function that sends the request and returns the response.
+        billable (bool): If True, every attempt that returns a successful response counts
+            against the daily quota.
+        stream (bool): True if `send` leaves the body unread (stream=True). Its transfer
+            time and size are then recorded with `record_transfer` by whoever reads it.
+
+    Returns:
+        requests.Response: The response returned by `limiter.call`.
+    """
+    metrics = get_metrics()
+    attempts = 0
+
+    def timed_send():
+        nonlocal attempts
+        attempts += 1
+        _phases.connect = 0.0
+        start = time.perf_counter()
+        response = send()
+        total = time.perf_counter() - start
+        # `elapsed` runs until the headers are parsed, the body is read afterwards
+        headers = min(response.elapsed.total_seconds(), total)
+        connect = min(_phases.connect, headers)
+        metrics.inc(
+            "machine_http_responses_total",
+            endpoint=endpoint,
+            status=str(response.status_code),
+        )
+        metrics.observe("machine_http_attempt_seconds", total, endpoint=endpoint)
+        metrics.observe(
+            "machine_http_phase_seconds", connect, endpoint=endpoint, phase="connect"
+        )
+        metrics.observe(
+            "machine_http_phase_seconds", headers - connect, endpoint=endpoint, phase="wait"
+        )
+        if not stream:
+            record_transfer(endpoint, total - headers, len(response.content))
+        return response
+
+    status = "error"
+    try:
+        response = limiter.call(timed_send, billable=billable)
+        status = str(response.status_code)
+        return response
+    except Exception as e:
+        status = type(e).__name__
+        raise
+    finally:
+        metrics.inc("machine_http_requests_total", endpoint=endpoint, status=status)
+        if attempts > 1:
+            metrics.inc("machine_http_retries_total", attempts - 1, endpoint=endpoint)
+
+
+def record_transfer(endpoint: str, seconds: float, n_bytes: int):
+    """
+    Record the time spent reading a response body, and its size.
+
+    Args:
+        endpoint (str): Name of the endpoint, used as the 'endpoint' label.
+        seconds (float): Time spent reading the body.
+        n_bytes (int): Size of the body.
+    """
+    metrics = get_metrics()
+    metrics.observe(
+        "machine_http_phase_seconds", seconds, endpoint=endpoint, phase="transfer"
+    )
+    metrics.observe(
+        "machine_http_response_bytes",
+        n_bytes,
+        buckets=METRICS_BYTES_BUCKETS,
+        endpoint=endpoint,
+    )
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    """
+    Count a cache lookup.
+
+    Args:
+        cache (str): Name of the cache, used as the 'cache' label.
+        hit (bool): Whether the lookup was served from the cache.
+    """
+    get_metrics().inc("machine_cache_requests_total", cache=cache, result="hit" if hit else "miss")
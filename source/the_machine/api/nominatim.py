@@ -0,0 +1,95 @@
+import threading
+from typing import Optional
+
+import requests
+
+from ..config import NOMINATIM_API_URL
+from .geocache import GeocodeCache, normalize_query
+from .metrics import record_cache_lookup, send_instrumented
+from .ratelimit import get_limiter
+
+_geocode_cache: Optional[GeocodeCache] = None
+_geocode_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    """
+    Get the process-wide cache of search results, created on first use.
+
+    Returns:
+        GeocodeCache: The shared cache.
+    """
+    global _geocode_cache
+    with _geocode_cache_lock:
+        if _geocode_cache is None:
+            _geocode_cache = GeocodeCache()
+        return _geocode_cache
+
+
+def search(
+    query: str,
+    polygon_geojson: bool = False,
+    api_url: str = NOMINATIM_API_URL,
+    use_cache: bool = True,
+) -> list[dict]:
+    """
+    Search a place by name with the [Nominatim API](https://nominatim.org/release-docs/develop/api/Search/).
+
+    Requests go through the shared 'nominatim' rate limiter to respect the usage policy.
+    Results are cached by normalized query, so repeated searches for the same place do not
+    reach the API again until the cache entry expires.
+
+    Args:
+        query (str): Free-form name of the place.
+        polygon_geojson (bool): If True, include the boundary of every result as GeoJSON
+            under the 'geojson' key.
+        api_url (str): Base URL of the Nominatim API.
+        use_cache (bool): If True, look up and store the results in the geocoding cache.
+
+    Returns:
+        list: The search results, best match first.
+    """
+    cache_key = f"{normalize_query(query)}|polygon_geojson={int(polygon_geojson)}"
+    if use_cache:
+        results = get_geocode_cache().get(cache_key)
+        record_cache_lookup("geocode", results is not None)
+        if results is not None:
+            return results
+
+    params = {"q": query, "format": "json"}
+    if polygon_geojson:
+        params["polygon_geojson"] = 1
+    response = send_instrumented(
+        "nominatim_search",
+        get_limiter("nominatim"),
+        lambda: requests.get(
+            f"{api_url}/search",
+            params=params,
+            headers={"User-Agent": "Mozilla/5.0"},
+        ),
+    )
+    response.raise_for_status()
+    results = response.json()
+    if use_cache:
+        get_geocode_cache().put(cache_key, results)
+    return results
+
+
+def fetch_area_boundary(area_name: str, api_url: str = NOMINATIM_API_URL) -> dict:
+    """
+    Fetch the boundary of a named area, to sample locations inside it.
+
+    Args:
+        area_name (str): Name of the area, e.g. 'Elefsina'.
+        api_url (str): Base URL of the Nominatim API.
+
+    Returns:
+        dict: The first search result whose boundary is a Polygon or MultiPolygon.
+
+    Raises:
+        ValueError: If no result has a polygon boundary.
+    """
+    for result in search(area_name, polygon_geojson=True, api_url=api_url):
+        if result.get("geojson", {}).get("type") in ("Polygon", "MultiPolygon"):
+            return result
+    raise ValueError(f"Nominatim has no polygon boundary for '{area_name}'.")
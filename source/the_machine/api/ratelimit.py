@@ -0,0 +1,339 @@
+import random
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import requests
+
+from ..config import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    DEFAULT_QUOTA_FILE,
+    MAX_RETRIES,
+    RATE_LIMITS,
+)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class QuotaExceededError(RuntimeError):
+    """Raised when the daily request quota of an upstream has been used up."""
+
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """
+    Parse the Retry-After header, given either in seconds or as an HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _today() -> str:
+    return date.today().isoformat()
+
+
+class QuotaStore:
+    """
+    Daily request counts of the upstream APIs, kept in SQLite so that they survive restarts
+    and are shared by every process that uses the same file.
+
+    Every request reserves a unit of the quota before it is sent, in a single statement,
+    so concurrent processes never exceed the quota together. A request that turns out not
+    to be billable gives its unit back.
+
+    Args:
+        path (str): Path of the SQLite database; created if it does not exist.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUOTA_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS quota (upstream TEXT NOT NULL, day TEXT NOT NULL, "
+            "used INTEGER NOT NULL, PRIMARY KEY (upstream, day))"
+        )
+        self._db.commit()
+
+    def reserve(self, upstream: str, quota: int, day: str) -> bool:
+        """
+        Count a request against the quota of a day, if any of it is left.
+
+        Returns:
+            bool: True if the request was counted, False if the quota is used up.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO quota (upstream, day, used) VALUES (?, ?, 0)",
+                (upstream, day),
+            )
+            reserved = self._db.execute(
+                "UPDATE quota SET used = used + 1 WHERE upstream = ? AND day = ? AND used < ?",
+                (upstream, day, quota),
+            ).rowcount
+            # Earlier days are not needed anymore
+            self._db.execute(
+                "DELETE FROM quota WHERE upstream = ? AND day < ?", (upstream, day)
+            )
+            self._db.commit()
+        return bool(reserved)
+
+    def release(self, upstream: str, day: str):
+        """
+        Give back a reserved request that was not billed.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE quota SET used = used - 1 WHERE upstream = ? AND day = ? AND used > 0",
+                (upstream, day),
+            )
+            self._db.commit()
+
+    def used(self, upstream: str, day: str) -> int:
+        """
+        Returns:
+            int: Number of requests counted against the quota of a day.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT used FROM quota WHERE upstream = ? AND day = ?", (upstream, day)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter with retries and daily quota accounting for one upstream API.
+
+    A single instance is meant to be shared by every thread that calls the upstream, see
+    `get_limiter`. When the upstream asks to back off (429 with a Retry-After header),
+    all threads are paused, not just the one that received the response.
+
+    Only attempts that return a successful response count against the daily quota: retried
+    429 and 5xx responses, errors and failed connections are not billed. With a
+    `quota_store`, the quota is shared by every process using it and survives restarts;
+    without one, it is counted in memory by this process alone.
+
+    Args:
+        name (str): Name of the upstream, used in error messages.
+        rate (float): Sustained number of requests per second.
+        burst (int): Maximum number of requests that can be sent at once.
+        daily_quota (int, optional): Maximum number of billable requests per day; unlimited
+            if None.
+        quota_store (QuotaStore, optional): Where the daily quota is counted.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int = 1,
+        daily_quota: Optional[int] = None,
+        quota_store: Optional[QuotaStore] = None,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.quota_store = quota_store
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._quota_day = _today()
+
+        self.requests = 0
+        self.retries = 0
+        self.quota_used = 0
+        self.throttled_seconds = 0.0
+
+    def _reserve_quota(self) -> str:
+        """
+        Count a request against the quota of today.
+
+        Returns:
+            str: The day the request was counted on, to release it on.
+
+        Raises:
+            QuotaExceededError: If the quota is used up.
+        """
+        today = _today()
+        if self.quota_store is not None and self.daily_quota is not None:
+            reserved = self.quota_store.reserve(self.name, self.daily_quota, today)
+        else:
+            if today != self._quota_day:
+                self._quota_day = today
+                self.quota_used = 0
+            reserved = self.daily_quota is None or self.quota_used < self.daily_quota
+            self.quota_used += reserved
+        if not reserved:
+            raise QuotaExceededError(
+                f"Daily quota of {self.daily_quota} requests to {self.name} is used up."
+            )
+        return today
+
+    def _release_quota(self, day: str):
+        """Give back the quota of a request that was not billed."""
+        with self._lock:
+            if self.quota_store is not None and self.daily_quota is not None:
+                self.quota_store.release(self.name, day)
+            elif day == self._quota_day:
+                self.quota_used -= 1
+
+    def acquire(self, billable: bool = True) -> Optional[str]:
+        """
+        Block until a request may be sent.
+
+        Args:
+            billable (bool): If True, the request counts against the daily quota, unless it
+                turns out not to be billed, see `call`.
+
+        Returns:
+            str: The day a billable request was counted on, or None.
+        """
+        day = None
+        with self._lock:
+            if billable:
+                day = self._reserve_quota()
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Reserve a token, possibly going into debt, and wait until it is paid off
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now, 0.0)
+            self.requests += 1
+            self.throttled_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return day
+
+    def pause(self, seconds: float):
+        """
+        Hold back every request to this upstream for the given number of seconds.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]):
+        with self._lock:
+            self.retries += 1
+        delay = _retry_after_seconds(response) if response is not None else None
+        if delay is not None:
+            # Hold back every thread; the wait happens in the next acquire()
+            self.pause(delay)
+            return
+        # Exponential backoff with full jitter
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+        with self._lock:
+            self.throttled_seconds += delay
+        time.sleep(delay)
+
+    def call(
+        self,
+        send: Callable[[], requests.Response],
+        billable: bool = True,
+        max_retries: int = MAX_RETRIES,
+    ) -> requests.Response:
+        """
+        Send a request under the rate limit, retrying on throttling, server and connection errors.
+
+        Args:
+            send (Callable): Function that sends the request and returns the response.
+            billable (bool): If True, every attempt that returns a successful response
+                counts against the daily quota.
+            max_retries (int): Maximum number of retries after the first attempt.
+
+        Returns:
+            requests.Response: The first response that should not be retried, or the last one.
+
+        Raises:
+            QuotaExceededError: If the daily quota is used up.
+            requests.exceptions.RequestException: If the last attempt failed to connect.
+        """
+        for attempt in range(max_retries + 1):
+            day = self.acquire(billable=billable)
+            response = None
+            try:
+                response = send()
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ):
+                if attempt == max_retries:
+                    raise
+                self._backoff(attempt, None)
+                continue
+            finally:
+                # Only successful responses are billed
+                if day is not None and (response is None or not response.ok):
+                    self._release_quota(day)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+            # Release the connection of a streamed response that will not be read
+            response.close()
+            self._backoff(attempt, response)
+        return response
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Number of requests and retries, seconds spent throttled and daily quota usage.
+        """
+        quota_used = self.quota_used
+        if self.quota_store is not None and self.daily_quota is not None:
+            quota_used = self.quota_store.used(self.name, _today())
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "quota_used": quota_used,
+                "daily_quota": self.daily_quota,
+            }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    """
+    Get the process-wide rate limiter of an upstream, configured from RATE_LIMITS.
+
+    A daily quota is counted in DEFAULT_QUOTA_FILE, shared by every process.
+
+    Args:
+        name (str): Name of the upstream, e.g. 'streetview' or 'nominatim'.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            limits = RATE_LIMITS[name]
+            store = QuotaStore() if limits["daily_quota"] is not None else None
+            _limiters[name] = RateLimiter(name, **limits, quota_store=store)
+        return _limiters[name]
@@ -1,14 +1,68 @@
 import os
 
 STREETVIEW_API_URL = "https://maps.googleapis.com/maps/api/streetview"
+NOMINATIM_API_URL = "https://nominatim.openstreetmap.org"
 
 
 DEFAULT_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".streetview_photographer")
 DEFAULT_CONFIG_FILE = os.path.join(DEFAULT_CONFIG_DIR, "config.ini")
 
+# Process-wide request limits per upstream API
+RATE_LIMITS = {
+    "streetview": {
+        "rate": 50,  # requests per second
+        "burst": 50,
+        "daily_quota": None,  # images per day, shared by all processes, None for unlimited
+    },
+    "nominatim": {
+        "rate": 1,  # usage policy: an absolute maximum of 1 request per second
+        "burst": 1,
+        "daily_quota": None,
+    },
+}
+MAX_RETRIES = 5  # retries on 429, 5xx and connection errors
+BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+BACKOFF_MAX = 60.0  # seconds
+
+DEFAULT_CACHE_DIR = os.path.join(DEFAULT_CONFIG_DIR, "cache")
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024**3  # evict least recently used images above 2 GiB
+DEFAULT_QUOTA_FILE = os.path.join(DEFAULT_CACHE_DIR, "quota.sqlite")  # daily quota counts
+
+SHARD_MAX_BYTES = 1024**3  # size at which a shard store starts a new shard file
+AGENT_PHOTO_STORE = None  # directory of a shard store for the agent's photos, None for plain files
+
+NEAR_DUPLICATE_THRESHOLD = 6  # differing bits (of 64) up to which two images are near-duplicates
+PLACEHOLDER_MAX_STD = 4.0  # grayscale standard deviation (0-255) below which an image is blank
+PLACEHOLDER_HASHES = ()  # perceptual hashes of placeholder images seen, e.g. "no imagery here"
+DEFAULT_HASH_WORKERS = min(4, os.cpu_count() or 1)  # processes decoding and hashing images
+HASH_BATCH_SIZE = 64  # fetched images checked for near-duplicates at a time
+AGENT_DROP_NEAR_DUPLICATES = False  # give the agent the earlier photo instead of a near-duplicate
+
+DEFAULT_PHOTO_INDEX_FILE = os.path.join(DEFAULT_CONFIG_DIR, "photos.sqlite")
+PHOTO_INDEX_PRECISION = 9  # geohash characters stored per photo, cells of about 5 x 5 m
+NEARBY_HEADING_TOLERANCE = 30  # degrees between the headings of photos that face the same way
+AGENT_SKIP_NEARBY = None  # e.g. 10: meters within which the agent reuses a photo of the same view
+
+DEFAULT_GEOCODE_CACHE_FILE = os.path.join(DEFAULT_CACHE_DIR, "geocode.sqlite")
+GEOCODE_CACHE_TTL = 30 * 24 * 3600  # seconds before a place name is looked up again
+GEOCODE_CACHE_MAX_ENTRIES = 10_000  # evict least recently used place names on disk above this
+GEOCODE_CACHE_MEMORY_ENTRIES = 256  # place names kept in memory
+
+DEFAULT_PLAN_CACHE_FILE = os.path.join(DEFAULT_CACHE_DIR, "plans.sqlite")
+PLAN_CACHE_TTL = 7 * 24 * 3600  # seconds before a prompt is planned by the model again
+AGENT_REPLAY_PLANS = False  # replay the cached tool calls of a prompt instead of running the agent
+
+TILE_GEOHASH_PRECISION = 6  # tiles of a tiled run are geohash cells, of about 1.2 x 0.6 km
+TILE_LEASE_SECONDS = 300  # a tile is handed out again if its worker is silent for this long
+TILE_MAX_ATTEMPTS = 3  # claims of a tile before it is marked failed
+
 DEFAULT_LOCATION_TYPE = "coordinates"
 DEFAULT_INPUT_FILE = "athens_random.csv"
 DEFAULT_SAVE_DIR = os.path.join(os.getcwd(), "streetviews")
+DEFAULT_WORKERS = 8  # concurrent requests when fetching without manual checks
+DEFAULT_CHUNK_SIZE = 10_000  # locations generated or read per chunk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes of an image held in memory at a time while saving it
+DOWNLOAD_FSYNC = False  # flush every image to disk before renaming it, to also survive power loss
 
 DEFAULT_API_PARAMS = {
     "n_addresses": 1,
@@ -19,6 +73,9 @@ DEFAULT_API_PARAMS = {
     "pitch": "10",  # [-90, 90]: up/down angle of the camera
     "source": "default",  # viewing mode: 'default' or 'outdoor'
     "return_error_code": "true",
+    "headings": None,  # e.g. [0, 90, 180, 270]: capture one view per heading at every location
+    "pitches": None,  # e.g. [0, 30]: capture one view per pitch (and heading) at every location
+    "stitch": False,  # combine the views of a location into one strip image (requires Pillow)
 }
 
 # Default bounding box for Athens (can be over-written)
@@ -27,6 +84,12 @@ DEFAULT_LOCATION_PARAMS = {
     "max_lat": 38092677,
     "min_lon": 23665374,
     "max_lon": 23926643,
-    "method": "random",  # sample method: 'random' or 'even'
+    "method": "random",  # sample method: 'random', 'even', 'halton', 'sobol' or 'poisson'
     "n_locs": 10,  # number of photos / locations to generate
+    "min_distance": 50,  # meters between any two locations with the 'poisson' method
+    "seed": 42,  # seed of the 'random' and 'poisson' methods
 }
+
+# Histogram buckets of the request metrics, see api/metrics.py
+METRICS_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_BYTES_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 1024**2, 5 * 1024**2)
@@ -0,0 +1,194 @@
+import multiprocessing
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from ..config import (
+    DEFAULT_HASH_WORKERS,
+    NEAR_DUPLICATE_THRESHOLD,
+    PLACEHOLDER_HASHES,
+    PLACEHOLDER_MAX_STD,
+)
+from .hashing import HammingIndex, ImageSource, hash_images
+
+UNIQUE = "unique"
+DUPLICATE = "duplicate"  # looks like an image checked before
+PLACEHOLDER = "placeholder"  # blank, or looks like the "no imagery" placeholder
+UNREADABLE = "unreadable"  # could not be decoded, so could not be judged
+
+
+@dataclass(frozen=True)
+class ImageVerdict:
+    """
+    Outcome of checking an image against the images seen before.
+
+    Attributes:
+        key (str): Key the image was checked under, e.g. its path.
+        status (str): One of 'unique', 'duplicate', 'placeholder' or 'unreadable'.
+        duplicate_of (str, optional): Key of the most similar earlier image, for duplicates.
+        distance (int, optional): Number of bits in which their perceptual hashes differ.
+    """
+
+    key: str
+    status: str
+    duplicate_of: Optional[str] = None
+    distance: Optional[int] = None
+
+
+def _signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateDetector:
+    """
+    Flag images that look like an image seen before, or like the "no imagery" placeholder.
+
+    Nearby locations often resolve to the same panorama, or to panoramas taken a few meters
+    apart, and an image request answered with a placeholder still costs a request. Every
+    image is reduced to a perceptual hash and a difference hash (see `hashing`); an image is
+    a near-duplicate of an earlier one when both hashes are within `threshold` bits of it,
+    found through a `HammingIndex` of the perceptual hashes of the unique images. Images that
+    are almost uniform, or whose hash is close to one of PLACEHOLDER_HASHES, are placeholders.
+
+    Hashes are kept in an SQLite file, so that images are checked incrementally against every
+    image of earlier runs, and batches are decoded and hashed on a pool of processes.
+    Requires [Pillow](https://python-pillow.org/), which is not installed by default.
+
+    Args:
+        path (str): SQLite file holding the hashes; created if needed.
+        threshold (int): Maximum number of differing bits (out of 64) of a near-duplicate.
+        workers (int): Number of processes that batches are hashed on; with 1, images are
+            hashed in the calling process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threshold: int = NEAR_DUPLICATE_THRESHOLD,
+        workers: int = DEFAULT_HASH_WORKERS,
+    ):
+        import PIL  # noqa: F401, fail early rather than flag every image as unreadable
+
+        self.path = path
+        self.threshold = threshold
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "key TEXT PRIMARY KEY, phash INTEGER NOT NULL, dhash INTEGER NOT NULL, "
+            "status TEXT NOT NULL, duplicate_of TEXT, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+        self._index = HammingIndex(threshold)
+        self._indexed = set()
+        rows = self._db.execute(
+            "SELECT key, phash, dhash FROM images WHERE status = ?", (UNIQUE,)
+        )
+        for key, phash, dhash in rows:
+            self._index.add(_unsigned(phash), (key, _unsigned(dhash)))
+            self._indexed.add(key)
+        self._placeholders = HammingIndex(threshold)
+        for phash in PLACEHOLDER_HASHES:
+            self._placeholders.add(phash, None)
+
+    def check(self, key: str, source: ImageSource) -> ImageVerdict:
+        """
+        Check a single image in the calling process, see `check_many`.
+        """
+        return self._classify_all([key], hash_images([source]))[0]
+
+    def check_many(self, items: Sequence[Tuple[str, ImageSource]]) -> List[ImageVerdict]:
+        """
+        Check a batch of images, hashing them in parallel.
+
+        Every image is compared with the images of earlier batches and runs, and with the
+        images before it in the batch. Unique images are remembered for later checks.
+
+        Args:
+            items (Sequence): (key, source) of every image, where source is its path or
+                the image itself.
+
+        Returns:
+            list: An ImageVerdict per image, in order.
+        """
+        sources = [source for _, source in items]
+        if self.workers > 1 and len(sources) > 1:
+            if self._executor is None:
+                # Forking a process that runs threads can deadlock, so workers are spawned
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            size = -(-len(sources) // self.workers)
+            batches = [sources[i : i + size] for i in range(0, len(sources), size)]
+            hashes = [h for batch in self._executor.map(hash_images, batches) for h in batch]
+        else:
+            hashes = hash_images(sources)
+        return self._classify_all([key for key, _ in items], hashes)
+
+    def _classify_all(self, keys: List[str], hashes: list) -> List[ImageVerdict]:
+        with self._lock:
+            verdicts = [self._classify(key, hashed) for key, hashed in zip(keys, hashes)]
+            self._db.commit()
+        return verdicts
+
+    def _classify(self, key: str, hashed: Optional[Tuple[int, int, float]]) -> ImageVerdict:
+        if hashed is None:
+            return ImageVerdict(key, UNREADABLE)
+        phash, dhash, deviation = hashed
+
+        if deviation <= PLACEHOLDER_MAX_STD or self._placeholders.query(phash):
+            verdict = ImageVerdict(key, PLACEHOLDER)
+        else:
+            matches = [
+                (other, distance)
+                for (other, other_dhash), distance in self._index.query(phash)
+                if other != key and (dhash ^ other_dhash).bit_count() <= self.threshold
+            ]
+            if matches:
+                verdict = ImageVerdict(key, DUPLICATE, *matches[0])
+            else:
+                verdict = ImageVerdict(key, UNIQUE)
+                if key not in self._indexed:
+                    self._index.add(phash, (key, dhash))
+                    self._indexed.add(key)
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO images "
+            "(key, phash, dhash, status, duplicate_of, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, _signed(phash), _signed(dhash), verdict.status, verdict.duplicate_of, time.time()),
+        )
+        return verdict
+
+    def counts(self) -> dict:
+        """
+        Returns:
+            dict: Number of checked images per status.
+        """
+        with self._lock:
+            return dict(
+                self._db.execute("SELECT status, COUNT(*) FROM images GROUP BY status")
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> "NearDuplicateDetector":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,176 @@
+import itertools
+from collections import defaultdict
+from typing import Hashable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Images are reduced to a grayscale thumbnail of this size (width, height) before hashing:
+# 4x4 blocks of it give the 9x8 grid of the difference hash, and its DCT the perceptual hash
+THUMBNAIL_SIZE = (36, 32)
+
+ImageSource = Union[str, bytes]
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix, so that `_dct_matrix(n) @ x` is the DCT of x."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_ROWS = _dct_matrix(THUMBNAIL_SIZE[1]).astype(np.float32)
+_DCT_COLUMNS = _dct_matrix(THUMBNAIL_SIZE[0]).astype(np.float32)
+
+
+def load_thumbnail(source: ImageSource) -> np.ndarray:
+    """
+    Decode an image into the grayscale thumbnail that is hashed.
+
+    Requires [Pillow](https://python-pillow.org/), which is not installed by default.
+    JPEGs are decoded at reduced size straight from their DCT coefficients, which is
+    much faster than decoding them in full.
+
+    Args:
+        source (str or bytes): Path of the image, or the image itself.
+
+    Returns:
+        np.ndarray: Pixel values as float32, with shape (height, width) of THUMBNAIL_SIZE.
+    """
+    import io
+
+    from PIL import Image
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        image.draft("L", (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        thumbnail = image.convert("L").resize(THUMBNAIL_SIZE, Image.Resampling.BOX)
+        return np.asarray(thumbnail, dtype=np.float32)
+
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Pack rows of 64 booleans into unsigned 64-bit integers, first bit highest."""
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def hash_thumbnails(thumbnails: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute the perceptual and difference hashes of a batch of thumbnails at once.
+
+    The perceptual hash (pHash) sets a bit for every one of the 8x8 lowest frequencies of
+    the thumbnail's DCT that is above their median. The difference hash (dHash) sets a bit
+    for every pair of horizontally adjacent cells of a 9x8 grid whose brightness increases.
+    Similar images have hashes that differ in few bits.
+
+    Args:
+        thumbnails (np.ndarray): Thumbnails from `load_thumbnail`, shape (n, height, width).
+
+    Returns:
+        tuple: pHashes and dHashes as uint64 arrays, and the standard deviation of every
+            thumbnail, which is close to zero for blank images.
+    """
+    n = len(thumbnails)
+    width, height = THUMBNAIL_SIZE
+    cells = thumbnails.reshape(n, 8, height // 8, 9, width // 9).mean(axis=(2, 4))
+    dhashes = _pack_bits((cells[:, :, 1:] > cells[:, :, :-1]).reshape(n, 64))
+
+    # Only the lowest frequencies are needed, so only the first 8 rows of the DCT matrices
+    low = (_DCT_ROWS[:8] @ thumbnails @ _DCT_COLUMNS[:8].T).reshape(n, 64)
+    # The first coefficient is the mean brightness, which says nothing about structure
+    medians = np.median(low[:, 1:], axis=1)
+    phashes = _pack_bits(low > medians[:, None])
+
+    return phashes, dhashes, thumbnails.std(axis=(1, 2))
+
+
+def hash_images(sources: Sequence[ImageSource]) -> List[Optional[Tuple[int, int, float]]]:
+    """
+    Hash a batch of images, see `hash_thumbnails`.
+
+    Args:
+        sources (Sequence): Paths of the images, or the images themselves.
+
+    Returns:
+        list: (pHash, dHash, standard deviation) of every image, or None for images that
+            could not be decoded.
+    """
+    thumbnails, decoded = [], []
+    for i, source in enumerate(sources):
+        try:
+            thumbnails.append(load_thumbnail(source))
+            decoded.append(i)
+        except (OSError, ValueError):
+            pass  # not an image Pillow can read, e.g. truncated
+    results = [None] * len(sources)
+    if thumbnails:
+        phashes, dhashes, deviations = hash_thumbnails(np.stack(thumbnails))
+        for i, phash, dhash, deviation in zip(decoded, phashes, dhashes, deviations):
+            results[i] = (int(phash), int(dhash), float(deviation))
+    return results
+
+
+class HammingIndex:
+    """
+    Index of 64-bit hashes that finds the ones within a Hamming distance in sub-linear time.
+
+    Uses multi-index hashing: every hash is split into `n_chunks` chunks, each indexed in
+    its own table. Two hashes within `threshold` bits of each other have at least one chunk
+    within `threshold // n_chunks` bits, so a query only needs to look up the chunks near
+    its own, then check the full distance of the few candidates found.
+
+    Args:
+        threshold (int): Maximum number of differing bits of a match.
+        n_chunks (int): Number of chunks; more chunks mean fewer lookups for large
+            thresholds but more candidates to check.
+    """
+
+    def __init__(self, threshold: int, n_chunks: int = 4):
+        if 64 % n_chunks:
+            raise ValueError("n_chunks must divide 64.")
+        self.threshold = threshold
+        self.n_chunks = n_chunks
+        self._chunk_bits = 64 // n_chunks
+        self._chunk_mask = (1 << self._chunk_bits) - 1
+        radius = threshold // n_chunks
+        # Every way to flip up to `radius` bits of a chunk
+        self._flips = [
+            sum(1 << bit for bit in bits)
+            for n_bits in range(radius + 1)
+            for bits in itertools.combinations(range(self._chunk_bits), n_bits)
+        ]
+        self._tables = [defaultdict(list) for _ in range(n_chunks)]
+        self._items = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _chunks(self, value: int) -> List[int]:
+        return [
+            (value >> (i * self._chunk_bits)) & self._chunk_mask
+            for i in range(self.n_chunks)
+        ]
+
+    def add(self, value: int, item: Hashable):
+        """
+        Index a hash with the item it belongs to.
+        """
+        position = len(self._items)
+        self._items.append((value, item))
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table[chunk].append(position)
+
+    def query(self, value: int) -> List[Tuple[Hashable, int]]:
+        """
+        Returns:
+            list: (item, distance) of every indexed hash within the threshold, closest first.
+        """
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for flip in self._flips:
+                candidates.update(table.get(chunk ^ flip, ()))
+        matches = []
+        for position in candidates:
+            other, item = self._items[position]
+            distance = (value ^ other).bit_count()
+            if distance <= self.threshold:
+                matches.append((item, distance))
+        return sorted(matches, key=lambda match: match[1])
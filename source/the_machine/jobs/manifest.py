@@ -0,0 +1,143 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"  # declined during the manual check
+NO_IMAGERY = "no_imagery"  # dropped by the metadata pre-flight, or as a placeholder image
+DUPLICATE = "duplicate"  # dropped as a near-duplicate of an earlier image
+NEARBY = "nearby"  # not fetched, a photo facing the same way was already taken close by
+
+# Statuses that a resumed run does not revisit
+FINISHED_STATUSES = (DONE, FAILED, NO_IMAGERY, DUPLICATE, NEARBY)
+
+RUN_MODES = ("run", "resume", "retry-failed")
+
+
+class JobManifest:
+    """
+    Durable record of the status of every location of a fetch run.
+
+    The manifest is a SQLite database with one row per input location, keyed by the row
+    number of the location in the input. Every status change is committed immediately,
+    so a run that is killed can be resumed from the last completed location.
+
+    Args:
+        path (str): Path of the SQLite database; created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            "row INTEGER PRIMARY KEY, location TEXT NOT NULL, filename TEXT, "
+            "status TEXT NOT NULL, status_code INTEGER, error TEXT, updated_at REAL NOT NULL, "
+            "sha256 TEXT)"
+        )
+        # Manifests written before checksums were recorded lack the column
+        columns = [column[1] for column in self._db.execute("PRAGMA table_info(locations)")]
+        if "sha256" not in columns:
+            self._db.execute("ALTER TABLE locations ADD COLUMN sha256 TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS locations_status ON locations (status)"
+        )
+        self._db.commit()
+
+    def statuses(self, rows: Iterable[int], locations: Iterable[str]) -> Dict[int, str]:
+        """
+        Look up the recorded status of input rows.
+
+        A row only counts as recorded if its location matches, so a manifest reused with a
+        different input does not skip unrelated locations.
+
+        Args:
+            rows (iterable): Input row numbers.
+            locations (iterable): Formatted location string of every row.
+
+        Returns:
+            dict: Status of every recorded row, by row number.
+        """
+        wanted = {int(row): location for row, location in zip(rows, locations)}
+        wanted_rows = list(wanted)
+        statuses = {}
+        # Query in batches to stay below SQLite's limit on bound parameters
+        for start in range(0, len(wanted_rows), 500):
+            batch = wanted_rows[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            records = self._db.execute(
+                f"SELECT row, location, status FROM locations WHERE row IN ({placeholders})",
+                batch,
+            )
+            for row, location, status in records:
+                if wanted[row] == location:
+                    statuses[row] = status
+        return statuses
+
+    def mark_pending(
+        self, rows: Iterable[int], locations: Iterable[str], filenames: Iterable[str]
+    ):
+        """
+        Record rows that are about to be fetched.
+
+        Args:
+            rows (iterable): Input row numbers.
+            locations (iterable): Formatted location string of every row.
+            filenames (iterable): Output path of every row.
+        """
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO locations (row, location, filename, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (int(row), location, filename, PENDING, now)
+                for row, location, filename in zip(rows, locations, filenames)
+            ],
+        )
+        self._db.commit()
+
+    def record(
+        self,
+        row: int,
+        location: str,
+        status: str,
+        filename: Optional[str] = None,
+        status_code: Optional[int] = None,
+        error: Optional[str] = None,
+        sha256: Optional[str] = None,
+    ):
+        """
+        Record the outcome of a row and commit it to disk.
+
+        Args:
+            row (int): Input row number.
+            location (str): Formatted location string.
+            status (str): New status of the row.
+            filename (str, optional): Output path of the image.
+            status_code (int, optional): HTTP status code of the response.
+            error (str, optional): Error message when the request failed.
+            sha256 (str, optional): Hex SHA-256 digest of the image.
+        """
+        self._db.execute(
+            "INSERT OR REPLACE INTO locations "
+            "(row, location, filename, status, status_code, error, updated_at, sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (int(row), location, filename, status, status_code, error, time.time(), sha256),
+        )
+        self._db.commit()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns:
+            dict: Number of rows per status.
+        """
+        return dict(
+            self._db.execute("SELECT status, COUNT(*) FROM locations GROUP BY status")
+        )
+
+    def close(self):
+        self._db.close()
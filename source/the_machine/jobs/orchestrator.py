@@ -0,0 +1,406 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from ..config import (
+    DEFAULT_API_PARAMS,
+    DEFAULT_LOCATION_PARAMS,
+    DEFAULT_SAVE_DIR,
+    DEFAULT_WORKERS,
+    RATE_LIMITS,
+    TILE_GEOHASH_PRECISION,
+    TILE_LEASE_SECONDS,
+    TILE_MAX_ATTEMPTS,
+)
+from ..locations.geohash import bounding_box, covering
+from .manifest import DONE, FAILED, JobManifest
+from .tiles import TileLease, TileQueue
+
+MICRODEGREES = 1_000_000
+
+
+class LeaseLost(Exception):
+    """Raised in a worker whose tile was handed to another worker."""
+
+
+def default_worker_id() -> str:
+    """
+    Returns:
+        str: An identifier of the current process that is unique across machines.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def plan_tiles(location_params: dict, precision: int = TILE_GEOHASH_PRECISION) -> List[str]:
+    """
+    Split the bounding box of a run into geohash tiles.
+
+    Args:
+        location_params (dict): Generation parameters, see DEFAULT_LOCATION_PARAMS.
+        precision (int): Geohash precision of the tiles.
+
+    Returns:
+        list: The geohash of every tile overlapping the bounding box.
+    """
+    if location_params.get("area") is not None:
+        raise ValueError("Tiled runs split a bounding box; 'area' is not supported.")
+    return covering(
+        location_params["min_lat"] / MICRODEGREES,
+        location_params["max_lat"] / MICRODEGREES,
+        location_params["min_lon"] / MICRODEGREES,
+        location_params["max_lon"] / MICRODEGREES,
+        precision,
+    )
+
+
+def _clip_to_tile(geohash: str, location_params: dict) -> Dict[str, int]:
+    """The bounding box of a run clipped to a tile, in microdegrees."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(geohash)
+    return {
+        "min_lat": max(location_params["min_lat"], round(min_lat * MICRODEGREES)),
+        "max_lat": min(location_params["max_lat"], round(max_lat * MICRODEGREES)),
+        "min_lon": max(location_params["min_lon"], round(min_lon * MICRODEGREES)),
+        "max_lon": min(location_params["max_lon"], round(max_lon * MICRODEGREES)),
+    }
+
+
+def allocate_locations(location_params: dict, precision: int) -> Dict[str, int]:
+    """
+    Spread the n_locs of a run over its tiles in proportion to their areas.
+
+    Every tile gets the whole part of its share and the remaining locations go to the
+    tiles with the largest fractional parts, so the tiles add up to exactly n_locs and
+    small tiles, e.g. slivers along the edges of the bounding box, may get none.
+
+    Args:
+        location_params (dict): Generation parameters of the whole run.
+        precision (int): Geohash precision of the tiles.
+
+    Returns:
+        dict: Number of locations of every tile, by geohash.
+    """
+    areas = {}
+    for geohash in plan_tiles(location_params, precision):
+        tile = _clip_to_tile(geohash, location_params)
+        areas[geohash] = max(0, tile["max_lat"] - tile["min_lat"]) * max(
+            0, tile["max_lon"] - tile["min_lon"]
+        )
+    total = sum(areas.values())
+    if not total:
+        return dict.fromkeys(areas, 0)
+    n_locs = location_params["n_locs"]
+    quotas = {geohash: n_locs * area / total for geohash, area in areas.items()}
+    allocation = {geohash: int(quota) for geohash, quota in quotas.items()}
+    remainder = n_locs - sum(allocation.values())
+    # Ties go to the first tiles in geohash order, so every worker computes the same split
+    by_fraction = sorted(
+        quotas, key=lambda geohash: (allocation[geohash] - quotas[geohash], geohash)
+    )
+    for geohash in by_fraction[:remainder]:
+        allocation[geohash] += 1
+    return allocation
+
+
+def tile_location_params(
+    geohash: str, location_params: dict, n_locs: Optional[int] = None
+) -> dict:
+    """
+    Generation parameters of the part of a run's bounding box that lies in a tile.
+
+    The tile gets its share of n_locs by area, see `allocate_locations`, so every tile is
+    sampled as densely as the whole bounding box would be, and a seed of its own, so that
+    random methods do not repeat the same pattern in every tile.
+
+    Args:
+        geohash (str): Geohash of the tile.
+        location_params (dict): Generation parameters of the whole run.
+        n_locs (int, optional): Number of locations of the tile, if already allocated.
+
+    Returns:
+        dict: The parameters, with the bounding box clipped to the tile.
+    """
+    if n_locs is None:
+        n_locs = allocate_locations(location_params, len(geohash))[geohash]
+    return {
+        **location_params,
+        **_clip_to_tile(geohash, location_params),
+        "n_locs": n_locs,
+        "seed": zlib.crc32(geohash.encode()),
+    }
+
+
+def _fetch_tile(
+    lease: TileLease,
+    settings: dict,
+    save_dir: str,
+    lost: threading.Event,
+    fetch_options: dict,
+    n_locs: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Generate and fetch the locations of a tile into its own directory.
+
+    Every tile keeps its own job manifest, so a tile taken over from a dead worker
+    resumes where that worker stopped. Unless the run sets n_addresses, every location
+    of the tile is fetched.
+
+    Returns:
+        dict: Number of locations per status in the manifest of the tile.
+    """
+    from ..api.client import iter_fetch_images
+    from ..api.ratelimit import QuotaExceededError
+    from ..locations.generator import iter_locations
+
+    location_params = tile_location_params(lease.geohash, settings["location_params"], n_locs)
+    if not location_params["n_locs"]:
+        return {}
+    tile_dir = os.path.join(save_dir, lease.geohash)
+    os.makedirs(tile_dir, exist_ok=True)
+    chunks = iter_locations(
+        location_params, output_file=os.path.join(tile_dir, "locations.csv")
+    )
+    results = iter_fetch_images(
+        chunks,
+        params={"n_addresses": location_params["n_locs"], **settings["api_params"]},
+        save_dir=tile_dir,
+        manual_check=False,
+        mode="resume",
+        **fetch_options,
+    )
+    try:
+        for result in results:
+            if result.quota_exceeded:
+                raise QuotaExceededError(result.error)
+            if lost.is_set():
+                raise LeaseLost(f"Lost the lease of tile {lease.geohash}")
+    finally:
+        results.close()
+    manifest = JobManifest(os.path.join(tile_dir, "manifest.sqlite"))
+    try:
+        return manifest.counts()
+    finally:
+        manifest.close()
+
+
+def _heartbeat(
+    queue_path: str,
+    lease: TileLease,
+    lease_seconds: float,
+    stop: threading.Event,
+    lost: threading.Event,
+):
+    """Renew a lease until stopped, and flag it if it is lost."""
+    queue = TileQueue(queue_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not queue.renew(lease, lease_seconds):
+                lost.set()
+                return
+    finally:
+        queue.close()
+
+
+def run_worker(
+    queue_path: str,
+    save_dir: Optional[str] = None,
+    worker: Optional[str] = None,
+    lease_seconds: float = TILE_LEASE_SECONDS,
+    workers: int = DEFAULT_WORKERS,
+    rate_share: float = 1.0,
+    **fetch_options,
+) -> int:
+    """
+    Claim tiles from a tile queue and fetch them until every tile is done or failed.
+
+    Workers can run on any machine that sees the queue and save_dir. While no tile is
+    pending, a worker waits for the leases of other workers to expire, in case they died.
+    The daily quota of the Street View API, see RATE_LIMITS, is shared by every worker
+    process on a machine through DEFAULT_QUOTA_FILE, while the request rate is shared by
+    giving every worker a part of it, see `rate_share`. A worker whose daily quota runs out
+    hands its tile back and stops; the run resumes where it stopped when started again.
+
+    Args:
+        queue_path (str): Path of the TileQueue database, set up by `run_tiled`.
+        save_dir (str, optional): Directory the tiles are saved in, one subdirectory per
+            tile. Defaults to the directory of the queue.
+        worker (str, optional): Identifier of the worker; defaults to `default_worker_id()`.
+        lease_seconds (float): Duration of the leases, renewed every third of it.
+        workers (int): Number of concurrent requests within a tile.
+        rate_share (float): Part of the Street View rate limit this worker may use;
+            `run_tiled` gives each of its processes an equal part.
+        **fetch_options: Other arguments of `iter_fetch_images`, e.g. use_cache or preflight.
+            A shard store (store_dir) only supports one writing process, so every worker
+            process needs its own.
+
+    Returns:
+        int: Number of tiles this worker completed.
+    """
+    from ..api.auth import redact_credentials
+    from ..api.client import get_credentials
+    from ..api.ratelimit import QuotaExceededError, get_limiter
+
+    get_credentials()  # fail once here rather than on every tile
+    limits = RATE_LIMITS["streetview"]
+    limiter = get_limiter("streetview")
+    limiter.rate = limits["rate"] * rate_share
+    limiter.burst = max(1, int(limits["burst"] * rate_share))
+    worker = worker or default_worker_id()
+    save_dir = save_dir or os.path.dirname(os.path.abspath(queue_path))
+    queue = TileQueue(queue_path)
+    settings = queue.settings()
+    fetch_options = {"workers": workers, **fetch_options}
+    allocations = {}  # locations of every tile, by precision
+    n_completed = 0
+    try:
+        while True:
+            lease = queue.claim(worker, lease_seconds)
+            if lease is None:
+                if queue.is_finished():
+                    return n_completed
+                time.sleep(min(lease_seconds / 10, 30))
+                continue
+
+            print(f"[{worker}] Tile {lease.geohash}, attempt {lease.attempt}")
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(
+                target=_heartbeat,
+                args=(queue_path, lease, lease_seconds, stop, lost),
+                daemon=True,
+            )
+            heartbeat.start()
+            precision = len(lease.geohash)
+            if precision not in allocations:
+                allocations[precision] = allocate_locations(settings["location_params"], precision)
+            try:
+                counts = _fetch_tile(
+                    lease,
+                    settings,
+                    save_dir,
+                    lost,
+                    fetch_options,
+                    allocations[precision].get(lease.geohash, 0),
+                )
+            except LeaseLost as e:
+                print(f"[{worker}] {e}")
+                continue
+            except QuotaExceededError as e:
+                print(f"[{worker}] {e} Stopping; tile {lease.geohash} is handed back.")
+                queue.release(lease)
+                return n_completed
+            except Exception as e:
+                error = redact_credentials(f"{type(e).__name__}: {e}")
+                print(f"[{worker}] Tile {lease.geohash} failed: {error}")
+                queue.fail(lease, error)
+                continue
+            finally:
+                stop.set()
+                heartbeat.join()
+            if queue.complete(lease, counts.get(DONE, 0), counts.get(FAILED, 0)):
+                n_completed += 1
+            print(f"[{worker}] Tile {lease.geohash} done:", counts)
+    finally:
+        # Hand back whatever this worker held, e.g. when interrupted
+        queue.release_worker(worker)
+        queue.close()
+
+
+def run_tiled(
+    location_params: dict = DEFAULT_LOCATION_PARAMS,
+    api_params: Optional[dict] = None,
+    save_dir: str = DEFAULT_SAVE_DIR,
+    queue_path: Optional[str] = None,
+    precision: int = TILE_GEOHASH_PRECISION,
+    n_processes: int = 4,
+    lease_seconds: float = TILE_LEASE_SECONDS,
+    **worker_options,
+) -> Dict[str, int]:
+    """
+    Split a bounding box into geohash tiles and fetch them with a pool of worker processes.
+
+    The tiles are queued in a `TileQueue`, together with the parameters of the run, so
+    more workers can join from other machines sharing save_dir with `run_worker`. The
+    coordinator restarts local workers that die and hands their tiles out again right
+    away; tiles of remote workers are handed out again once their leases expire. Running
+    it again with the same queue resumes the run: finished tiles are kept and tiles
+    interrupted halfway resume from their manifests.
+
+    Args:
+        location_params (dict): Generation parameters of the whole run, see
+            DEFAULT_LOCATION_PARAMS. n_locs is spread over the tiles by area.
+        api_params (dict, optional): API parameters, see DEFAULT_API_PARAMS. If they set
+            n_addresses, it caps the locations fetched in every tile; otherwise every
+            location of a tile is fetched. Defaults to DEFAULT_API_PARAMS without
+            n_addresses.
+        save_dir (str): Directory of the run, with a subdirectory per tile.
+        queue_path (str, optional): Path of the queue; defaults to 'tiles.sqlite' in save_dir.
+        precision (int): Geohash precision of the tiles.
+        n_processes (int): Number of local worker processes. They split the Street View
+            rate limit between them and share its daily quota, see `run_worker`.
+        lease_seconds (float): Duration of the leases of the tiles.
+        **worker_options: Other arguments of `run_worker`.
+
+    Returns:
+        dict: Number of tiles per status at the end of the run.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    queue_path = queue_path or os.path.join(save_dir, "tiles.sqlite")
+    tiles = plan_tiles(location_params, precision)
+    if api_params is None:
+        api_params = {
+            name: value for name, value in DEFAULT_API_PARAMS.items() if name != "n_addresses"
+        }
+    queue = TileQueue(queue_path)
+    queue.set_settings(location_params=location_params, api_params=api_params)
+    n_added = queue.add(tiles)
+    print(f"Tile queue {queue_path}: {len(tiles)} tiles, {n_added} new.", queue.counts())
+
+    # Workers are spawned rather than forked, as they run threads and open connections
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    n_started = 0
+    max_restarts = n_processes * TILE_MAX_ATTEMPTS
+
+    def start_worker():
+        nonlocal n_started
+        worker = f"{default_worker_id()}-{n_started}"
+        process = context.Process(
+            target=run_worker,
+            args=(queue_path, save_dir, worker, lease_seconds),
+            kwargs={"rate_share": 1 / n_processes, **worker_options},
+            name=worker,
+        )
+        process.start()
+        processes[worker] = process
+        n_started += 1
+
+    for _ in range(n_processes):
+        start_worker()
+    try:
+        while processes:
+            time.sleep(min(lease_seconds / 10, 5))
+            queue.requeue_expired()
+            for worker, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                del processes[worker]
+                if process.exitcode == 0:
+                    continue  # no tiles left
+                n_released = queue.release_worker(worker)
+                print(
+                    f"Worker {worker} died with exit code {process.exitcode}; "
+                    f"{n_released} tiles handed out again."
+                )
+                if n_started - n_processes < max_restarts and not queue.is_finished():
+                    start_worker()
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.join()
+        counts = queue.counts()
+        print(f"Tile queue {queue_path}:", counts)
+        queue.close()
+    return counts
@@ -0,0 +1,275 @@
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from ..config import TILE_LEASE_SECONDS, TILE_MAX_ATTEMPTS
+
+TILE_PENDING = "pending"
+TILE_LEASED = "leased"  # claimed by a worker until its lease expires
+TILE_DONE = "done"
+TILE_FAILED = "failed"  # failed or was abandoned TILE_MAX_ATTEMPTS times
+
+
+@dataclass(frozen=True)
+class TileLease:
+    """
+    A tile claimed by a worker.
+
+    Attributes:
+        geohash (str): Geohash of the tile.
+        worker (str): Identifier of the worker holding the lease.
+        attempt (int): Number of times the tile has been claimed, this time included.
+        expires_at (float): Time at which the lease expires unless renewed.
+    """
+
+    geohash: str
+    worker: str
+    attempt: int
+    expires_at: float
+
+
+class TileQueue:
+    """
+    Queue of geohash tiles shared by the workers of a tiled fetch run.
+
+    The queue is a SQLite database, so workers in several processes, or on several
+    machines sharing a file system, can use it at once. A worker claims a tile with a
+    lease, renews the lease while it works, and reports the tile done or failed. A tile
+    whose lease expires, because its worker died or lost the file system, is handed out
+    again, until it has been claimed `max_attempts` times.
+
+    SQLite relies on file locks, which some network file systems do not implement
+    correctly; the file should live on a local disk or a file system with working locks.
+
+    Args:
+        path (str): Path of the SQLite database; created if it does not exist.
+        max_attempts (int): Number of claims after which a tile that keeps failing or
+            being abandoned is marked failed.
+    """
+
+    def __init__(self, path: str, max_attempts: int = TILE_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Transactions are managed explicitly, to claim tiles atomically across processes
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            "geohash TEXT PRIMARY KEY, status TEXT NOT NULL, worker TEXT, "
+            "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "n_done INTEGER, n_failed INTEGER, error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS tiles_status ON tiles (status, lease_expires)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def set_settings(self, **settings):
+        """
+        Store JSON-serializable settings of the run, such as its parameters, so that
+        workers started elsewhere only need the path of the queue.
+        """
+        with self._transaction():
+            self._db.executemany(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)",
+                [(name, json.dumps(value)) for name, value in settings.items()],
+            )
+
+    def settings(self) -> dict:
+        """
+        Returns:
+            dict: The settings stored with `set_settings`.
+        """
+        rows = self._db.execute("SELECT name, value FROM settings")
+        return {name: json.loads(value) for name, value in rows}
+
+    def add(self, geohashes: Iterable[str]) -> int:
+        """
+        Add tiles to the queue; tiles already in it keep their status.
+
+        Returns:
+            int: Number of tiles added.
+        """
+        now = time.time()
+        with self._transaction():
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tiles (geohash, status, updated_at) VALUES (?, ?, ?)",
+                [(geohash, TILE_PENDING, now) for geohash in geohashes],
+            )
+            return self._db.total_changes - before
+
+    def claim(
+        self, worker: str, lease_seconds: float = TILE_LEASE_SECONDS
+    ) -> Optional[TileLease]:
+        """
+        Claim the next pending tile, or a tile whose lease has expired.
+
+        Args:
+            worker (str): Identifier of the worker, e.g. its host name and process id.
+            lease_seconds (float): Time the worker has to finish the tile, or renew the lease.
+
+        Returns:
+            TileLease: The claimed tile, or None if no tile is available.
+        """
+        now = time.time()
+        with self._transaction():
+            self._expire(now)
+            row = self._db.execute(
+                "SELECT geohash, attempts FROM tiles WHERE status = ? ORDER BY geohash LIMIT 1",
+                (TILE_PENDING,),
+            ).fetchone()
+            if row is None:
+                return None
+            geohash, attempts = row
+            expires_at = now + lease_seconds
+            self._db.execute(
+                "UPDATE tiles SET status = ?, worker = ?, lease_expires = ?, "
+                "attempts = ?, updated_at = ? WHERE geohash = ?",
+                (TILE_LEASED, worker, expires_at, attempts + 1, now, geohash),
+            )
+        return TileLease(geohash, worker, attempts + 1, expires_at)
+
+    def renew(self, lease: TileLease, lease_seconds: float = TILE_LEASE_SECONDS) -> bool:
+        """
+        Extend a lease, as a heartbeat of the worker holding it.
+
+        Returns:
+            bool: False if the lease was lost, e.g. because it expired and the tile was
+                claimed by another worker; the worker should then stop working on the tile.
+        """
+        now = time.time()
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE tiles SET lease_expires = ?, updated_at = ? "
+                "WHERE geohash = ? AND worker = ? AND status = ?",
+                (now + lease_seconds, now, lease.geohash, lease.worker, TILE_LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, lease: TileLease, n_done: int = 0, n_failed: int = 0) -> bool:
+        """
+        Report a tile as done.
+
+        Args:
+            lease (TileLease): Lease of the tile.
+            n_done (int): Number of images fetched.
+            n_failed (int): Number of locations that failed.
+
+        Returns:
+            bool: False if the lease had been lost, in which case nothing is recorded.
+        """
+        return self._finish(lease, TILE_DONE, n_done=n_done, n_failed=n_failed)
+
+    def fail(self, lease: TileLease, error: str) -> bool:
+        """
+        Report that a tile could not be processed. It is handed out again, unless it
+        has used up its attempts.
+
+        Returns:
+            bool: False if the lease had been lost, in which case nothing is recorded.
+        """
+        status = TILE_FAILED if lease.attempt >= self.max_attempts else TILE_PENDING
+        return self._finish(lease, status, error=error)
+
+    def _finish(self, lease: TileLease, status: str, **fields) -> bool:
+        assignments = "".join(f", {name} = ?" for name in fields)
+        with self._transaction():
+            cursor = self._db.execute(
+                f"UPDATE tiles SET status = ?, lease_expires = NULL, updated_at = ?{assignments} "
+                "WHERE geohash = ? AND worker = ? AND status = ?",
+                (status, time.time(), *fields.values(), lease.geohash, lease.worker, TILE_LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, lease: TileLease) -> bool:
+        """
+        Hand a tile back without counting the attempt, e.g. when the worker has to stop for
+        a reason unrelated to the tile.
+
+        Returns:
+            bool: False if the lease had been lost.
+        """
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE tiles SET status = ?, lease_expires = NULL, attempts = attempts - 1, "
+                "updated_at = ? WHERE geohash = ? AND worker = ? AND status = ?",
+                (TILE_PENDING, time.time(), lease.geohash, lease.worker, TILE_LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def release_worker(self, worker: str) -> int:
+        """
+        Hand the tiles of a worker known to be dead out again, without waiting for their
+        leases to expire.
+
+        Returns:
+            int: Number of released tiles, including any other expired ones.
+        """
+        with self._transaction():
+            self._db.execute(
+                "UPDATE tiles SET lease_expires = 0 WHERE worker = ? AND status = ?",
+                (worker, TILE_LEASED),
+            )
+            return self._expire(time.time())
+
+    def requeue_expired(self) -> int:
+        """
+        Hand the tiles whose leases expired out again.
+
+        Returns:
+            int: Number of requeued tiles.
+        """
+        with self._transaction():
+            return self._expire(time.time())
+
+    def _expire(self, now: float) -> int:
+        abandoned = self._db.execute(
+            "UPDATE tiles SET status = ?, error = 'lease expired', updated_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (TILE_FAILED, now, TILE_LEASED, now, self.max_attempts),
+        ).rowcount
+        return abandoned + self._db.execute(
+            "UPDATE tiles SET status = ?, updated_at = ? WHERE status = ? AND lease_expires < ?",
+            (TILE_PENDING, now, TILE_LEASED, now),
+        ).rowcount
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction that takes the database lock up front (BEGIN IMMEDIATE), so that
+        two processes never read the same pending tile before either has claimed it.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns:
+            dict: Number of tiles per status.
+        """
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM tiles GROUP BY status"))
+
+    def is_finished(self) -> bool:
+        """
+        Returns:
+            bool: True once every tile is done or failed.
+        """
+        (n_open,) = self._db.execute(
+            "SELECT COUNT(*) FROM tiles WHERE status IN (?, ?)", (TILE_PENDING, TILE_LEASED)
+        ).fetchone()
+        return n_open == 0
+
+    def close(self):
+        self._db.close()
+
@@ -0,0 +1,158 @@
+import csv
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO
+
+
+class LocationChunk:
+    """
+    Columnar table of locations, a lightweight stand-in for a pandas DataFrame.
+
+    Supports the part of the DataFrame interface used by the fetching pipeline (`len`,
+    `index`, `itertuples`, `head`, boolean row selection, column access, `assign` and
+    `to_csv`), so that generating and fetching locations does not need pandas. Use
+    `to_frame` to get a real DataFrame.
+
+    Args:
+        columns (dict): Values of every column, as lists or NumPy arrays of equal length.
+        index (Sequence, optional): Row labels, e.g. the position of every location in the
+            full input; defaults to 0..n-1.
+    """
+
+    def __init__(self, columns: Dict[str, Sequence], index: Optional[Sequence] = None):
+        self.columns = dict(columns)
+        n_rows = len(next(iter(self.columns.values()))) if self.columns else 0
+        self.index = range(n_rows) if index is None else index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+    def __getitem__(self, key):
+        """
+        Get a column by name, or the rows where a boolean mask is true.
+        """
+        if isinstance(key, str):
+            return self.columns[key]
+        if hasattr(key, "to_numpy"):  # pandas Series
+            key = key.to_numpy()
+        if hasattr(key, "nonzero"):  # NumPy array
+            positions = key.nonzero()[0]
+        else:
+            positions = [i for i, keep in enumerate(key) if keep]
+        return LocationChunk(
+            {name: _take(values, positions) for name, values in self.columns.items()},
+            index=_take(self.index, positions),
+        )
+
+    def head(self, n: int) -> "LocationChunk":
+        return LocationChunk(
+            {name: values[:n] for name, values in self.columns.items()},
+            index=self.index[:n],
+        )
+
+    def assign(self, **columns: Sequence) -> "LocationChunk":
+        return LocationChunk({**self.columns, **columns}, index=self.index)
+
+    def itertuples(self) -> Iterator[tuple]:
+        """
+        Yields:
+            namedtuple: Every row, with its label as 'Index' followed by its columns.
+        """
+        row_type = namedtuple("Location", ["Index", *self.columns], rename=True)
+        columns = [_to_list(values) for values in self.columns.values()]
+        for row in zip(_to_list(self.index), *columns):
+            yield row_type._make(row)
+
+    def to_csv(
+        self,
+        path: str,
+        mode: str = "w",
+        header: bool = True,
+        index: bool = False,
+        float_format: Optional[str] = None,
+    ):
+        """
+        Write the chunk to a CSV file, see `pandas.DataFrame.to_csv`.
+        """
+        with open(path, mode, newline="") as file:
+            writer = csv.writer(file)
+            if header:
+                writer.writerow((["Index"] if index else []) + list(self.columns))
+            for row in self.itertuples():
+                values = row if index else row[1:]
+                writer.writerow(_format_values(values, float_format))
+
+    def to_frame(self):
+        """
+        Returns:
+            pd.DataFrame: The chunk as a pandas DataFrame.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.columns, index=list(self.index))
+
+
+def _take(values: Sequence, positions: List[int]) -> Sequence:
+    if hasattr(values, "take"):  # NumPy array
+        return values.take(positions)
+    return [values[i] for i in positions]
+
+
+def _to_list(values: Sequence) -> list:
+    # NumPy arrays are converted to Python scalars, as `DataFrame.itertuples` does
+    return values.tolist() if hasattr(values, "tolist") else list(values)
+
+
+def _format_values(values: Sequence, float_format: Optional[str]) -> list:
+    if float_format is None:
+        return ["" if value is None else value for value in values]
+    return [
+        float_format % value
+        if isinstance(value, float)
+        else "" if value is None else value
+        for value in values
+    ]
+
+
+def read_csv_chunks(
+    file: TextIO,
+    chunk_size: int,
+    start_row: int = 0,
+    float_columns: Sequence[str] = ("lat", "long"),
+) -> Iterator[LocationChunk]:
+    """
+    Read a CSV file of locations in chunks, without pandas.
+
+    Args:
+        file (TextIO): The open CSV file.
+        chunk_size (int): Number of rows per chunk.
+        start_row (int): Number of data rows to skip.
+        float_columns (Sequence): Columns parsed as numbers; all others are kept as text.
+
+    Yields:
+        LocationChunk: Chunks of rows, indexed by their row number in the file.
+    """
+    reader = csv.reader(file)
+    columns = next(reader, None)
+    if columns is None:
+        return
+    parsed = [i for i, column in enumerate(columns) if column in float_columns]
+
+    for _ in range(start_row):
+        if next(reader, None) is None:
+            return
+    start = start_row
+    while True:
+        rows = [row for _, row in zip(range(chunk_size), reader)]
+        if not rows:
+            return
+        for row in rows:
+            for i in parsed:
+                row[i] = float(row[i]) if row[i] else None
+        yield LocationChunk(
+            {column: [row[i] for row in rows] for i, column in enumerate(columns)},
+            index=range(start, start + len(rows)),
+        )
+        start += len(rows)
@@ -1,73 +1,304 @@
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 import numpy as np
-import pandas as pd
 import os
-from ..config import DEFAULT_LOCATION_PARAMS
+from ..config import DEFAULT_CHUNK_SIZE, DEFAULT_LOCATION_PARAMS
+from .chunk import LocationChunk
+from .geometry import PolygonIndex, load_area
+from .sampling import halton, poisson_disk, sobol
 
 
-def _evenly_generate(params: dict) -> Tuple[np.ndarray, np.ndarray]:
+MICRODEGREES = 1_000_000
+METERS_PER_DEGREE_LAT = 110_574
+METERS_PER_DEGREE_LON_AT_EQUATOR = 111_320
+
+
+def _evenly_generate(
+    params: dict, area: Optional[PolygonIndex] = None
+) -> Tuple[np.ndarray, np.ndarray]:
     """
     Generate evenly spaced latitude and longitude arrays based on the bounding box.
 
     Args:
-        params (dict): Contains min/max latitude/longitude and n_locs.
+        params (dict): Contains min/max latitude/longitude (in microdegrees) and n_locs.
+        area (PolygonIndex, optional): Unused; grid points outside the area are dropped
+            by `iter_locations`.
 
     Returns:
-        tuple: Arrays of latitudes and longitudes.
+        tuple: Arrays of latitudes and longitudes in microdegrees.
     """
     n_points = params["n_locs"] ** 0.5
     lat_range = params["max_lat"] - params["min_lat"]
     lon_range = params["max_lon"] - params["min_lon"]
-    lat_step = int(lat_range // n_points)
-    lon_step = int(lon_range // n_points)
-    lats = np.arange(params["min_lat"], params["max_lat"], lat_step, dtype=int)
-    lons = np.arange(params["min_lon"], params["max_lon"], lon_step, dtype=int)
+    lat_step = max(int(lat_range // n_points), 1)
+    lon_step = max(int(lon_range // n_points), 1)
+    lats = np.arange(params["min_lat"], params["max_lat"], lat_step, dtype=np.int64)
+    lons = np.arange(params["min_lon"], params["max_lon"], lon_step, dtype=np.int64)
     return lats, lons
 
 
-def _randomly_generate(params: dict) -> Tuple[np.ndarray, np.ndarray]:
+def _randomly_generate(
+    params: dict, area: Optional[PolygonIndex] = None
+) -> Tuple[np.ndarray, np.ndarray]:
     """
     Generate random latitude and longitude arrays based on the bounding box.
 
     Args:
-        params (dict): Contains min/max latitude/longitude and n_locs.
+        params (dict): Contains min/max latitude/longitude (in microdegrees) and n_locs.
+        area (PolygonIndex, optional): Unused; grid points outside the area are dropped
+            by `iter_locations`.
 
     Returns:
-        tuple: Arrays of latitudes and longitudes.
+        tuple: Arrays of latitudes and longitudes in microdegrees.
     """
     n_points = int(params["n_locs"] ** 0.5)
-    rng = np.random.default_rng(seed=42)
-    lats = rng.integers(params["min_lat"], params["max_lat"], n_points)
-    lons = rng.integers(params["min_lon"], params["max_lon"], n_points)
+    rng = np.random.default_rng(seed=params.get("seed", 42))
+    lats = rng.integers(params["min_lat"], params["max_lat"], n_points, dtype=np.int64)
+    lons = rng.integers(params["min_lon"], params["max_lon"], n_points, dtype=np.int64)
     return lats, lons
 
 
-def _generate_coordinates(lats: np.ndarray, lons: np.ndarray):
+def _scale_to_bounding_box(
+    params: dict, x: np.ndarray, y: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Map points of the unit square onto the bounding box.
+
+    Returns:
+        tuple: Arrays of latitudes and longitudes in microdegrees.
+    """
+    lats = params["min_lat"] + y * (params["max_lat"] - params["min_lat"])
+    lons = params["min_lon"] + x * (params["max_lon"] - params["min_lon"])
+    return lats.astype(np.int64), lons.astype(np.int64)
+
+
+def _sample_sequence(
+    sequence, params: dict, area: Optional[PolygonIndex]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Take the first n_locs points of a low-discrepancy sequence that fall inside the area.
+    """
+    n_locs = params["n_locs"]
+    x, y = sequence(n_locs)
+    lats, lons = _scale_to_bounding_box(params, x, y)
+    if area is None:
+        return lats, lons
+
+    inside = area.contains(lons / MICRODEGREES, lats / MICRODEGREES)
+    lats, lons = [lats[inside]], [lons[inside]]
+    n_inside, n_drawn = int(inside.sum()), n_locs
+    while n_inside < n_locs:
+        # Extend the sequence by the expected number of missing points, plus a margin
+        fraction = max(n_inside / n_drawn, 0.01)
+        batch = int((n_locs - n_inside) / fraction * 1.2) + 100
+        x, y = sequence(batch, skip=1 + n_drawn)
+        batch_lats, batch_lons = _scale_to_bounding_box(params, x, y)
+        inside = area.contains(batch_lons / MICRODEGREES, batch_lats / MICRODEGREES)
+        lats.append(batch_lats[inside])
+        lons.append(batch_lons[inside])
+        n_inside += int(inside.sum())
+        n_drawn += batch
+    return np.concatenate(lats)[:n_locs], np.concatenate(lons)[:n_locs]
+
+
+def _halton_generate(
+    params: dict, area: Optional[PolygonIndex] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate exactly n_locs points of the low-discrepancy Halton sequence in the bounding box.
+
+    Args:
+        params (dict): Contains min/max latitude/longitude (in microdegrees) and n_locs.
+        area (PolygonIndex, optional): If given, only points inside the area are kept.
+
+    Returns:
+        tuple: Arrays of the latitude and longitude of every point, in microdegrees.
+    """
+    return _sample_sequence(halton, params, area)
+
+
+def _sobol_generate(
+    params: dict, area: Optional[PolygonIndex] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate exactly n_locs points of the low-discrepancy Sobol sequence in the bounding box.
+
+    Args:
+        params (dict): Contains min/max latitude/longitude (in microdegrees) and n_locs.
+        area (PolygonIndex, optional): If given, only points inside the area are kept.
+
+    Returns:
+        tuple: Arrays of the latitude and longitude of every point, in microdegrees.
+    """
+    return _sample_sequence(sobol, params, area)
+
+
+def _poisson_generate(
+    params: dict, area: Optional[PolygonIndex] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate exactly n_locs random points in the bounding box that are at least
+    min_distance meters apart from each other (Poisson-disk sampling).
+
+    Args:
+        params (dict): Contains min/max latitude/longitude (in microdegrees), n_locs and
+            min_distance (in meters).
+        area (PolygonIndex, optional): If given, only points inside the area are sampled.
+
+    Returns:
+        tuple: Arrays of the latitude and longitude of every point, in microdegrees.
+    """
+    # Sample in a local equirectangular projection, in meters
+    mid_lat = (params["min_lat"] + params["max_lat"]) / 2 / MICRODEGREES
+    meters_per_lon = METERS_PER_DEGREE_LON_AT_EQUATOR * np.cos(np.radians(mid_lat))
+    height = (params["max_lat"] - params["min_lat"]) / MICRODEGREES * METERS_PER_DEGREE_LAT
+    width = (params["max_lon"] - params["min_lon"]) / MICRODEGREES * meters_per_lon
+
+    def in_area(x, y):
+        lats = params["min_lat"] + y / height * (params["max_lat"] - params["min_lat"])
+        lons = params["min_lon"] + x / width * (params["max_lon"] - params["min_lon"])
+        return area.contains(lons / MICRODEGREES, lats / MICRODEGREES)
+
+    x, y = poisson_disk(
+        params["n_locs"],
+        width,
+        height,
+        params["min_distance"],
+        accept=in_area if area is not None else None,
+        seed=params.get("seed", 42),
+    )
+    return _scale_to_bounding_box(params, x / width, y / height)
+
+
+def _generate_coordinates(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> dict:
     """
-    Generate location coordinates along with placeholder address information.
+    Generate the grid of every latitude and longitude along with placeholder address information.
 
     Args:
-        lats (array-like): Array of latitude values.
-        lons (array-like): Array of longitude values.
+        lats (array-like): Array of latitude values in microdegrees.
+        lons (array-like): Array of longitude values in microdegrees.
+        start (int): Position of the first grid point to generate, in row-major order.
+        stop (int, optional): Position after the last grid point to generate; defaults to the full grid.
 
     Returns:
         dict: Dictionary with columns 'Address', 'City', 'Country', 'lat', 'long'.
+            'lat' and 'long' are in decimal degrees.
+    """
+    lats = np.asarray(lats, dtype=np.int64)
+    lons = np.asarray(lons, dtype=np.int64)
+    if stop is None:
+        stop = len(lats) * len(lons)
+    positions = np.arange(start, stop, dtype=np.int64)
+    return _points_to_coordinates(
+        lats[positions // len(lons)], lons[positions % len(lons)]
+    )
+
+
+def _points_to_coordinates(lats: np.ndarray, lons: np.ndarray) -> dict:
+    """
+    Convert points to location columns with placeholder address information.
+
+    Args:
+        lats (array-like): Latitude of every point in microdegrees.
+        lons (array-like): Longitude of every point in microdegrees.
+
+    Returns:
+        dict: Dictionary with columns 'Address', 'City', 'Country', 'lat', 'long'.
+            'lat' and 'long' are in decimal degrees.
+    """
+    placeholder = np.full(len(lats), "-", dtype=object)
+    return {
+        "Address": placeholder,
+        "City": placeholder,
+        "Country": placeholder,
+        "lat": np.asarray(lats) / MICRODEGREES,
+        "long": np.asarray(lons) / MICRODEGREES,
+    }
+
+
+# Methods that return latitude and longitude axes, combined into a grid of every pair
+GRID_METHODS = {
+    "random": _randomly_generate,
+    "even": _evenly_generate,
+}
+# Methods that return exactly n_locs individual points
+POINT_METHODS = {
+    "halton": _halton_generate,
+    "sobol": _sobol_generate,
+    "poisson": _poisson_generate,
+}
+SAMPLING_METHODS = {**GRID_METHODS, **POINT_METHODS}
+
+
+def iter_locations(
+    params: dict = DEFAULT_LOCATION_PARAMS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    output_file: Optional[str] = None,
+) -> Iterator[LocationChunk]:
     """
-    locs = {"Address": [], "City": [], "Country": [], "lat": [], "long": []}
-    for lat in lats:
-        for lon in lons:
-            lat_str = str(lat)
-            lon_str = str(lon)
-            # Insert decimal point as needed
-            lat_fmt = lat_str[:2] + "." + lat_str[2:]
-            lon_fmt = lon_str[:2] + "." + lon_str[2:]
-            locs["Address"].append("-")
-            locs["City"].append("-")
-            locs["Country"].append("-")
-            locs["lat"].append(lat_fmt)
-            locs["long"].append(lon_fmt)
-    return locs
+    Lazily generate location coordinates in chunks.
+
+    Only one chunk is held in memory at a time, so the grid can be arbitrarily large
+    and consumers such as `fetch_images` can start working on the first chunk right away.
+
+    Args:
+        params (dict, optional): Generation parameters; defaults to DEFAULT_LOCATION_PARAMS.
+        chunk_size (int): Number of locations per chunk.
+        output_file (str, optional): If given, every yielded chunk is also appended to this CSV file.
+
+    Yields:
+        LocationChunk: Chunks with columns 'Address', 'City', 'Country', 'lat', 'long',
+            indexed by the position of each location in the full grid.
+
+    If params contains an 'area' (a GeoJSON file path, GeoJSON object or Nominatim result
+    with a polygon boundary), the bounding box is taken from the area and only locations
+    inside its polygons are generated. Grid methods then skip the positions outside the area.
+    """
+    area = None
+    if params.get("area") is not None:
+        area = load_area(params["area"])
+        params = {**params, **area.bounding_box()}
+
+    latitudes, longitudes = SAMPLING_METHODS[params["method"]](params, area)
+    if params["method"] in GRID_METHODS:
+        n_points = len(latitudes) * len(longitudes)
+        print(
+            f"Generated {len(latitudes)} latitudes, {len(longitudes)} longitudes. "
+            f"Creating {n_points} points."
+        )
+    else:
+        n_points = len(latitudes)
+        print(f"Generated {n_points} points.")
+
+    if n_points == 0 and output_file:
+        LocationChunk(_points_to_coordinates([], [])).to_csv(output_file)
+
+    for start in range(0, n_points, chunk_size):
+        stop = min(start + chunk_size, n_points)
+        if params["method"] in GRID_METHODS:
+            coordinates = _generate_coordinates(latitudes, longitudes, start, stop)
+        else:
+            coordinates = _points_to_coordinates(
+                latitudes[start:stop], longitudes[start:stop]
+            )
+        chunk = LocationChunk(coordinates, index=np.arange(start, stop))
+        if area is not None and params["method"] in GRID_METHODS:
+            chunk = chunk[area.contains(chunk["long"], chunk["lat"])]
+        if output_file:
+            chunk.to_csv(
+                output_file,
+                mode="w" if start == 0 else "a",
+                header=start == 0,
+                index=False,
+                float_format="%.6f",
+            )
+        if len(chunk):
+            yield chunk
 
 
 def create_locations(params: dict = DEFAULT_LOCATION_PARAMS) -> str:
@@ -80,19 +311,8 @@ def create_locations(params: dict = DEFAULT_LOCATION_PARAMS) -> str:
     Returns:
         str: The file path of the generated CSV.
     """
-    methods = {"random": _randomly_generate(params), "even": _evenly_generate(params)}
-    latitudes, longitudes = methods[params["method"]]
-
-    print(latitudes, longitudes)
-    print(
-        f"Generated {len(latitudes)} latitudes, {len(longitudes)} longitudes. "
-        f"Creating {len(latitudes) * len(longitudes)} points."
-    )
-    coordinates = _generate_coordinates(latitudes, longitudes)
-    df = pd.DataFrame(
-        coordinates, columns=["Address", "City", "Country", "lat", "long"]
-    )
-    filename = f"athens_{params['method']}.csv"
-    df.to_csv(filename, index=False)
-    print(f"CSV file created: {os.path.join(os.getcwd(), filename)}")
-    return os.path.join(os.getcwd(), filename)
+    filename = os.path.join(os.getcwd(), f"athens_{params['method']}.csv")
+    for _ in iter_locations(params, output_file=filename):
+        pass
+    print(f"CSV file created: {filename}")
+    return filename
@@ -0,0 +1,139 @@
+import math
+from typing import List, Tuple
+
+# Geohashes encode a cell of a recursive latitude / longitude grid as a base-32 string:
+# every character adds 5 bits, alternately halving the longitude and latitude ranges
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {character: value for value, character in enumerate(BASE32)}
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    """
+    Encode a point as the geohash of the cell containing it.
+
+    Args:
+        lat (float): Latitude in decimal degrees.
+        lon (float): Longitude in decimal degrees.
+        precision (int): Number of characters; 6 is a cell of about 1.2 km x 0.6 km.
+
+    Returns:
+        str: The geohash.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    characters, value, n_bits, even = [], 0, 0, True
+    while len(characters) < precision:
+        value_range, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (value_range[0] + value_range[1]) / 2
+        if coordinate >= middle:
+            value = value << 1 | 1
+            value_range[0] = middle
+        else:
+            value <<= 1
+            value_range[1] = middle
+        even = not even
+        n_bits += 1
+        if n_bits == 5:
+            characters.append(BASE32[value])
+            value, n_bits = 0, 0
+    return "".join(characters)
+
+
+def bounding_box(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Returns:
+        tuple: (min_lat, max_lat, min_lon, max_lon) of the cell of a geohash, in decimal degrees.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for character in geohash:
+        value = _DECODE[character]
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            value_range[0 if value >> shift & 1 else 1] = middle
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """
+    Returns:
+        tuple: Height and width in decimal degrees of the cells of a precision.
+    """
+    n_bits = 5 * precision
+    return 180.0 / 2 ** (n_bits // 2), 360.0 / 2 ** (n_bits - n_bits // 2)
+
+
+def covering(
+    min_lat: float, max_lat: float, min_lon: float, max_lon: float, precision: int
+) -> List[str]:
+    """
+    List the geohashes of every cell that overlaps a bounding box.
+
+    Args:
+        min_lat, max_lat, min_lon, max_lon (float): Bounding box in decimal degrees.
+        precision (int): Number of characters of the geohashes.
+
+    Returns:
+        list: The geohashes, row by row from the south-west corner.
+    """
+    height, width = cell_size(precision)
+    # Walk the centers of the cells, starting from the cell of the south-west corner
+    first_lat = (min_lat + 90) // height * height - 90 + height / 2
+    first_lon = (min_lon + 180) // width * width - 180 + width / 2
+    n_rows = int((max_lat - (first_lat - height / 2)) // height) + 1
+    n_columns = int((max_lon - (first_lon - width / 2)) // width) + 1
+    geohashes = []
+    for row in range(n_rows):
+        lat = first_lat + row * height
+        if lat - height / 2 >= max_lat and row:
+            break
+        for column in range(n_columns):
+            lon = first_lon + column * width
+            if lon - width / 2 >= max_lon and column:
+                break
+            geohashes.append(encode(lat, lon, precision))
+    return geohashes
+
+
+EARTH_RADIUS_METERS = 6_371_000
+
+
+def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Returns:
+        float: Great-circle distance between two points in decimal degrees, in meters.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_near(lat: float, lon: float, radius: float, max_precision: int) -> List[str]:
+    """
+    List the geohashes of cells that together cover every point within a radius, e.g. to
+    look up points by geohash prefix. The cells are the smallest ones, up to
+    `max_precision` characters, that are no smaller than the radius.
+
+    Args:
+        lat (float): Latitude in decimal degrees.
+        lon (float): Longitude in decimal degrees.
+        radius (float): Radius in meters.
+        max_precision (int): Maximum number of characters of the geohashes.
+
+    Returns:
+        list: Geohashes whose cells together contain the circle, at most 9 of them.
+    """
+    d_lat = math.degrees(radius / EARTH_RADIUS_METERS)
+    d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    precision = 1
+    # Small cells hold few points, but cells smaller than the radius would take many
+    while precision < max_precision:
+        height, width = cell_size(precision + 1)
+        if height < d_lat or width < d_lon:
+            break
+        precision += 1
+    return covering(lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon, precision)
@@ -0,0 +1,176 @@
+import json
+from typing import List, Union
+
+import numpy as np
+
+# Upper bound on the size of the point x edge matrices evaluated at once
+MAX_CROSSINGS_PER_BATCH = 4_000_000
+
+
+def _polygons_from_geometry(geometry: dict) -> List[List[np.ndarray]]:
+    kind = geometry["type"]
+    if kind == "Polygon":
+        return [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in geometry["coordinates"]]]
+    if kind == "MultiPolygon":
+        return [
+            [np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon]
+            for polygon in geometry["coordinates"]
+        ]
+    if kind == "GeometryCollection":
+        return [
+            polygon
+            for member in geometry["geometries"]
+            for polygon in _polygons_from_geometry(member)
+        ]
+    return []
+
+
+def polygons_from_geojson(geojson: Union[dict, list]) -> List[List[np.ndarray]]:
+    """
+    Extract the polygons of a GeoJSON object.
+
+    Accepts any GeoJSON geometry, Feature or FeatureCollection, as well as Nominatim search
+    results requested with `polygon_geojson=1` (a result or a list of results, of which the
+    first one with a polygon boundary is used). Non-areal geometries are ignored.
+
+    Args:
+        geojson (dict or list): The GeoJSON object.
+
+    Returns:
+        list: Polygons, each a list of rings (outer boundary first, then holes) given as
+            arrays of (longitude, latitude) vertices in degrees.
+    """
+    if isinstance(geojson, list):
+        for result in geojson:
+            polygons = polygons_from_geojson(result)
+            if polygons:
+                return polygons
+        return []
+    if "geojson" in geojson:  # Nominatim search result
+        return polygons_from_geojson(geojson["geojson"])
+    if geojson.get("type") == "FeatureCollection":
+        return [
+            polygon
+            for feature in geojson["features"]
+            for polygon in polygons_from_geojson(feature)
+        ]
+    if geojson.get("type") == "Feature":
+        return _polygons_from_geometry(geojson["geometry"]) if geojson["geometry"] else []
+    return _polygons_from_geometry(geojson)
+
+
+class PolygonIndex:
+    """
+    Vectorized point-in-polygon test over a polygon or multipolygon.
+
+    The edges of all rings are bucketed into horizontal bands, so every point is only
+    tested against the few edges that cross its band, which keeps the test fast for
+    boundaries with thousands of vertices. Inside-ness follows the even-odd rule, which
+    handles holes and multiple polygons.
+
+    Args:
+        polygons (list): Polygons as returned by `polygons_from_geojson`.
+        n_bands (int, optional): Number of horizontal bands; defaults to the square root
+            of the number of edges.
+    """
+
+    def __init__(self, polygons: List[List[np.ndarray]], n_bands: int = None):
+        if not polygons:
+            raise ValueError("The area does not contain any polygon.")
+        rings = [ring for polygon in polygons for ring in polygon]
+        vertices = np.concatenate(rings)
+        self.min_lon, self.min_lat = vertices.min(axis=0)
+        self.max_lon, self.max_lat = vertices.max(axis=0)
+
+        starts = vertices
+        ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+        # Horizontal edges never cross a horizontal ray
+        crossing = starts[:, 1] != ends[:, 1]
+        x1, y1 = starts[crossing, 0], starts[crossing, 1]
+        x2, y2 = ends[crossing, 0], ends[crossing, 1]
+
+        self.n_bands = n_bands or max(int(np.sqrt(len(x1))), 1)
+        self._band_height = (self.max_lat - self.min_lat) / self.n_bands or 1.0
+        low = self._band(np.minimum(y1, y2))
+        high = self._band(np.maximum(y1, y2))
+
+        # Edges of every band, as (x1, y1, slope, y2) arrays
+        slope = (x2 - x1) / (y2 - y1)
+        self._bands = []
+        for band in range(self.n_bands):
+            in_band = (low <= band) & (high >= band)
+            self._bands.append((x1[in_band], y1[in_band], slope[in_band], y2[in_band]))
+
+    def _band(self, lats: np.ndarray) -> np.ndarray:
+        band = ((lats - self.min_lat) / self._band_height).astype(np.int64)
+        return np.clip(band, 0, self.n_bands - 1)
+
+    def bounding_box(self) -> dict:
+        """
+        Returns:
+            dict: min_lat, max_lat, min_lon and max_lon of the area, in microdegrees.
+        """
+        return {
+            "min_lat": int(np.floor(self.min_lat * 1_000_000)),
+            "max_lat": int(np.ceil(self.max_lat * 1_000_000)),
+            "min_lon": int(np.floor(self.min_lon * 1_000_000)),
+            "max_lon": int(np.ceil(self.max_lon * 1_000_000)),
+        }
+
+    def contains(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """
+        Test which points lie inside the area.
+
+        Args:
+            lons (np.ndarray): Longitudes in degrees.
+            lats (np.ndarray): Latitudes in degrees.
+
+        Returns:
+            np.ndarray: Boolean mask of the points inside the area.
+        """
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        inside = np.zeros(len(lons), dtype=bool)
+
+        candidates = np.flatnonzero(
+            (lons >= self.min_lon)
+            & (lons <= self.max_lon)
+            & (lats >= self.min_lat)
+            & (lats <= self.max_lat)
+        )
+        bands = self._band(lats[candidates])
+        order = np.argsort(bands, kind="stable")
+        candidates, bands = candidates[order], bands[order]
+        boundaries = np.searchsorted(bands, np.arange(self.n_bands + 1))
+
+        for band, (x1, y1, slope, y2) in enumerate(self._bands):
+            points = candidates[boundaries[band] : boundaries[band + 1]]
+            if len(points) == 0 or len(x1) == 0:
+                continue
+            step = max(MAX_CROSSINGS_PER_BATCH // len(x1), 1)
+            for start in range(0, len(points), step):
+                batch = points[start : start + step]
+                px = lons[batch][:, None]
+                py = lats[batch][:, None]
+                # Count the edges crossed by a ray cast from every point towards +longitude
+                straddles = (y1 > py) != (y2 > py)
+                crosses = straddles & (px < x1 + (py - y1) * slope)
+                inside[batch] = np.count_nonzero(crosses, axis=1) % 2 == 1
+        return inside
+
+
+def load_area(area: Union[str, dict, list]) -> PolygonIndex:
+    """
+    Load the boundary of an area to sample locations in.
+
+    Args:
+        area (str, dict or list): Path to a GeoJSON file, or a parsed GeoJSON object or
+            Nominatim search result (see `polygons_from_geojson`).
+
+    Returns:
+        PolygonIndex: Point-in-polygon index of the area.
+    """
+    if isinstance(area, str):
+        with open(area) as file:
+            area = json.load(file)
+    return PolygonIndex(polygons_from_geojson(area))
@@ -7,20 +7,19 @@ def preprocess_location(index: int, item) -> tuple:
 
     Args:
         index (int): Row index.
-        item (pandas.Series): A row with location data.
+        item: A row with location data, accessible by attribute, such as a namedtuple
+            from `LocationChunk.itertuples` or `DataFrame.itertuples`, or a pandas.Series.
 
     Returns:
         tuple: (location, filename)
     """
     if DEFAULT_LOCATION_TYPE == "coordinates":
-        lat_str = str(item["lat"])
-        long_str = str(item["long"])
+        lat_str = str(item.lat)
+        long_str = str(item.long)
         location = f"{lat_str},{long_str}"
         loc_str = f"{lat_str}_{long_str}".replace(".", "")
     else:
-        location = f"{item['Address']}, {item['City']}, {item['Country']}".replace(
-            " ", ""
-        )
-        loc_str = item["Address"].replace(".", "_").replace(" ", "")
+        location = f"{item.Address}, {item.City}, {item.Country}".replace(" ", "")
+        loc_str = item.Address.replace(".", "_").replace(" ", "")
     filename = f"view_{index}_{loc_str}.jpg"
     return location, filename
@@ -0,0 +1,183 @@
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# Spatial index cells for Poisson-disk sampling; beyond this the grid would not fit in memory
+MAX_GRID_CELLS = 50_000_000
+
+
+def radical_inverse(indices: np.ndarray, base: int) -> np.ndarray:
+    """
+    Van der Corput radical inverse of every index in the given base.
+
+    Args:
+        indices (np.ndarray): Non-negative integer indices.
+        base (int): Base of the sequence, a prime for Halton sequences.
+
+    Returns:
+        np.ndarray: Values in [0, 1).
+    """
+    indices = np.asarray(indices, dtype=np.int64).copy()
+    result = np.zeros(len(indices), dtype=np.float64)
+    scale = 1.0 / base
+    while np.any(indices > 0):
+        indices, digits = np.divmod(indices, base)
+        result += digits * scale
+        scale /= base
+    return result
+
+
+def halton(n_points: int, skip: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    First points of the two-dimensional Halton sequence (bases 2 and 3).
+
+    Args:
+        n_points (int): Number of points.
+        skip (int): Number of leading points to skip; the first point is always (0, 0).
+
+    Returns:
+        tuple: Arrays of the x and y coordinates of the points in the unit square.
+    """
+    indices = np.arange(skip, skip + n_points, dtype=np.int64)
+    return radical_inverse(indices, 2), radical_inverse(indices, 3)
+
+
+def sobol(n_points: int, skip: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    First points of the two-dimensional Sobol sequence.
+
+    The first dimension is the base-2 van der Corput sequence and the second uses the
+    direction numbers of the primitive polynomial x + 1.
+
+    Args:
+        n_points (int): Number of points.
+        skip (int): Number of leading points to skip; the first point is always (0, 0).
+
+    Returns:
+        tuple: Arrays of the x and y coordinates of the points in the unit square.
+    """
+    bits = 32
+    indices = np.arange(skip, skip + n_points, dtype=np.uint64)
+
+    # Direction numbers m_k = 2 * m_{k-1} XOR m_{k-1}, scaled to fixed point
+    m = 1
+    directions_x, directions_y = [], []
+    for k in range(1, bits + 1):
+        directions_x.append(np.uint64(1 << (bits - k)))
+        directions_y.append(np.uint64(m << (bits - k)))
+        m = (m << 1) ^ m
+
+    x = np.zeros(n_points, dtype=np.uint64)
+    y = np.zeros(n_points, dtype=np.uint64)
+    for k in range(bits):
+        bit_set = ((indices >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        x[bit_set] ^= directions_x[k]
+        y[bit_set] ^= directions_y[k]
+    return x / 2.0**bits, y / 2.0**bits
+
+
+def poisson_disk(
+    n_points: int,
+    width: float,
+    height: float,
+    min_distance: float,
+    seed: int = 42,
+    max_failed_batches: int = 5,
+    accept: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample points in a rectangle so that no two points are closer than a minimum distance.
+
+    Candidates are drawn uniformly in large batches and checked against a uniform grid
+    with cells of side min_distance / sqrt(2), so every cell holds at most one point and
+    only the 5x5 neighbouring cells have to be inspected. Conflicts inside a batch are
+    resolved in favour of the earlier candidate.
+
+    Args:
+        n_points (int): Number of points.
+        width (float): Width of the rectangle.
+        height (float): Height of the rectangle.
+        min_distance (float): Minimum distance between any two points, in the same unit.
+        seed (int): Seed of the random number generator.
+        max_failed_batches (int): Give up after this many consecutive batches without a new point.
+        accept (Callable, optional): Function that takes arrays of x and y coordinates and
+            returns a mask of the candidates that may be used, e.g. to sample inside a polygon.
+
+    Returns:
+        tuple: Arrays of the x and y coordinates of the points.
+
+    Raises:
+        ValueError: If the points do not fit in the rectangle at the given distance.
+    """
+    cell = min_distance / np.sqrt(2)
+    n_x = max(int(np.ceil(width / cell)), 1)
+    n_y = max(int(np.ceil(height / cell)), 1)
+    if n_x * n_y > MAX_GRID_CELLS:
+        raise ValueError(
+            f"min_distance {min_distance} is too small for the area: the spatial index "
+            f"would need {n_x * n_y} cells. Increase min_distance or use 'halton'."
+        )
+    # Index of the point in every cell, or -1 if the cell is empty
+    grid = np.full((n_x, n_y), -1, dtype=np.int64)
+    xs = np.empty(n_points, dtype=np.float64)
+    ys = np.empty(n_points, dtype=np.float64)
+    offsets = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if dx or dy]
+    min_distance_sq = min_distance**2
+
+    rng = np.random.default_rng(seed=seed)
+    count = 0
+    failed_batches = 0
+    while count < n_points:
+        batch_size = min(max(2 * (n_points - count), 1024), 1_000_000)
+        x = rng.uniform(0, width, batch_size)
+        y = rng.uniform(0, height, batch_size)
+        if accept is not None:
+            allowed = accept(x, y)
+            x, y = x[allowed], y[allowed]
+        cx = np.minimum((x / cell).astype(np.int64), n_x - 1)
+        cy = np.minimum((y / cell).astype(np.int64), n_y - 1)
+
+        # Keep the first candidate of every free cell
+        keep = grid[cx, cy] < 0
+        _, first = np.unique(cx[keep] * n_y + cy[keep], return_index=True)
+        candidates = np.flatnonzero(keep)[np.sort(first)]
+        x, y, cx, cy = x[candidates], y[candidates], cx[candidates], cy[candidates]
+
+        # Temporarily mark candidates in the grid as -(position + 2)
+        grid[cx, cy] = -(np.arange(len(x)) + 2)
+        keep = np.ones(len(x), dtype=bool)
+        for dx, dy in offsets:
+            nx, ny = cx + dx, cy + dy
+            inside = (nx >= 0) & (nx < n_x) & (ny >= 0) & (ny < n_y)
+            neighbour = np.full(len(x), -1, dtype=np.int64)
+            neighbour[inside] = grid[nx[inside], ny[inside]]
+
+            accepted = neighbour >= 0
+            j = neighbour[accepted]
+            too_close = (xs[j] - x[accepted]) ** 2 + (
+                ys[j] - y[accepted]
+            ) ** 2 < min_distance_sq
+            keep[np.flatnonzero(accepted)[too_close]] = False
+
+            earlier = neighbour <= -2
+            k = -neighbour[earlier] - 2
+            own = np.flatnonzero(earlier)
+            too_close = (k < own) & (
+                (x[k] - x[own]) ** 2 + (y[k] - y[own]) ** 2 < min_distance_sq
+            )
+            keep[own[too_close]] = False
+        grid[cx, cy] = -1
+
+        new = np.flatnonzero(keep)[: n_points - count]
+        grid[cx[new], cy[new]] = np.arange(count, count + len(new))
+        xs[count : count + len(new)] = x[new]
+        ys[count : count + len(new)] = y[new]
+        count += len(new)
+
+        failed_batches = failed_batches + 1 if len(new) == 0 else 0
+        if failed_batches >= max_failed_batches:
+            raise ValueError(
+                f"Could only place {count} of {n_points} points at least {min_distance} "
+                "apart. Decrease min_distance or the number of locations."
+            )
+    return xs, ys
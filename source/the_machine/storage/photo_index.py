@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Iterable, List, Optional, Tuple
+
+from ..config import NEARBY_HEADING_TOLERANCE, PHOTO_INDEX_PRECISION
+from ..locations.geohash import cells_near, distance_meters, encode
+
+# Sorts after every geohash character, to turn a prefix into a range of the index
+_PREFIX_END = "~"
+
+
+@dataclass(frozen=True)
+class PhotoRecord:
+    """
+    A captured photo in a PhotoIndex.
+
+    Attributes:
+        path (str): Path of the photo, or its key in a shard store.
+        lat (float): Latitude it was requested at, in decimal degrees.
+        lon (float): Longitude it was requested at, in decimal degrees.
+        heading (float, optional): Compass heading of the camera, if known.
+        pitch (float, optional): Pitch of the camera, if known.
+        fov (float, optional): Horizontal field of view, if known.
+        size (str, optional): Image size as 'WIDTHxHEIGHT', if known.
+        distance (float, optional): Distance from the queried point in meters, for
+            results of `PhotoIndex.nearby`.
+    """
+
+    path: str
+    lat: float
+    lon: float
+    heading: Optional[float] = None
+    pitch: Optional[float] = None
+    fov: Optional[float] = None
+    size: Optional[str] = None
+    distance: Optional[float] = None
+
+
+def parse_coordinates(location: str) -> Optional[Tuple[float, float]]:
+    """
+    Returns:
+        tuple: (lat, lon) of a 'lat,lon' location string, or None for other locations,
+            such as addresses.
+    """
+    try:
+        lat, lon = (float(value) for value in location.split(","))
+    except ValueError:
+        return None
+    return lat, lon
+
+
+def heading_difference(a: float, b: float) -> float:
+    """
+    Returns:
+        float: Angle between two compass headings in degrees, from 0 to 180.
+    """
+    difference = abs(a - b) % 360
+    return min(difference, 360 - difference)
+
+
+class PhotoIndex:
+    """
+    Persistent spatial index of captured photos, to tell whether a place has already been
+    photographed facing a given way.
+
+    Every photo is stored in SQLite with its coordinates, camera settings and the geohash
+    of its location, indexed. A proximity query looks up the few geohash cells around the point
+    that are no smaller than the search radius, as prefix ranges of the index, and only
+    measures the distance of the photos in those cells. Lookups therefore touch a handful
+    of rows regardless of the size of the index.
+
+    The index is safe to share between the threads of one process.
+
+    Args:
+        path (str): Path of the SQLite database; created if it does not exist.
+        precision (int): Number of geohash characters stored per photo, which bounds how
+            small the cells of a query can get.
+    """
+
+    def __init__(self, path: str, precision: int = PHOTO_INDEX_PRECISION):
+        self.path = path
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            "path TEXT PRIMARY KEY, geohash TEXT NOT NULL, lat REAL NOT NULL, "
+            "lon REAL NOT NULL, heading REAL, pitch REAL, fov REAL, size TEXT, "
+            "created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS photos_geohash ON photos (geohash)")
+        self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+
+    def add(
+        self,
+        path: str,
+        lat: float,
+        lon: float,
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        size: Optional[str] = None,
+    ):
+        """
+        Record a captured photo, replacing any record of the same path.
+        """
+        self.add_many([PhotoRecord(path, lat, lon, heading, pitch, fov, size)])
+
+    def add_many(self, records: Iterable[PhotoRecord]):
+        """
+        Record several captured photos in one transaction.
+        """
+        now = time.time()
+        rows = [
+            (
+                record.path,
+                encode(record.lat, record.lon, self.precision),
+                record.lat,
+                record.lon,
+                record.heading,
+                record.pitch,
+                record.fov,
+                record.size,
+                now,
+            )
+            for record in records
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO photos "
+                "(path, geohash, lat, lon, heading, pitch, fov, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def remove(self, path: str):
+        """
+        Forget a photo, e.g. one that was deleted.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM photos WHERE path = ?", (path,))
+            self._db.commit()
+
+    def nearby(
+        self,
+        lat: float,
+        lon: float,
+        radius: float,
+        heading: Optional[float] = None,
+        tolerance: float = NEARBY_HEADING_TOLERANCE,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        size: Optional[str] = None,
+    ) -> List[PhotoRecord]:
+        """
+        Find the photos taken within a distance of a point, optionally facing a direction
+        with given camera settings.
+
+        Args:
+            lat (float): Latitude in decimal degrees.
+            lon (float): Longitude in decimal degrees.
+            radius (float): Maximum distance in meters.
+            heading (float, optional): If given, only photos whose heading is within
+                `tolerance` degrees of it are returned; photos of unknown heading are not.
+            tolerance (float): Maximum difference of headings in degrees.
+            pitch (float, optional): If given, only photos of exactly this pitch are returned.
+            fov (float, optional): If given, only photos of exactly this field of view are
+                returned.
+            size (str, optional): If given, only photos of exactly this size are returned.
+
+        Returns:
+            list: The matching PhotoRecords with their distance, closest first.
+        """
+        cells = cells_near(lat, lon, radius, self.precision)
+        with self._lock:
+            rows = [
+                row
+                for cell in cells
+                for row in self._db.execute(
+                    "SELECT path, lat, lon, heading, pitch, fov, size FROM photos "
+                    "WHERE geohash >= ? AND geohash < ?",
+                    (cell, cell + _PREFIX_END),
+                )
+            ]
+        matches = []
+        for row in rows:
+            record = PhotoRecord(*row)
+            if heading is not None and (
+                record.heading is None or heading_difference(heading, record.heading) > tolerance
+            ):
+                continue
+            camera = ((pitch, record.pitch), (fov, record.fov), (size, record.size))
+            if any(wanted is not None and wanted != actual for wanted, actual in camera):
+                continue
+            distance = distance_meters(lat, lon, record.lat, record.lon)
+            if distance <= radius:
+                matches.append(replace(record, distance=distance))
+        return sorted(matches, key=lambda record: record.distance)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> "PhotoIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
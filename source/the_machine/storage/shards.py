@@ -0,0 +1,401 @@
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from ..config import DOWNLOAD_CHUNK_SIZE, SHARD_MAX_BYTES
+
+# Every record in a shard is a header, the key, the metadata as JSON and the image:
+# magic, key length, metadata length, image length
+_RECORD_HEADER = struct.Struct("<4sHIQ")
+_RECORD_MAGIC = b"SVR1"
+# Metadata of the empty record appended when an image is deleted
+_TOMBSTONE = {"deleted": True}
+
+
+@dataclass(frozen=True)
+class ShardEntry:
+    """
+    Location of an image in a shard store.
+
+    Attributes:
+        key (str): Key of the image.
+        shard (int): Number of the shard file holding it.
+        offset (int): Position of the image in the shard.
+        length (int): Size of the image in bytes.
+        sha256 (str): Hex SHA-256 digest of the image.
+        metadata (dict): Metadata stored with the image.
+    """
+
+    key: str
+    shard: int
+    offset: int
+    length: int
+    sha256: str
+    metadata: dict
+
+
+class ShardStore:
+    """
+    Image store that packs images into large append-only shard files.
+
+    Millions of small files make directory listings, backups and file system metadata
+    slow. Instead, images are appended to 'shard-NNNNN.bin' files of up to
+    `max_shard_bytes` each, and an SQLite index maps every key to its shard, offset,
+    length, checksum and metadata. Reads go through memory maps of the shards and
+    return zero-copy memoryviews.
+
+    Every record in a shard also carries its key and metadata, so the index can be
+    rebuilt from the shards alone. Records appended by a writer that crashed before
+    updating the index are recovered when the store is opened, and a partly written
+    last record is cut off.
+
+    The store is safe to share between the threads of one process; only one process
+    should write to a store at a time.
+
+    Args:
+        directory (str): Directory holding the shards and the index; created if needed.
+        max_shard_bytes (int): Size above which a new shard is started.
+    """
+
+    def __init__(self, directory: str, max_shard_bytes: int = SHARD_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_shard_bytes = max_shard_bytes
+        self._lock = threading.Lock()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._writer = None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.directory / "index.sqlite", check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, shard INTEGER NOT NULL, offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, sha256 TEXT NOT NULL, metadata TEXT, "
+            "created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+        shards = self._shard_numbers()
+        self._shard = shards[-1] if shards else 0
+        self._recover(self._shard)
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.directory / f"shard-{shard:05d}.bin"
+
+    def _shard_numbers(self) -> list:
+        return sorted(int(path.stem[6:]) for path in self.directory.glob("shard-*.bin"))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.entry(key) is not None
+
+    def entry(self, key: str) -> Optional[ShardEntry]:
+        """
+        Returns:
+            ShardEntry: Where the image of a key is stored, or None if it is not.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, shard, offset, length, sha256, metadata FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        return _entry(row) if row else None
+
+    def entries(self, prefix: str = "") -> Iterator[ShardEntry]:
+        """
+        Yields:
+            ShardEntry: Every stored image whose key starts with `prefix`, in storage order.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, shard, offset, length, sha256, metadata FROM entries "
+                "WHERE substr(key, 1, ?) = ? ORDER BY shard, offset",
+                (len(prefix), prefix),
+            ).fetchall()
+        for row in rows:
+            yield _entry(row)
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """
+        Read an image without copying it.
+
+        The memoryview points into a memory map of the shard. It stays valid after the
+        store is closed, as long as it is referenced.
+
+        Args:
+            key (str): Key of the image.
+
+        Returns:
+            memoryview: The image bytes, or None if the key is not stored.
+        """
+        entry = self.entry(key)
+        if entry is None:
+            return None
+        return self.read(entry)
+
+    def read(self, entry: ShardEntry) -> memoryview:
+        """
+        Returns:
+            memoryview: The image bytes of an entry, see `get`.
+        """
+        end = entry.offset + entry.length
+        with self._lock:
+            shard_map = self._maps.get(entry.shard)
+            if shard_map is None or len(shard_map) < end:
+                # The shard grew since it was mapped; earlier views keep the old map alive
+                if self._writer and entry.shard == self._shard:
+                    self._writer.flush()
+                with open(self._shard_path(entry.shard), "rb") as file:
+                    shard_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[entry.shard] = shard_map
+        return memoryview(shard_map)[entry.offset : end]
+
+    def put(self, key: str, content: bytes, metadata: Optional[dict] = None) -> ShardEntry:
+        """
+        Append an image to the store, replacing any image stored under the same key.
+
+        Args:
+            key (str): Key of the image, e.g. its relative file path.
+            content (bytes): The image.
+            metadata (dict, optional): JSON-serializable metadata stored with the image.
+
+        Returns:
+            ShardEntry: Where the image was stored.
+        """
+        return self._append(key, [content], len(content), metadata)
+
+    def put_file(
+        self, key: str, filename: str, metadata: Optional[dict] = None
+    ) -> ShardEntry:
+        """
+        Append an image file to the store in chunks, see `put`.
+        """
+        with open(filename, "rb") as file:
+            chunks = iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b"")
+            return self._append(key, chunks, os.path.getsize(filename), metadata)
+
+    def delete(self, key: str) -> bool:
+        """
+        Remove an image from the store.
+
+        Shards are append-only: the image stays in its shard, and a tombstone record is
+        appended so that rebuilding the index does not bring it back.
+
+        Args:
+            key (str): Key of the image.
+
+        Returns:
+            bool: True if the key was stored.
+        """
+        if key not in self:
+            return False
+        self._append(key, [], 0, _TOMBSTONE)
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+        return True
+
+    def _append(self, key, chunks, length: int, metadata: Optional[dict]) -> ShardEntry:
+        encoded_key = key.encode()
+        encoded_metadata = json.dumps(metadata or {}).encode()
+        header = _RECORD_HEADER.pack(
+            _RECORD_MAGIC, len(encoded_key), len(encoded_metadata), length
+        )
+        record_size = len(header) + len(encoded_key) + len(encoded_metadata) + length
+        digest = hashlib.sha256()
+
+        with self._lock:
+            writer = self._open_writer(record_size)
+            start = writer.tell()
+            offset = start + len(header) + len(encoded_key) + len(encoded_metadata)
+            writer.write(header + encoded_key + encoded_metadata)
+            written = 0
+            for chunk in chunks:
+                writer.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+            if written != length:
+                # The source changed size while it was being copied
+                writer.truncate(start)
+                writer.seek(start)
+                raise OSError(f"Expected {length} bytes for '{key}', got {written}")
+            writer.flush()
+            # The index is only updated once the record is complete in the shard
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, shard, offset, length, sha256, metadata, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    self._shard,
+                    offset,
+                    length,
+                    digest.hexdigest(),
+                    encoded_metadata.decode(),
+                    time.time(),
+                ),
+            )
+            self._db.commit()
+        return ShardEntry(
+            key, self._shard, offset, length, digest.hexdigest(), metadata or {}
+        )
+
+    def _open_writer(self, record_size: int):
+        """Open the shard to append to, starting a new one when the current one is full."""
+        if self._writer is None:
+            self._writer = open(self._shard_path(self._shard), "ab")
+        size = self._writer.tell()
+        if size > 0 and size + record_size > self.max_shard_bytes:
+            self._writer.close()
+            self._shard += 1
+            self._writer = open(self._shard_path(self._shard), "ab")
+        return self._writer
+
+    def _recover(self, shard: int):
+        """
+        Index the complete records at the end of a shard that are missing from the index,
+        and cut off a partly written last record.
+        """
+        path = self._shard_path(shard)
+        if not path.exists():
+            return
+        (indexed_end,) = self._db.execute(
+            "SELECT COALESCE(MAX(offset + length), 0) FROM entries WHERE shard = ?",
+            (shard,),
+        ).fetchone()
+        size = path.stat().st_size
+        if size == indexed_end:
+            return
+        position = self._index_records(shard, indexed_end)
+        if position < size:
+            with open(path, "r+b") as file:
+                file.truncate(position)
+
+    def _index_records(self, shard: int, position: int = 0) -> int:
+        """
+        Add the records of a shard from a position on to the index.
+
+        Returns:
+            int: The end of the last complete record.
+        """
+        with open(self._shard_path(shard), "rb") as file:
+            file.seek(position)
+            while True:
+                header = file.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                magic, key_length, metadata_length, length = _RECORD_HEADER.unpack(header)
+                if magic != _RECORD_MAGIC:
+                    break
+                key = file.read(key_length)
+                metadata = file.read(metadata_length)
+                offset = file.tell()
+                digest = hashlib.sha256()
+                remaining = length
+                while remaining:
+                    chunk = file.read(min(remaining, DOWNLOAD_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                if remaining or len(key) < key_length or len(metadata) < metadata_length:
+                    break
+                position = file.tell()
+                if length == 0 and json.loads(metadata) == _TOMBSTONE:
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key.decode(),))
+                    continue
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries "
+                    "(key, shard, offset, length, sha256, metadata, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key.decode(),
+                        shard,
+                        offset,
+                        length,
+                        digest.hexdigest(),
+                        metadata.decode(),
+                        time.time(),
+                    ),
+                )
+        self._db.commit()
+        return position
+
+    def rebuild_index(self):
+        """
+        Recreate the index from the records in the shards, e.g. after losing it.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            for shard in self._shard_numbers():
+                self._index_records(shard)
+
+    def export(self, directory: str, prefix: str = "") -> int:
+        """
+        Write stored images back to plain files, named after their keys.
+
+        Args:
+            directory (str): Directory to write the images to.
+            prefix (str): Only export the keys that start with this prefix.
+
+        Returns:
+            int: Number of exported images.
+        """
+        n_exported = 0
+        for entry in self.entries(prefix):
+            path = Path(directory) / entry.key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as file:
+                file.write(self.read(entry))
+            os.replace(tmp_path, path)
+            n_exported += 1
+        return n_exported
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Number of images, their total size and the number of shards.
+        """
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM entries"
+            ).fetchone()
+        return {"entries": entries, "bytes": total, "shards": len(self._shard_numbers())}
+
+    def close(self):
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            for shard_map in self._maps.values():
+                try:
+                    shard_map.close()
+                except BufferError:
+                    pass  # still referenced by a memoryview, closed once it is released
+            self._maps.clear()
+            self._db.close()
+
+    def __enter__(self) -> "ShardStore":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _entry(row: tuple) -> ShardEntry:
+    key, shard, offset, length, sha256, metadata = row
+    return ShardEntry(key, shard, offset, length, sha256, json.loads(metadata or "{}"))
@@ -0,0 +1,30 @@
+import pytest
+
+from source import agentic_machine
+from source.benchmarks.mock_server import MockConfig, MockServer
+from source.the_machine.api.cache import ImageCache
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    monkeypatch.setenv("STREET_VIEW_API_KEY", "key")
+    monkeypatch.setenv("STREET_VIEW_API_SECRET", "c2VjcmV0")
+
+
+@pytest.fixture
+def mock_server(credentials):
+    """A Street View stand-in where every location has imagery and answers right away."""
+    config = MockConfig(image_bytes=2_000, latency_ms=0, jitter_ms=0, not_found_rate=0)
+    with MockServer(config) as server:
+        yield server
+
+
+@pytest.fixture
+def street_view(tmp_path, monkeypatch, mock_server):
+    """The agent's tools, fetching from the mock server into a fresh cache."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(agentic_machine, "STREETVIEW_API_URL", mock_server.streetview_url)
+    cache = ImageCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(agentic_machine, "_image_cache", cache)
+    yield mock_server
+    cache.close()
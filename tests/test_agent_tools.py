@@ -0,0 +1,19 @@
+import importlib.util
+
+import pytest
+
+from source.agentic_machine import get_panorama_from_street_view
+
+PLACE = "37.97,23.72"
+
+
+def test_stitching_without_pillow_is_refused(street_view, monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(
+        importlib.util, "find_spec", lambda name: None if name == "PIL" else find_spec(name)
+    )
+
+    with pytest.raises(ValueError, match="requires Pillow"):
+        get_panorama_from_street_view(PLACE, "64x64", 90, [0, 180], stitch=True)
+    assert street_view.requests == 0
+    assert len(get_panorama_from_street_view(PLACE, "64x64", 90, [0, 180])) == 2
@@ -0,0 +1,65 @@
+import pytest
+
+from source.the_machine.api.cache import ImageCache, request_key
+
+LOCATION = "37.9838,23.7275"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=300)
+    yield cache
+    cache.close()
+
+
+def test_request_key_only_depends_on_the_image():
+    key = request_key(LOCATION, {"size": "640x640", "heading": 90})
+    assert key == request_key("37.9838, 23.7275", {"size": "640x640 ", "heading": "90"})
+    # Parameters the API assumes anyway, or that do not change the image
+    assert key == request_key(LOCATION, {"size": "640x640", "heading": 90, "fov": 90})
+    assert key == request_key(LOCATION, {"size": "640x640", "heading": 90, "key": "other"})
+    assert key != request_key(LOCATION, {"size": "640x640", "heading": 180})
+
+
+def test_hits_and_misses_are_counted(cache, tmp_path):
+    cache.put("a", b"a" * 100)
+    assert cache.copy_to("a", str(tmp_path / "a.jpg"))
+    assert (tmp_path / "a.jpg").read_bytes() == b"a" * 100
+    assert not cache.copy_to("b", str(tmp_path / "b.jpg"))
+    assert cache.get_path("a") is not None
+
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 1, "bytes": 100}
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_least_recently_used_images_are_evicted(cache):
+    for key in "abc":
+        cache.put(key, key.encode() * 100)
+    cache.get_path("a")  # 'b' is now the least recently used
+
+    cache.put("d", b"d" * 100)
+    assert cache.get_path("b") is None
+    assert all(cache.get_path(key) is not None for key in "acd")
+    assert cache.stats()["bytes"] == 300
+
+    # An image larger than the whole cache is not stored
+    cache.put("e", b"e" * 301)
+    assert cache.get_path("e") is None
+    assert cache.stats()["entries"] == 3
+
+
+def test_image_evicted_while_copied_is_a_miss(cache, tmp_path, monkeypatch):
+    cache.put("a", b"a" * 100)
+    get_path = cache.get_path
+
+    def evicted_after_lookup(key):
+        path = get_path(key)
+        path.unlink()  # another process evicts the image right after the lookup
+        return path
+
+    monkeypatch.setattr(cache, "get_path", evicted_after_lookup)
+    assert not cache.copy_to("a", str(tmp_path / "a.jpg"))
+
+    assert not (tmp_path / "a.jpg").exists()
+    assert not list(tmp_path.glob("a.jpg.*"))
+    assert (cache.hits, cache.misses) == (0, 1)
@@ -0,0 +1,92 @@
+import asyncio
+import copy
+import time
+
+import pytest
+
+from source.the_machine.api.geocache import GeocodeCache, normalize_query, track_lookups
+
+ELEFSINA = [{"name": "Elefsina", "lat": "38.0476080", "lon": "23.5348663"}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite"), memory_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_normalize_query():
+    assert normalize_query("  Elefsina ") == normalize_query("ELEFSINA") == "elefsina"
+    assert normalize_query("Plaka,\tAthens\n") == "plaka, athens"
+    # Compatibility characters and case folding beyond ASCII
+    assert normalize_query("ＡＴＨＥＮＳ") == "athens"
+    assert normalize_query("Straße") == normalize_query("STRASSE")
+
+
+def test_changing_a_result_does_not_change_the_cache(cache, tmp_path):
+    stored = copy.deepcopy(ELEFSINA)
+    cache.put("elefsina", stored)
+    stored[0]["lat"] = "0"  # the caller's list is not cached by reference
+
+    first = cache.get("elefsina")
+    first[0].pop("lat")
+    first.append({"name": "somewhere else"})
+    assert cache.get("elefsina") == ELEFSINA
+
+    reopened = GeocodeCache(str(tmp_path / "geocode.sqlite"))
+    reopened.get("elefsina")[0].clear()  # loaded from disk
+    assert reopened.get("elefsina") == ELEFSINA
+    assert reopened.stats() == {"memory_hits": 1, "disk_hits": 1, "misses": 0}
+    reopened.close()
+
+
+def test_entries_expire(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite"), ttl=0.05)
+    cache.put("elefsina", ELEFSINA)
+    assert cache.get("elefsina") == ELEFSINA
+    time.sleep(0.1)
+    assert cache.get("elefsina") is None
+
+    # Expired entries are not read from disk either
+    reopened = GeocodeCache(str(tmp_path / "geocode.sqlite"))
+    assert reopened.get("elefsina") is None
+    assert cache.stats()["misses"] == reopened.stats()["misses"] == 1
+    reopened.close()
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite"), max_entries=2, memory_entries=1)
+    cache.put("a", [1])
+    time.sleep(0.01)
+    cache.put("b", [2])
+    time.sleep(0.01)
+    cache.get("a")  # from disk, as 'b' took its place in memory
+    time.sleep(0.01)
+    cache.put("c", [3])
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ([1], [3])
+    cache.close()
+
+
+def test_lookups_are_tracked_per_context(cache):
+    cache.put("elefsina", ELEFSINA)
+
+    async def lookup(keys):
+        counts = track_lookups()
+        for key in keys:
+            # Threads started from the context count into its dict
+            await asyncio.to_thread(cache.get, key)
+        return counts
+
+    async def concurrently():
+        return await asyncio.gather(
+            lookup(["elefsina", "elefsina"]), lookup(["athens", "elefsina"])
+        )
+
+    first, second = asyncio.run(concurrently())
+    assert first == {"memory_hits": 2, "disk_hits": 0, "misses": 0}
+    assert second == {"memory_hits": 1, "disk_hits": 0, "misses": 1}
+    assert cache.stats() == {"memory_hits": 3, "disk_hits": 0, "misses": 1}
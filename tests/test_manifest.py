@@ -0,0 +1,127 @@
+import sqlite3
+
+import pytest
+
+from source.the_machine.api.client import fetch_images
+from source.the_machine.config import DEFAULT_API_PARAMS
+from source.the_machine.jobs.manifest import DONE, FAILED, PENDING, JobManifest
+
+# With half of the locations lacking imagery, the mock server fails rows 2, 3 and 5
+LOCATIONS = [(round(37.97 + row * 0.001, 3), 23.72) for row in range(8)]
+NOT_FOUND_RATE = 0.5
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "locations.csv"
+    path.write_text("lat,long\n" + "".join(f"{lat},{long}\n" for lat, long in LOCATIONS))
+    return str(path)
+
+
+@pytest.fixture
+def run(tmp_path, input_file, mock_server):
+    mock_server.config.not_found_rate = NOT_FOUND_RATE
+
+    def run(mode, n_addresses):
+        requests_before = mock_server.requests
+        results = fetch_images(
+            input_file,
+            params={**DEFAULT_API_PARAMS, "n_addresses": n_addresses},
+            save_dir=str(tmp_path / "photos"),
+            manual_check=False,
+            use_cache=False,
+            api_url=mock_server.streetview_url,
+            chunk_size=3,
+            mode=mode,
+        )
+        return results, mock_server.requests - requests_before
+
+    return run
+
+
+def manifest_rows(tmp_path):
+    """Returns: dict: (status, filename, sha256, updated_at) of every recorded row."""
+    db = sqlite3.connect(tmp_path / "photos" / "manifest.sqlite")
+    try:
+        return {
+            row: rest
+            for row, *rest in db.execute(
+                "SELECT row, status, filename, sha256, updated_at FROM locations"
+            )
+        }
+    finally:
+        db.close()
+
+
+def statuses(rows):
+    return {row: record[0] for row, record in rows.items()}
+
+
+def test_run_records_every_processed_row(tmp_path, run):
+    results, n_requests = run("run", n_addresses=5)
+
+    assert n_requests == len(results) == 5
+    rows = manifest_rows(tmp_path)
+    assert statuses(rows) == {0: DONE, 1: DONE, 2: FAILED, 3: FAILED, 4: DONE}
+    for status, filename, sha256, _ in rows.values():
+        assert (sha256 is not None) == (status == DONE)
+        assert filename.endswith(".jpg")
+
+
+def test_resume_only_fetches_unfinished_rows(tmp_path, run):
+    run("run", n_addresses=5)
+    before = manifest_rows(tmp_path)
+
+    # Finished rows, failed ones included, count towards the number of addresses
+    results, n_requests = run("resume", n_addresses=7)
+    assert n_requests == len(results) == 2
+    rows = manifest_rows(tmp_path)
+    assert statuses(rows) == {
+        0: DONE, 1: DONE, 2: FAILED, 3: FAILED, 4: DONE, 5: FAILED, 6: DONE
+    }
+    assert {row: rows[row] for row in before} == before
+
+    results, n_requests = run("resume", n_addresses=7)
+    assert (results, n_requests) == ([], 0)
+
+
+def test_rows_left_pending_are_resumed(tmp_path, run):
+    run("run", n_addresses=5)
+    # A run killed after marking its chunk pending but before fetching it
+    manifest = JobManifest(str(tmp_path / "photos" / "manifest.sqlite"))
+    manifest.mark_pending([4], ["37.974,23.72"], ["view_4.jpg"])
+    manifest.close()
+
+    results, n_requests = run("resume", n_addresses=5)
+    assert n_requests == len(results) == 1
+    assert results[0].location == "37.974,23.72"
+    assert PENDING not in statuses(manifest_rows(tmp_path)).values()
+
+
+def test_retry_failed_ignores_n_addresses_and_keeps_done_rows(tmp_path, run, mock_server):
+    run("run", n_addresses=8)
+    before = manifest_rows(tmp_path)
+    failed = [row for row, status in statuses(before).items() if status == FAILED]
+    assert failed == [2, 3, 5]
+    done_files = {
+        filename: (tmp_path / "photos" / filename).stat().st_mtime_ns
+        for status, filename, _, _ in before.values()
+        if status == DONE
+    }
+
+    # The imagery is there now; a single address must not limit the retry
+    mock_server.config.not_found_rate = 0
+    results, n_requests = run("retry-failed", n_addresses=1)
+
+    assert n_requests == len(results) == len(failed)
+    assert {result.status for result in results} == {DONE}
+    rows = manifest_rows(tmp_path)
+    assert set(statuses(rows).values()) == {DONE}
+    for row, record in before.items():
+        if row not in failed:
+            assert rows[row] == record
+    for filename, mtime in done_files.items():
+        assert (tmp_path / "photos" / filename).stat().st_mtime_ns == mtime
+
+    results, n_requests = run("retry-failed", n_addresses=1)
+    assert (results, n_requests) == ([], 0)
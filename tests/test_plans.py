@@ -0,0 +1,115 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from source import agent_plans
+from source.agent_plans import (
+    AgentPlan,
+    PlanCache,
+    PlanStep,
+    plan_from_trace,
+    plan_key,
+    replay_plan,
+)
+
+PLACES = ["37.97,23.72", "37.971,23.72", "37.972,23.72"]  # the last one has no imagery
+CAMERA = {"size": "64x64", "fov": 90, "heading": 0}
+
+
+def tool_span(tool, arguments, output=None):
+    attributes = {
+        "gen_ai.operation.name": "execute_tool",
+        "gen_ai.tool.name": tool,
+        "gen_ai.tool.args": json.dumps(arguments),
+        "gen_ai.output": output,
+    }
+    return SimpleNamespace(attributes=attributes)
+
+
+def batch_plan(places=PLACES):
+    step = PlanStep("get_photos_from_street_view", {"coordinates": places, **CAMERA})
+    return AgentPlan([step], "Here are three photos of Athens.")
+
+
+@pytest.fixture
+def plan_cache(tmp_path, monkeypatch):
+    cache = PlanCache(str(tmp_path / "plans.sqlite"))
+    monkeypatch.setattr(agent_plans, "_plan_cache", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def street_view(street_view):
+    street_view.config.not_found_rate = 0.5
+    return street_view
+
+
+def test_plan_key_ignores_case_and_whitespace_but_not_the_tools():
+    key = plan_key("Explore  Athens", "model", "instructions", use_web=False)
+    assert key == plan_key(" explore athens", "model", "instructions", use_web=False)
+    assert key != plan_key("explore athens", "model", "instructions", use_web=True)
+    assert key != plan_key("explore athens", "other", "instructions", use_web=False)
+
+
+def test_plan_from_trace_keeps_the_street_view_and_geocoding_calls():
+    trace = SimpleNamespace(
+        spans=[
+            SimpleNamespace(attributes={"gen_ai.operation.name": "call_llm"}),
+            tool_span("get_area_details_from_name", {"area_name": "Plaka"}, "[...]"),
+            tool_span("search_web", {"query": "Plaka"}),
+            tool_span("get_photo_from_street_view", {"coordinates": PLACES[0], **CAMERA}),
+            SimpleNamespace(attributes=None),
+        ],
+        final_output="A photo of Plaka.",
+    )
+
+    plan = plan_from_trace(trace)
+    assert [step.tool for step in plan.steps] == [
+        "get_area_details_from_name",
+        "get_photo_from_street_view",
+    ]
+    assert plan.steps[0].output == "[...]"
+    assert plan.steps[1].arguments == {"coordinates": PLACES[0], **CAMERA}
+    assert [step.tool for step in plan.photo_steps] == ["get_photo_from_street_view"]
+    assert plan.final_output == "A photo of Plaka."
+
+
+def test_plans_round_trip_and_expire(tmp_path):
+    cache = PlanCache(str(tmp_path / "plans.sqlite"), ttl=0.05)
+    cache.put("key", "prompt", batch_plan())
+    assert cache.get("key") == batch_plan()
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    cache.close()
+
+
+def test_batch_replay_counts_the_places_that_failed(plan_cache, street_view):
+    result = replay_plan(batch_plan(), key="key")
+
+    assert len(result.paths) == 2
+    assert [error["error"].split(":")[0] for error in result.errors] == [PLACES[2]]
+    # The recorded answer describes three photos, so it is not given
+    assert result.final_output == (
+        "Replayed an earlier run of this prompt: 2 photos fetched, "
+        "1 could not be fetched again."
+    )
+
+    result = replay_plan(batch_plan(PLACES[:2]), key="key")
+    assert result.errors == []
+    assert result.final_output.startswith("Here are three photos of Athens.")
+    assert "Replayed" in result.final_output
+
+
+def test_plan_that_replays_nothing_is_forgotten(plan_cache, street_view):
+    plan = AgentPlan(
+        [PlanStep("get_photo_from_street_view", {"coordinates": PLACES[2], **CAMERA})],
+        "A photo of Athens.",
+    )
+    plan_cache.put("key", "prompt", plan)
+
+    result = replay_plan(plan, key="key")
+    assert result.paths == [] and len(result.errors) == 1
+    assert plan_cache.get("key") is None
@@ -0,0 +1,124 @@
+import io
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from source.the_machine.api import ratelimit
+from source.the_machine.api.ratelimit import (
+    QuotaExceededError,
+    QuotaStore,
+    RateLimiter,
+    _retry_after_seconds,
+)
+
+
+def response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(b"")
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+def responses(*status_codes, retry_after=None):
+    """A `send` function that answers with the given status codes in turn."""
+    answers = iter(status_codes)
+    return lambda: response(next(answers), retry_after)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = QuotaStore(str(tmp_path / "quota.sqlite"))
+    yield store
+    store.close()
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    limiter = RateLimiter("test", rate=20, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.03
+
+    for _ in range(4):
+        limiter.acquire()
+    # Four requests beyond the burst wait for four tokens at 20 per second
+    assert time.monotonic() - start >= 0.19
+    assert limiter.stats()["throttled_seconds"] >= 0.19
+
+
+def test_retry_after_in_seconds_or_as_a_date():
+    assert _retry_after_seconds(response(429, "2.5")) == 2.5
+    assert _retry_after_seconds(response(429, "-1")) == 0.0
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(minutes=1), True)
+    assert 55 < _retry_after_seconds(response(429, in_a_minute)) <= 60
+    assert _retry_after_seconds(response(429, "soon")) is None
+    assert _retry_after_seconds(response(429)) is None
+
+
+def test_retry_after_pauses_until_the_next_attempt():
+    limiter = RateLimiter("test", rate=1000, burst=10)
+    start = time.monotonic()
+    result = limiter.call(responses(429, 503, 200, retry_after="0.1"))
+
+    assert result.status_code == 200
+    assert time.monotonic() - start >= 0.2
+    assert limiter.stats()["retries"] == 2
+
+
+def test_only_successful_attempts_count_against_the_quota():
+    limiter = RateLimiter("test", rate=1000, burst=10, daily_quota=2)
+    assert limiter.call(responses(429, 200, retry_after="0")).status_code == 200
+    assert limiter.call(responses(404)).status_code == 404
+    with pytest.raises(requests.exceptions.ConnectionError):
+        limiter.call(_refuse, max_retries=0)
+    assert limiter.stats()["quota_used"] == 1
+
+    limiter.call(responses(200))
+    with pytest.raises(QuotaExceededError):
+        limiter.call(responses(200))
+    # Requests that are not billable are still sent
+    assert limiter.call(responses(200), billable=False).status_code == 200
+
+
+def _refuse():
+    raise requests.exceptions.ConnectionError("refused")
+
+
+def test_quota_is_shared_and_survives_restarts(tmp_path, store):
+    first = RateLimiter("test", rate=1000, burst=10, daily_quota=3, quota_store=store)
+    other = QuotaStore(str(tmp_path / "quota.sqlite"))
+    second = RateLimiter("test", rate=1000, burst=10, daily_quota=3, quota_store=other)
+
+    first.call(responses(200))
+    second.call(responses(200))
+    other.close()
+    restarted = QuotaStore(str(tmp_path / "quota.sqlite"))
+    third = RateLimiter("test", rate=1000, burst=10, daily_quota=3, quota_store=restarted)
+    third.call(responses(200))
+
+    with pytest.raises(QuotaExceededError):
+        first.call(responses(200))
+    assert third.stats()["quota_used"] == 3
+    # Other upstreams have a quota of their own
+    assert RateLimiter("other", 1000, 10, 3, quota_store=store).call(responses(200)).ok
+    restarted.close()
+
+
+@pytest.mark.parametrize("persisted", [False, True])
+def test_quota_rolls_over_at_midnight(monkeypatch, store, persisted):
+    monkeypatch.setattr(ratelimit, "_today", lambda: "2026-10-17")
+    limiter = RateLimiter(
+        "test", 1000, 10, daily_quota=1, quota_store=store if persisted else None
+    )
+    limiter.call(responses(200))
+    with pytest.raises(QuotaExceededError):
+        limiter.call(responses(200))
+
+    monkeypatch.setattr(ratelimit, "_today", lambda: "2026-10-18")
+    assert limiter.call(responses(200)).ok
+    assert limiter.stats()["quota_used"] == 1
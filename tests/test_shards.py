@@ -0,0 +1,135 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from source.export_shards import main as export_main
+from source.the_machine.storage.shards import _RECORD_HEADER, ShardStore
+
+IMAGES = {f"athens/{n:03d}.jpg": bytes([n]) * (100 + n) for n in range(6)}
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return tmp_path / "store"
+
+
+def fill(store_dir, images=IMAGES, max_shard_bytes=400):
+    with ShardStore(str(store_dir), max_shard_bytes=max_shard_bytes) as store:
+        for key, content in images.items():
+            store.put(key, content, {"size": len(content)})
+
+
+def last_shard(store_dir):
+    return sorted(store_dir.glob("shard-*.bin"))[-1]
+
+
+def test_round_trip_survives_reopen(store_dir):
+    fill(store_dir)
+    with ShardStore(str(store_dir)) as store:
+        assert len(store) == len(IMAGES)
+        assert store.stats()["shards"] > 1
+        for key, content in IMAGES.items():
+            assert bytes(store.get(key)) == content
+            entry = store.entry(key)
+            assert entry.sha256 == hashlib.sha256(content).hexdigest()
+            assert entry.metadata == {"size": len(content)}
+        assert store.get("athens/missing.jpg") is None
+
+
+def test_reads_follow_a_growing_shard_and_outlive_the_store(store_dir):
+    store = ShardStore(str(store_dir))
+    store.put("first.jpg", b"a" * 50)
+    first = store.get("first.jpg")
+    # The shard is mapped now; a later record lies beyond the end of that map
+    store.put("second.jpg", b"b" * 50)
+    second = store.get("second.jpg")
+    store.close()
+    assert (bytes(first), bytes(second)) == (b"a" * 50, b"b" * 50)
+
+
+def test_put_replaces_and_delete_leaves_a_tombstone(store_dir):
+    fill(store_dir)
+    with ShardStore(str(store_dir), max_shard_bytes=400) as store:
+        store.put("athens/000.jpg", b"new")
+        assert store.delete("athens/001.jpg")
+        assert not store.delete("athens/001.jpg")
+
+    with ShardStore(str(store_dir)) as store:
+        assert "athens/001.jpg" not in store
+        # Rebuilding the index from the shards must not bring the deleted image back
+        store.rebuild_index()
+        assert "athens/001.jpg" not in store
+        assert bytes(store.get("athens/000.jpg")) == b"new"
+        assert len(store) == len(IMAGES) - 1
+        for key in set(IMAGES) - {"athens/000.jpg", "athens/001.jpg"}:
+            assert bytes(store.get(key)) == IMAGES[key]
+
+
+def test_records_appended_before_a_crash_are_recovered(store_dir):
+    fill(store_dir)
+    # A writer that crashed after appending the records but before updating the index
+    index = sqlite3.connect(store_dir / "index.sqlite")
+    last = index.execute("SELECT MAX(shard) FROM entries").fetchone()[0]
+    lost = [key for (key,) in index.execute("SELECT key FROM entries WHERE shard = ?", (last,))]
+    index.execute("DELETE FROM entries WHERE shard = ?", (last,))
+    index.commit()
+    index.close()
+
+    with ShardStore(str(store_dir)) as store:
+        assert lost and all(key in store for key in lost)
+        for key, content in IMAGES.items():
+            assert bytes(store.get(key)) == content
+
+
+@pytest.mark.parametrize("tail", [b"SVR1\x05", b"garbage that is not a record"])
+def test_partly_written_last_record_is_cut_off(store_dir, tail):
+    fill(store_dir)
+    shard = last_shard(store_dir)
+    size = shard.stat().st_size
+    with open(shard, "ab") as file:
+        file.write(tail)
+
+    with ShardStore(str(store_dir)) as store:
+        assert shard.stat().st_size == size
+        for key, content in IMAGES.items():
+            assert bytes(store.get(key)) == content
+        # Appending goes on where the last complete record ended
+        entry = store.put("after.jpg", b"after")
+        assert entry.offset == size + _RECORD_HEADER.size + len("after.jpg") + len("{}")
+    with ShardStore(str(store_dir)) as store:
+        assert bytes(store.get("after.jpg")) == b"after"
+
+
+def test_partly_written_record_after_unindexed_records(store_dir):
+    fill(store_dir, max_shard_bytes=10**6)
+    with ShardStore(str(store_dir)) as store:
+        store.put("unindexed.jpg", b"u" * 30)
+    index = sqlite3.connect(store_dir / "index.sqlite")
+    index.execute("DELETE FROM entries WHERE key = 'unindexed.jpg'")
+    index.commit()
+    index.close()
+    with open(last_shard(store_dir), "ab") as file:
+        file.write(b"SVR1")
+
+    with ShardStore(str(store_dir)) as store:
+        assert bytes(store.get("unindexed.jpg")) == b"u" * 30
+        assert len(store) == len(IMAGES) + 1
+
+
+def test_export_writes_the_stored_images(store_dir, tmp_path):
+    fill(store_dir)
+    with ShardStore(str(store_dir)) as store:
+        store.delete("athens/002.jpg")
+        store.rebuild_index()
+        assert store.export(str(tmp_path / "some"), prefix="athens/00") == len(IMAGES) - 1
+
+    export_main(str(store_dir), str(tmp_path / "all"))
+    for key, content in IMAGES.items():
+        exported = tmp_path / "all" / key
+        if key == "athens/002.jpg":
+            assert not exported.exists()
+        else:
+            assert exported.read_bytes() == content
+            assert (tmp_path / "some" / key).read_bytes() == content
+    assert not list((tmp_path / "all").rglob("*.tmp"))
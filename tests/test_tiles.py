@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import pytest
+
+from source.the_machine.api import ratelimit
+from source.the_machine.config import DEFAULT_API_PARAMS, RATE_LIMITS
+from source.the_machine.jobs.manifest import DONE, JobManifest
+from source.the_machine.jobs.orchestrator import (
+    LeaseLost,
+    _fetch_tile,
+    _heartbeat,
+    allocate_locations,
+    plan_tiles,
+    run_worker,
+)
+from source.the_machine.jobs.tiles import (
+    TILE_DONE,
+    TILE_FAILED,
+    TILE_LEASED,
+    TILE_PENDING,
+    TileQueue,
+)
+
+# About 1.5 x 2 km of Athens, covering a few geohash tiles of precision 6
+LOCATION_PARAMS = {
+    "min_lat": 37970000,
+    "max_lat": 37985000,
+    "min_lon": 23720000,
+    "max_lon": 23745000,
+    "method": "halton",
+    "n_locs": 40,
+    "min_distance": 20,
+    "seed": 42,
+}
+API_PARAMS = {
+    name: value for name, value in DEFAULT_API_PARAMS.items() if name != "n_addresses"
+}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TileQueue(str(tmp_path / "tiles.sqlite"), max_attempts=2)
+    queue.add(["swbbh0"])
+    yield queue
+    queue.close()
+
+
+def expire(seconds=0.01):
+    time.sleep(seconds * 2)
+
+
+def test_expired_lease_is_taken_over(queue):
+    first = queue.claim("first", lease_seconds=0.01)
+    assert queue.claim("second") is None
+    expire()
+
+    second = queue.claim("second")
+    assert (second.geohash, second.attempt) == ("swbbh0", 2)
+    assert queue.counts() == {TILE_LEASED: 1}
+    # The first worker finds out at its next heartbeat, and its report is ignored
+    assert not queue.renew(first)
+    assert not queue.complete(first, n_done=3)
+    assert queue.complete(second, n_done=5)
+    assert queue.counts() == {TILE_DONE: 1}
+
+
+def test_tile_is_abandoned_after_max_attempts(queue):
+    queue.claim("first", lease_seconds=0.01)
+    expire()
+    queue.claim("second", lease_seconds=0.01)
+    expire()
+
+    assert queue.claim("third") is None
+    assert queue.counts() == {TILE_FAILED: 1}
+    assert queue.is_finished()
+
+
+def test_release_worker_hands_tiles_out_right_away(queue):
+    queue.claim("dead")
+    assert queue.release_worker("dead") == 1
+    assert queue.counts() == {TILE_PENDING: 1}
+
+
+def test_heartbeat_flags_lost_lease(queue):
+    lease = queue.claim("first")
+    queue.release_worker("first")
+    queue.claim("second")
+
+    stop, lost = threading.Event(), threading.Event()
+    _heartbeat(queue.path, lease, 0.03, stop, lost)
+    assert lost.is_set()
+
+
+def test_allocation_adds_up_and_allows_empty_tiles():
+    for precision in (5, 6, 7):
+        allocation = allocate_locations(LOCATION_PARAMS, precision)
+        assert set(allocation) == set(plan_tiles(LOCATION_PARAMS, precision))
+        assert sum(allocation.values()) == LOCATION_PARAMS["n_locs"]
+    assert 0 in allocate_locations(LOCATION_PARAMS, 7).values()
+
+
+def _manifest_counts(tile_dir):
+    manifest = JobManifest(os.path.join(tile_dir, "manifest.sqlite"))
+    try:
+        return manifest.counts()
+    finally:
+        manifest.close()
+
+
+def test_lost_lease_stops_tile_and_tile_resumes_from_manifest(tmp_path, mock_server):
+    settings = {"location_params": LOCATION_PARAMS, "api_params": API_PARAMS}
+    fetch_options = {"workers": 1, "use_cache": False, "api_url": mock_server.streetview_url}
+    allocation = allocate_locations(LOCATION_PARAMS, 6)
+    tile = max(allocation, key=allocation.get)
+    queue = TileQueue(str(tmp_path / "tiles.sqlite"))
+    queue.add([tile])
+
+    # The lease is lost while the first locations are fetched
+    first = queue.claim("first")
+    lost = threading.Event()
+    lost.set()
+    with pytest.raises(LeaseLost):
+        _fetch_tile(first, settings, str(tmp_path), lost, fetch_options)
+    n_fetched = _manifest_counts(tmp_path / tile).get(DONE, 0)
+    assert 0 < n_fetched < allocation[tile]
+
+    # Another worker takes the tile over and only fetches what is left
+    queue.release_worker("first")
+    second = queue.claim("second")
+    requests_before = mock_server.requests
+    counts = _fetch_tile(second, settings, str(tmp_path), threading.Event(), fetch_options)
+    # Without n_addresses in the API parameters, every location of the tile is fetched
+    assert counts == {DONE: allocation[tile]}
+    assert mock_server.requests - requests_before == allocation[tile] - n_fetched
+    queue.close()
+
+
+def test_worker_uses_its_share_of_the_rate_limit(queue, credentials, monkeypatch):
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+    queue.set_settings(location_params=LOCATION_PARAMS, api_params=API_PARAMS)
+    queue.complete(queue.claim("first"), n_done=1)
+
+    assert run_worker(queue.path, worker="second", rate_share=0.25) == 0
+    limiter = ratelimit.get_limiter("streetview")
+    assert limiter.rate == RATE_LIMITS["streetview"]["rate"] / 4
+    assert limiter.burst == RATE_LIMITS["streetview"]["burst"] // 4